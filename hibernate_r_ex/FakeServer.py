@@ -1,245 +1,1210 @@
+import asyncio
 import json
 import os.path
 import base64
 import uuid
+import socket
+import time
 import traceback
+import threading
+from collections import OrderedDict
 
 from mcdreforged.api.all import *
 
 from .byte_utils import *
 from .config import get_config
+from .proxy import *
+from .admission import AdmissionControl
+from .banlist import IPBanList, PlayerBanList
+from .online_auth import OnlineAuth, AuthError, SignedResponseError, EncryptedSocket
+from .packet_log import *
+from .metrics import metrics
+from .workers import WorkerPool, WorkerChannel, WorkerServer, Forwarding, MetricsReporter, renew_locks, reuse_port_available
+
+
+STATUS_CACHE_SIZE = 16  # 最多缓存的协议版本数
+FS_MAX_PACKET_SIZE = 32767  # 伪装服务器只处理握手、状态和登录开始，不接受更大的数据包
+LISTENER_CONFIG_KEYS = ("ip", "port", "listener_mode", "proxy_mode")  # 只在监听启动时读取的配置
+ACCEPT_POLL_SEC = 1  # 单线程模式下accept的超时，交接监听socket时不能shutdown，靠超时检查关闭标签
 
 
 class FakeServerSocket:
     def __init__(self, server: PluginServerInterface):
         self.config = get_config()
         self.fs_icon = None
-        self.server_socket = None
+        self.server_socket = None  # 监听socket，从start到stop一直由插件持有(多进程模式下只占用端口)，插件重载时交给新模块
         self.fs_is_running = False
         self.fs_stop = False
+        self._stopped = threading.Event()  # 监听已完全关闭
+        self._stopped.set()
+        self._detaching = False  # 停止监听但保留监听socket
+        self._mode = None  # 当前监听使用的模式
+        self._client_socket = None  # 单线程模式下正在处理的连接
+        self._async_loop = None  # asyncio模式下的事件循环
+        self._async_stop = None
+        self._async_tasks = set()
+        self._async_relays = set()  # 正在转发的任务，插件重载时不取消
+        self._async_result = None
+        self._async_backend_ready = None
+        self._workers = None  # 多进程模式下的工作进程池
+        self._reuse_port = False  # 工作进程中用SO_REUSEPORT与其他工作进程绑定同一端口
+        
+        # 代理模式：收到登录请求后保持连接，等后端服务器启动完成再转发
+        self._start_server = None
+        self._backend_ready = threading.Event()
+        self._wake_requested = False
+        self._proxy_sockets = set()  # 正在等待或转发的socket，关闭时统一断开
+        self._relay_sockets = set()  # 其中已开始转发的socket，插件重载时不断开
+        self.wake_guard = None  # 拒绝多次空唤醒的玩家名/IP，由插件设置
+        self.player_rule = None  # 判断玩家名能否唤醒服务器，由插件设置为计时器的黑名单/白名单规则
+        
+        # 准入控制：每IP频率限制和并发连接上限
+        self.admission = AdmissionControl(self.config.fs_ip_rate_per_min, self.config.fs_ip_burst,
+                                          self.config.fs_max_connections)
+        # IP封禁：服务器的banned-ips.json和插件的banned_ips，接受连接时和唤醒前检查
+        self.ip_bans = IPBanList(self.config.server_banned_ips, self.config.banned_ips, server.logger)
+        self.player_bans = PlayerBanList(self.config.server_banned_players, server.logger)
+        # 在线验证：加密握手在连接中完成，查询会话服务器交给单独的线程
+        self.auth = None
+        self._configure_auth(server)
+        
+        # 连接日志：按连接采样输出汇总，可选的最近原始数据抓包环
+        self.log_sampler = LogSampler(self.config.fs_log_sample)
+        self.capture = PacketCapture(self.config.fs_capture_size) if self.config.fs_capture_size > 0 else None
         
-        if not os.path.exists(self.config.server_icon):
+        # 指标：请求计数、连接耗时和代理等待时间，准入控制的计数直接通过回调暴露
+        for name in self.admission.counters:
+            metrics.counter("hr_fs_connections_total", "伪装服务器连接数", {"result": name},
+                            func=lambda name=name: self.admission.counters[name])
+        metrics.gauge("hr_fs_active_connections", "伪装服务器正在处理的连接数", func=lambda: self.admission.active)
+        self._m_requests = {kind: metrics.counter("hr_fs_requests_total", "伪装服务器处理的请求数", {"type": kind})
+                            for kind in ("status", "ping", "legacy_ping", "login", "invalid")}
+        self._m_login_rejected = {reason: metrics.counter("hr_fs_login_rejected_total", "伪装服务器拒绝唤醒的登录请求数", {"reason": reason})
+                                  for reason in ("ip_ban", "player_ban", "name_rule", "online_auth")}
+        self._m_auth = {result: metrics.counter("hr_online_auth_total", "在线验证次数", {"result": result})
+                        for result in ("ok", "cached", "failed", "error")}
+        self._m_session_time = metrics.histogram("hr_session_query_seconds", "查询会话服务器的耗时")
+        self._m_connection_time = metrics.histogram("hr_fs_connection_seconds", "伪装服务器连接处理耗时")
+        self._m_proxy_wait = metrics.histogram("hr_proxy_wait_seconds", "代理模式等待服务器就绪的时间")
+        self._m_proxy_bytes = {direction: metrics.counter("hr_proxy_bytes_total", "代理转发字节数", {"direction": direction})
+                               for direction in ("upstream", "downstream")}
+        
+        # 预编码的状态响应缓存，按客户端协议版本存放完整的数据包(含长度前缀)
+        self._status_lock = threading.Lock()
+        self._status_cache = OrderedDict()
+        self._status_stamp = None
+        self._status_template = None
+        self._boot_template = None  # 启动阶段的状态响应模板，不为None时代替_status_template
+        self._boot_progress = None
+        self.booting = False  # 服务器启动中，伪装服务器仍在监听
+        self.refresh_status(server)
+        
+        server.logger.info("伪装服务器初始化完成")
+    
+    def _status_source_stamp(self):
+        """配置对象与图标修改时间，任一变化则缓存失效"""
+        config = get_config()
+        try:
+            icon_mtime = os.stat(config.server_icon).st_mtime_ns
+        except OSError:
+            icon_mtime = None
+        return id(config), icon_mtime
+    
+    def refresh_status(self, server: PluginServerInterface):
+        """检查配置和图标，如有变化则重建状态模板并清空缓存，返回是否重建"""
+        stamp = self._status_source_stamp()
+        if stamp == self._status_stamp:
+            return False
+        
+        # 先在局部变量中构建，最后在锁内一次性换入，处理中的请求不会看到一半新一半旧的数据
+        config = get_config()
+        fs_icon = None
+        if stamp[1] is None:
             server.logger.warning("未找到服务器图标，设置为None")
         else:
-            with open(self.config.server_icon, 'rb') as image:
-                self.fs_icon = "data:image/png;base64," + base64.b64encode(image.read()).decode()
-        
-        self.motd = {
-            "version": {"name": self.config.version_text, "protocol": self.config.protocol},
-            "players": {"max": len(self.config.samples), "online": len(self.config.samples),
-                        "sample": [{"name": sample, "id": str(uuid.uuid4())} for sample in self.config.samples]},
-            "description": {"text": self.config.motd}
+            with open(config.server_icon, 'rb') as image:
+                fs_icon = "data:image/png;base64," + base64.b64encode(image.read()).decode()
+        
+        template = {
+            "version": {"name": config.version_text, "protocol": config.protocol},
+            "players": {"max": len(config.samples), "online": len(config.samples),
+                        "sample": [{"name": sample, "id": str(uuid.uuid4())} for sample in config.samples]},
+            "description": {"text": config.motd}
         }
-        if self.fs_icon and len(self.fs_icon) > 0:
-            self.motd["favicon"] = self.fs_icon
+        if fs_icon and len(fs_icon) > 0:
+            template["favicon"] = fs_icon
         
-        self.motd = json.dumps(self.motd)
+        with self._status_lock:
+            self.config = config
+            self.fs_icon = fs_icon
+            self._status_template = template
+            if self.booting:
+                self._boot_template = self._build_boot_template(self._boot_progress)
+            self._status_cache.clear()
+            self._status_stamp = stamp
+        if self._workers is not None:  # 工作进程持有的是fork时的状态，换一组新的
+            self._workers.request_refresh()
+        return True
+    
+    def reload_config(self, server: PluginServerInterface):
+        """配置重载：换入新的状态响应、准入参数和日志设置，监听socket和正在处理的连接不受影响"""
+        old = self.config
+        self.refresh_status(server)
+        new = self.config
+        self.admission.configure(new.fs_ip_rate_per_min, new.fs_ip_burst, new.fs_max_connections)
+        self.ip_bans.configure(new.server_banned_ips, new.banned_ips)
+        self.player_bans.configure(new.server_banned_players)
+        self._configure_auth(server)
+        if new.fs_log_sample != old.fs_log_sample:
+            self.log_sampler = LogSampler(new.fs_log_sample)
+        if new.fs_capture_size != old.fs_capture_size:
+            self.capture = PacketCapture(new.fs_capture_size) if new.fs_capture_size > 0 else None
+        if self.fs_is_running and any(getattr(old, key) != getattr(new, key) for key in LISTENER_CONFIG_KEYS):
+            server.logger.warning("监听地址、监听模式和代理模式的修改将在伪装服务器下次启动时生效")
+    
+    def _configure_auth(self, server: PluginServerInterface):
+        """按配置开启或关闭在线验证，缺少cryptography或会话服务器地址无效时保持关闭"""
+        if not self.config.online_auth:
+            if self.auth is not None:
+                self.auth.close()
+            self.auth = None
+            return
+        try:
+            if self.auth is None:
+                self.auth = OnlineAuth(self.config)
+            else:
+                self.auth.configure(self.config)
+        except (AuthError, ValueError) as e:
+            server.logger.error(f"无法开启在线验证: {e}")
+            self.auth = None
+    
+    def export_status(self):
+        """插件重载时交给新模块的状态模板和已编码的数据包，启动阶段的临时响应不交接"""
+        with self._status_lock:
+            if self.booting:
+                return None
+            return self._status_template, dict(self._status_cache)
+    
+    def adopt_status(self, status):
+        """沿用重载前的状态响应：模板除示例玩家的随机UUID外相同时换入旧模板和数据包，客户端看到的状态不变，返回是否沿用"""
+        if status is None:
+            return False
+        template, cache = status
+        with self._status_lock:
+            if self.booting or _without_sample_ids(template) != _without_sample_ids(self._status_template):
+                return False
+            self._status_template = template
+            self._status_cache = OrderedDict(cache)
+        return True
+    
+    def get_status_packet(self, protocol):
+        """返回对应客户端协议版本的完整状态响应数据包，命中缓存时不做任何编码"""
+        if not self.config.follow_client_protocol:
+            protocol = self.config.protocol  # 不跟随客户端时所有版本共用一个响应
+        packet = self._status_cache.get(protocol)
+        if packet is not None:
+            return packet
         
-        server.logger.info("伪装服务器初始化完成")
+        with self._status_lock:
+            template = dict(self._boot_template or self._status_template)
+            template["version"] = {"name": template["version"]["name"], "protocol": protocol}
+            packet = build_str_response(0x00, json.dumps(template))
+            self._status_cache[protocol] = packet
+            while len(self._status_cache) > STATUS_CACHE_SIZE:
+                self._status_cache.popitem(last=False)  # 淘汰最早加入的版本
+        return packet
     
-    @new_thread
-    def start(self, server: PluginServerInterface, start_server):
+    def _build_boot_template(self, progress):
+        """在状态模板的基础上替换为启动中的MOTD和版本名，在_status_lock内调用"""
+        template = dict(self._status_template)
+        template["version"] = {"name": self.config.boot_version_text, "protocol": self.config.protocol}
+        template["description"] = {"text": self.config.boot_motd.replace("{progress}", progress)}
+        return template
+    
+    def enter_boot(self, server: PluginServerInterface):
+        """服务器开始启动，伪装服务器仍在监听时改为回复启动中的状态，返回是否是本次进入"""
+        if not self.config.boot_status or not self.fs_is_running:
+            return False
+        with self._status_lock:
+            if self.booting:
+                return False
+            self.booting = True
+            self._boot_progress = "正在启动"
+            self._boot_template = self._build_boot_template(self._boot_progress)
+            self._status_cache.clear()
+        server.logger.info("服务器启动期间伪装服务器继续响应状态请求")
+        self._notify_workers(("boot", self._boot_progress))
+        return True
+    
+    def set_boot_progress(self, progress):
+        """更新启动进度，只有进度变化时才重建状态响应，每次请求仍直接发送缓存的数据包"""
+        with self._status_lock:
+            if not self.booting or progress == self._boot_progress:
+                return False
+            self._boot_progress = progress
+            self._boot_template = self._build_boot_template(progress)
+            self._status_cache.clear()
+        self._notify_workers(("boot", progress))
+        return True
+    
+    def end_boot(self):
+        """启动结束或失败，恢复休眠时的状态响应"""
+        with self._status_lock:
+            if not self.booting:
+                return
+            self.booting = False
+            self._boot_template = None
+            self._status_cache.clear()
+        self._notify_workers(("boot_end",))
+    
+    def _notify_workers(self, message):
+        pool = self._workers
+        if pool is not None:
+            pool.broadcast(message)
+    
+    def begin_boot(self, server: PluginServerInterface):
+        """非代理模式下唤醒服务器但不关闭伪装服务器，等服务器即将绑定端口时再释放"""
+        if self.enter_boot(server):
+            self._start_server(server)
+    
+    def release_port(self, server: PluginServerInterface):
+        """服务器即将绑定端口，关闭伪装服务器释放端口(代理模式下监听的不是服务器端口，无需释放)"""
+        if self.booting and not self.config.proxy_mode:
+            server.logger.info("服务器即将绑定端口，伪装服务器释放端口")
+            self.stop(server)
+    
+    def start(self, server: PluginServerInterface, start_server, listener=None):
+        """
+        启动伪装服务器，检查、绑定端口和设置标签在调用线程中完成，监听在单独的线程中运行，返回是否启动
+        listener为插件重载前的模块交接的监听socket，地址与配置一致时直接沿用，端口不会有无人监听的间隙
+        start/stop应只由插件的生命周期线程调用，保证同一时间只有一个监听
+        """
         # 检查伪装服务器是否在运行
         if self.fs_is_running:  # 已经启动了，返回
             server.logger.info("伪装服务器正在运行")
-            return
+            if listener is not None:  # 交接的监听socket用不上，释放端口
+                listener.close()
+            return False
         
-        # 检查服务器是否在运行
-        if server.is_server_running() or server.is_server_startup():
+        # 检查服务器是否在运行，代理模式下服务器运行期间也需要监听并转发
+        if not self.config.proxy_mode and (server.is_server_running() or server.is_server_startup()):
             server.logger.info("服务器正在运行,请勿启动伪装服务器!")
-            return
+            if listener is not None:  # 交接的监听socket用不上，释放端口
+                listener.close()
+            return False
+        
+        self._mode = self.config.listener_mode
+        if self._mode == "process" and (self.config.proxy_mode or not reuse_port_available()):
+            server.logger.warning("代理模式或当前系统(需要fork和SO_REUSEPORT)不支持多进程监听，改用asyncio模式")
+            self._mode = "asyncio"
+        
+        # 绑定监听socket
+        self.server_socket = self._open_listener(server, listener)
+        if self.server_socket is None:
+            return False
         
         # 设置标签
+        self._stopped.clear()
         self.fs_is_running = True
+        self._start_server = start_server
+        self.refresh_status(server)  # 配置或图标有变化时重建状态响应
         server.logger.info("伪装服务器已启动")
+        self._listen(server)
+        return True
+    
+    def _open_listener(self, server: PluginServerInterface, listener):
+        """
+        沿用交接的监听socket或绑定新的，失败时返回None
+        多进程模式下工作进程各自用SO_REUSEPORT绑定监听，插件进程的socket只绑定占用端口，交接时才开始监听
+        """
+        reuse_port = self._mode == "process"
+        if listener is not None:
+            ip, port = listener.getsockname()[:2]
+            if port != self.config.port or ip != (self.config.ip or "0.0.0.0"):
+                server.logger.info("监听地址已修改，关闭重载前的监听socket")
+                listener.close()
+            elif reuse_port and not listener.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT):
+                server.logger.info("重载前的监听socket未设置SO_REUSEPORT，无法与工作进程共用端口，重新绑定")
+                listener.close()
+            else:
+                server.logger.info(f"沿用重载前的监听socket {ip}:{port}")
+                return listener
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+            if reuse_port:
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
+            listener.bind((self.config.ip, self.config.port))
+            if not reuse_port:
+                listener.listen(32)  # 最大允许连接数
+        except Exception as e:
+            server.logger.error(f"伪装服务器启动失败: {e}")
+            listener.close()
+            return None
+        return listener
+    
+    @new_thread
+    def _listen(self, server: PluginServerInterface):
+        if self._mode == "process":
+            result = self._serve_workers(server)
+        elif self._mode == "asyncio":
+            result = asyncio.run(self._serve_async(server))
+        else:
+            result = self._serve_thread(server)
+        
+        # 设置退出状态
+        booted = self.booting  # 启动阶段的监听：服务器已经在启动中
+        self.end_boot()
+        if not self._detaching:  # 交接时监听socket由detach交给新模块
+            self.server_socket.close()
+        self.server_socket = None
+        self._detaching = False
+        self.fs_stop = False
+        self.fs_is_running = False
+        self._stopped.set()  # 通知stop端口已释放
+        
+        server.logger.info("伪装服务器已退出")
         
-        # FS创建部分
+        # 收到连接消息，请求开启服务器后退出
+        if result == "login_request" and not booted:
+            self._start_server(server)
+    
+    def _serve_thread(self, server: PluginServerInterface):
+        """单线程模式：逐个accept并处理连接"""
         result = None
+        self.server_socket.settimeout(ACCEPT_POLL_SEC)
         while True:
-            try:
-                self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-                self.server_socket.bind((self.config.ip, self.config.port))
-                self.server_socket.settimeout(5)  # 5s超时
-            except Exception as e:
-                server.logger.error(f"伪装服务器启动失败: {e}")
-                self.server_socket.close()
-                break  # 无法完成创建，退出
-            
             # FS监听部分
             try:
-                self.server_socket.listen(32)  # 最大允许连接数
                 while not self.fs_stop:
                     try:
-                        client_socket, client_address = self.server_socket.accept()
-                        server.logger.info(f"收到来自{client_address[0]}:{client_address[1]}的连接")
-                        result = self.handle_packet(server, client_socket)
+                        client_socket, client_address = self.server_socket.accept()  # stop时通过shutdown唤醒
+                        if self.config.proxy_mode and self._backend_ready.is_set():
+                            self._proxy_thread(server, client_socket, None)  # 服务器已就绪，直接转发
+                            continue
+                        self._client_socket = client_socket
+                        result = self.handle_packet(server, client_socket, client_address)
+                        self._client_socket = None
                     except socket.timeout:
-                        server.logger.debug("连接超时")  # 此处超时处理accept
-                        continue  # 重试
-            except Exception as e:
+                        continue  # 此处超时处理accept，检查关闭标签后重试
+            except Exception:
+                if self.fs_stop:  # stop关闭了监听socket
+                    break
                 server.logger.error(f"发生其它错误: {traceback.format_exc()}")
                 continue  # 重试
             break  # 此while true只是用于方便break处理错误
         
-        # 关闭socket
-        self.server_socket.close()
+        return result
+    
+    def _serve_workers(self, server: PluginServerInterface):
+        """多进程模式：工作进程负责监听，本线程转发它们的日志、唤醒请求和指标"""
+        self.get_status_packet(self.config.protocol)  # fork前预编码，工作进程直接发送缓存的数据包
+        pool = WorkerPool(self, server, self.config.fs_workers or os.cpu_count() or 1)
+        self._workers = pool
+        try:
+            if self.fs_stop:  # 启动期间已被要求关闭
+                return None
+            return pool.run()
+        finally:
+            self._workers = None
+    
+    def _run_worker(self, conn, pool):
+        """工作进程入口(fork后在子进程中执行)：在asyncio模式下监听，需要插件进程处理的事件通过管道发送"""
+        pool.detach_in_child()
+        metrics.renew_lock()
+        self._status_lock = threading.Lock()
+        renew_locks(self.admission, self.log_sampler, self.wake_guard, self.auth)
+        channel = WorkerChannel(conn)
+        server = WorkerServer(channel)
+        self._workers = None
+        self._reuse_port = True
+        self._start_server = lambda _server: channel.send(("wake",))
+        self.begin_boot = lambda _server: self._worker_begin_boot(channel)
+        if self.wake_guard is not None:  # 空唤醒记录在插件进程中
+            self.wake_guard = Forwarding(self.wake_guard, channel, "wake_guard", ("record_wake",))
+        if self.auth is not None:  # 验证结果缓存到插件进程，之后的工作进程继承
+            self.auth = Forwarding(self.auth, channel, "auth", ("remember",))
+        self.capture = None  # 抓包只在插件进程中进行
+        reporter = MetricsReporter(channel, self.admission)
+        threading.Thread(target=self._worker_commands, args=(conn,), daemon=True).start()
+        result = asyncio.run(self._serve_async(server))
+        if result == "login_request":
+            channel.send(("wake",))
+        reporter.close()
+        channel.send(("exit", result))
+    
+    def _worker_begin_boot(self, channel):
+        """工作进程中代替begin_boot：先在本进程进入启动阶段，收到登录请求的连接不会让工作进程退出，再由插件进程通知所有工作进程"""
+        self.enter_boot(WorkerServer(None))
+        channel.send(("wake",))
+    
+    def _worker_commands(self, conn):
+        """工作进程中接收插件进程的命令：启动进度和关闭"""
+        quiet = WorkerServer(None)  # 插件进程已输出过的日志不再重复
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):  # 插件进程已退出
+                message = ("stop",)
+            if message[0] == "stop":
+                self.fs_stop = True
+                self._call_in_loop(lambda: self._async_stop.set())
+                return
+            if message[0] == "boot":
+                self.enter_boot(quiet)
+                self.set_boot_progress(message[1])
+            elif message[0] == "boot_end":
+                self.end_boot()
+    
+    async def _serve_async(self, server: PluginServerInterface):
+        """asyncio模式：每个连接作为独立任务并发处理，stop时统一取消"""
+        self._async_loop = asyncio.get_running_loop()
+        self._async_stop = asyncio.Event()
+        self._async_tasks = set()
+        self._async_relays = set()
+        self._async_result = None
+        self._async_backend_ready = asyncio.Event()
+        if self._backend_ready.is_set():
+            self._async_backend_ready.set()
         
-        # 设置退出状态
-        self.server_socket = None
-        self.fs_stop = False
-        self.fs_is_running = False
+        handler = lambda reader, writer: self._handle_async_client(server, reader, writer)
+        listeners = []
+        try:
+            if self._reuse_port:  # 工作进程：各自用SO_REUSEPORT绑定同一端口，由内核分配连接
+                listeners.append(await asyncio.start_server(handler, self.config.ip, self.config.port, backlog=32,
+                                                            reuse_address=True, reuse_port=True))
+            if not self._reuse_port or _is_listening(self.server_socket):  # 重载时交接的socket已在监听，同样要处理
+                # asyncio关闭时会关闭传入的socket，传入副本，监听socket本身由start/stop管理
+                listeners.append(await asyncio.start_server(handler, sock=self.server_socket.dup(), backlog=32))
+        except Exception as e:
+            server.logger.error(f"伪装服务器启动失败: {e}")
+            for listener in listeners:
+                listener.close()
+            self._async_loop = None
+            return None
         
-        server.logger.info("伪装服务器已退出")
+        if self.fs_stop:  # 启动期间已被要求关闭
+            self._async_stop.set()
+        await self._async_stop.wait()
         
-        # 收到连接消息，开启服务器后退出
-        if result == "login_request":
-            start_server(server)
+        # 关闭监听并取消所有正在处理的连接，插件重载时转发中的连接除外
+        for listener in listeners:
+            listener.close()
+        relays = set(self._async_relays) if self._detaching else set()
+        tasks = self._async_tasks - relays
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if relays:  # 监听已停止，detach可以交出监听socket，转发留在此事件循环中直到玩家断开
+            self._stopped.set()
+            server.logger.info(f"{len(relays)}个转发中的代理连接将继续转发直到断开")
+            await asyncio.gather(*relays, return_exceptions=True)
+        for listener in listeners:
+            await listener.wait_closed()
+        self._async_loop = None
+        return self._async_result
     
-    def handle_packet(self, server: PluginServerInterface, client_socket):
-        result = None
-        binding = False
-        while not self.fs_stop:
-            try:
-                # https://minecraft.wiki/w/Java_Edition_protocol#Handshaking
-                head = read_exactly(client_socket, 1, timeout=5)[0]
-                server.logger.info(f"收到数据：[1]>[{hex(head)}]\"{head}\"")
-                # https://minecraft.wiki/w/Minecraft_Wiki:Projects/wiki.vg_merge/Server_List_Ping#1.6
-                if head == 0xFE:  # 1.6兼容协议，FE开头，强制匹配识别
-                    # 确认后两个是 01和fa
-                    next2 = read_exactly(client_socket, 2, timeout=5)
-                    server.logger.info(f"收到数据：[2]>[{format_hex(next2)}]\"{next2}\"")
-                    if next2[0] != 0x01 or next2[1] != 0xFA:
-                        server.logger.warning("收到了意外的数据包")
-                        break  # 剩下直接丢弃并断开连接
-                    else:
-                        server.logger.info("伪装服务器收到了一次1.6-ping")
-                        server.logger.info("发送空响应")
-                        # 以踢出数据包响应客户端，长度直接设为0，不给出任何信息
-                        client_socket.sendall(bytes([0xFF, 0x00, 0x00]))
-                    break
-                elif head == 0x01:  # binding
-                    next1 = read_exactly(client_socket, 1, timeout=5)[0]
-                    server.logger.info(f"收到数据：[1]>[{hex(next1)}]\"{next1}\"")
-                    if next1 == 0x00 and not binding:
-                        server.logger.info("伪装服务器收到了binding")
-                        if result == "status_request":
-                            server.logger.info("发送motd")
-                            # 使用新的响应函数发送motd
-                            write_str_response(client_socket, 0x00, self.motd)
-                            binding = True  # 已绑定，防止重复绑定
-                            continue  # 处理一次ping和pong
+    async def _handle_async_client(self, server: PluginServerInterface, reader, writer):
+        task = asyncio.current_task()
+        self._async_tasks.add(task)
+        try:
+            if self.config.proxy_mode and self._backend_ready.is_set():
+                await self._proxy_async(server, reader, writer, None)  # 服务器已就绪，直接转发
+                return
+            result = await self.handle_packet_async(server, reader, writer)
+            if result == "login_request" and not self.booting:  # 启动阶段继续监听
+                self._async_result = result
+                self._async_stop.set()  # 收到登录请求，关闭伪装服务器
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            server.logger.error(f"发生其它错误: {traceback.format_exc()}")
+        finally:
+            self._async_tasks.discard(task)
+            writer.close()
+    
+    def handle_packet(self, server: PluginServerInterface, client_socket, client_address):
+        """单线程模式下处理一个连接，数据直接recv_into到分帧器的缓冲区"""
+        conn = self._new_connection(client_socket, client_address)
+        if not self._admit(server, conn, client_address[0]):
+            client_socket.close()
+            return None
+        try:
+            while not self.fs_stop:
+                buffer = conn.framer.recv_buffer()
+                client_socket.settimeout(self._next_read_timeout(conn))
+                n = client_socket.recv_into(buffer)
+                if n == 0:
+                    raise ConnectionError("连接已关闭")
+                conn.framer.commit(n)
+                conn.received += n
+                if self.capture is not None:
+                    self.capture.add(conn.address, buffer[:n])
+                if self.config.proxy_mode:
+                    conn.replay += buffer[:n]  # 保存原始数据，转发时重放给服务器
+                if not self.handle_frames(server, conn):
                     break
-                
-                data = read_exactly(client_socket, head, timeout=5)  # head当作length
-                server.logger.info(f"收到数据：[{len(data)}]>[{format_hex(data)}]\"{data}\"")
-                
-                # 使用BytesReader解析数据
-                reader = BytesReader(data)
-                packet_id = reader.read_byte()
-                
-                if packet_id == 0x00:
-                    result = self.handle_handshaking(client_socket, reader, server, result)
-                    if result == "unknown_request":  # 未知请求则跳出断开连接
-                        break
-                    continue  # 重试
-                elif packet_id == 0x01:
-                    self.handle_ping(client_socket, reader, server)
-                    break  # 断开连接
-                else:
-                    server.logger.warning("伪装服务器收到了意外的数据包")
-                break  # 此while
-            except BytesReaderError as e:
-                server.logger.warning(f"伪装服务器解析数据出错: {e}")
-                break  # 此while
-            except TypeError as e:
-                server.logger.warning(f"伪装服务器收到了无效数据[{e}]")
-                break  # 此while
-            except IndexError as e:
-                server.logger.warning(f"伪装服务器收到了无效数据[{e}]")
-                break  # 此while
-            except ConnectionError:
-                server.logger.warning("客户端提前断开连接")
-                break  # 此while
-            except socket.timeout:
-                # server.logger.debug("连接超时")#此处超时处理read_exactly
-                break  # 此while
+        except ConnectionError:
+            conn.note("客户端提前断开")
+        except socket.timeout:
+            self._count_timeout(server, conn)  # 此处超时处理recv
+        
+        if self.config.proxy_mode and conn.result == "login_request":
+            self._finish_connection(server, conn, "转交代理")
+            self._proxy_thread(server, client_socket, conn)  # 交给代理线程等待服务器启动
+            return None
+        if conn.result == "auth_request":
+            self._auth_thread(server, client_socket, conn)  # 交给验证线程查询会话服务器，监听继续处理其他连接
+            return None
+        
         # 关闭退出
+        self._release(conn)
         client_socket.close()
-        server.logger.info("断开链接")
-        return result
+        self._finish_connection(server, conn, "断开")
+        return conn.result
     
-    def handle_handshaking(self, client_socket, reader: BytesReader, server: PluginServerInterface, result):
-        if result == "login_request":  # 链接请求，响应踢出消息，然后关闭伪服务端并启动服务器
-            # https://minecraft.wiki/w/Java_Edition_protocol#Login_Start
-            # 不读取，忽略信息(2字节玩家名长度，然后是玩家名，接着是其他数据(uuid))
-            # 使用新的响应函数发送踢出消息
-            write_str_response(client_socket, 0x00, json.dumps({"text": self.config.kick_message}))
-            self.fs_stop = True  # 提醒服务器应该关闭
-            return "login_request"
+    async def handle_packet_async(self, server: PluginServerInterface, reader, writer):
+        """asyncio模式下处理一个连接，协议处理与handle_packet共用handle_frames"""
+        client_address = writer.get_extra_info('peername')
+        conn = self._new_connection(_AsyncClientSocket(writer), client_address)
+        if not self._admit(server, conn, client_address[0]):
+            return None
+        try:
+            while not self.fs_stop:
+                data = await asyncio.wait_for(reader.read(RECV_BUFFER_SIZE), self._next_read_timeout(conn))
+                if not data:
+                    raise ConnectionError("连接已关闭")
+                conn.framer.feed(data)
+                conn.received += len(data)
+                if self.capture is not None:
+                    self.capture.add(conn.address, data)
+                if self.config.proxy_mode:
+                    conn.replay += data
+                keep = self.handle_frames(server, conn)
+                await writer.drain()
+                if not keep:
+                    break
+            if conn.result == "auth_request":  # 在线程池中查询会话服务器，不阻塞事件循环
+                profile = await asyncio.get_running_loop().run_in_executor(None, self._query_session, server, conn)
+                conn.result = "login_request" if self._complete_auth(server, conn, profile) else None
+                await writer.drain()
+        except ConnectionError:
+            conn.note("客户端提前断开")
+        except (asyncio.TimeoutError, socket.timeout):
+            self._count_timeout(server, conn)
+        finally:
+            if not (self.config.proxy_mode and conn.result == "login_request"):
+                self._release(conn)
+        
+        if self.config.proxy_mode and conn.result == "login_request":
+            self._finish_connection(server, conn, "转交代理")
+            await self._proxy_async(server, reader, writer, conn)
+            return None
         
+        self._finish_connection(server, conn, "断开")
+        return conn.result
+    
+    def _new_connection(self, sock, client_address):
+        """创建连接状态，并决定该连接的日志级别(采样只在连接开始时判断一次)"""
+        level = self.config.fs_log_level
+        if level != LOG_OFF and not self.log_sampler.sample():
+            level = LOG_OFF
+        return ClientConnection(sock, self.config.fs_connection_deadline,
+                                f"{client_address[0]}:{client_address[1]}", level, client_address[0])
+    
+    def _finish_connection(self, server: PluginServerInterface, conn, outcome):
+        """记录连接耗时并输出汇总日志，唤醒服务器的登录请求不受采样影响"""
+        self._m_connection_time.observe(time.monotonic() - conn.started)
+        if conn.log_level == LOG_OFF and not (conn.result == "login_request" and self.config.fs_log_level != LOG_OFF):
+            return
+        events = " → ".join(conn.events) if conn.events else "无数据"
+        server.logger.info(f"伪装服务器连接{conn.address}：{events}，{outcome}"
+                           f"(协议{conn.protocol}，{conn.packets}个数据包/{conn.received}字节，"
+                           f"用时{(time.monotonic() - conn.started) * 1000:.0f}ms)")
+    
+    def _admit(self, server: PluginServerInterface, conn, ip):
+        """准入检查，拒绝的连接只计数"""
+        if self.ip_bans.lookup(ip) is not None:
+            self.admission.count("rejected_banned")
+            self.admission.report(server.logger)
+            return False
+        if self.admission.admit(ip):
+            conn.admitted = True
+            return True
+        self.admission.report(server.logger)
+        return False
+    
+    def _release(self, conn):
+        """释放连接占用的并发名额，可重复调用"""
+        if conn is not None and conn.admitted:
+            conn.admitted = False
+            self.admission.release()
+    
+    def _next_read_timeout(self, conn):
+        """下一次读取的超时：未收到数据时使用fs_first_byte_timeout，否则5s，且都不超过整个连接的截止时间"""
+        remaining = conn.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("Connection deadline exceeded")
+        return min(self.config.fs_first_byte_timeout if conn.received == 0 else 5, remaining)
+    
+    def _count_timeout(self, server: PluginServerInterface, conn):
+        if conn.received > 0 and time.monotonic() >= conn.deadline:
+            self.admission.count("dropped_deadline")
+            conn.note("超过连接截止时间")
+        else:
+            self.admission.count("dropped_idle")
+            conn.note("空闲超时")
+        self.admission.report(server.logger)
+    
+    def handle_frames(self, server: PluginServerInterface, conn):
+        """处理分帧器中所有完整的数据包，返回False表示应断开连接"""
+        try:
+            # https://minecraft.wiki/w/Minecraft_Wiki:Projects/wiki.vg_merge/Server_List_Ping#1.6
+            if conn.state == STATE_HANDSHAKING:
+                pending = conn.framer.pending()
+                # 1.6兼容协议以FE 01 FA开头；长度为254、382等的新版数据包的长度VarInt同样以FE开头，按正常分帧处理
+                if len(pending) > 0 and pending[0] == 0xFE:
+                    if len(pending) < 3:
+                        return True  # 等待后两个字节
+                    if pending[1] == 0x01 and pending[2] == 0xFA:
+                        conn.packets += 1
+                        if conn.log_level == LOG_PACKET:
+                            server.logger.info(f"收到数据：[3]>[{format_hex(pending[:3])}]")
+                        conn.note("1.6-ping")
+                        self._m_requests["legacy_ping"].inc()
+                        # 以踢出数据包响应客户端，长度直接设为0，不给出任何信息
+                        conn.sock.sendall(bytes([0xFF, 0x00, 0x00]))
+                        return False
+            
+            while (reader := conn.framer.next_packet()) is not None:
+                conn.packets += 1
+                if conn.log_level == LOG_PACKET:
+                    server.logger.info(f"收到数据：[{reader.len()}]>[{format_hex(reader.getdata())}]")
+                packet_id = reader.read_varint()
+                
+                if conn.state == STATE_HANDSHAKING:
+                    if packet_id != 0x00:
+                        conn.note("意外的数据包")
+                        return False
+                    result, conn.protocol = self.handle_handshaking(conn, reader, server)
+                    if result == "status_request":
+                        conn.state = STATE_STATUS
+                        conn.result = result
+                    elif result == "login_request":
+                        conn.state = STATE_LOGIN  # 收到登录开始数据包后才算作登录请求
+                    else:  # 转移请求或未知请求则断开连接
+                        return False
+                elif conn.state == STATE_STATUS:
+                    if packet_id == 0x00 and not conn.status_sent:  # Status Request
+                        conn.note("发送motd")
+                        self._m_requests["status"].inc()
+                        # 发送预编码的状态响应
+                        conn.sock.sendall(self.get_status_packet(conn.protocol))
+                        conn.status_sent = True  # 已响应，防止重复请求
+                    elif packet_id == 0x01:  # Ping Request
+                        self.handle_ping(conn, reader, server)
+                        return False  # 断开连接
+                    else:
+                        conn.note("意外的数据包")
+                        return False
+                elif conn.state == STATE_LOGIN:
+                    if packet_id == 0x00:  # Login Start
+                        conn.note("登录开始")
+                        self._m_requests["login"].inc()
+                        allowed = self.handle_login_start(conn, reader, server)
+                        if allowed is None:
+                            return True  # 等待加密响应
+                        if allowed:
+                            conn.result = "login_request"
+                    elif packet_id == 0x01 and conn.login is not None:  # Encryption Response
+                        if self.handle_encryption_response(conn, reader, server):
+                            conn.result = "auth_request"
+                    else:
+                        conn.note("意外的数据包")
+                    return False
+            return True
+        except BytesReaderError as e:
+            conn.note(f"解析数据出错[{e}]")
+            self._m_requests["invalid"].inc()
+        except (TypeError, IndexError, UnicodeDecodeError) as e:
+            conn.note(f"无效数据[{e}]")
+            self._m_requests["invalid"].inc()
+        return False
+    
+    def handle_handshaking(self, conn, reader: BytesReader, server: PluginServerInterface):
+        """解析握手数据包，返回(请求类型, 客户端协议版本)"""
         try:
             version = reader.read_varint()
             ip = reader.read_str()
-            ip = ip.replace('\x00', '\\0').replace("\r", "\\r").replace("\t", "\\t").replace("\n", "\\n")
             port = reader.read_ushort()
             state = reader.read_byte()
             
-            server.logger.info(f"数据解析：version:[{version}], ip:[{ip}], port:[{port}], state:[{hex(state)}]")
+            if conn.log_level == LOG_PACKET:
+                ip = ip.replace('\x00', '\\0').replace("\r", "\\r").replace("\t", "\\t").replace("\n", "\\n")
+                server.logger.info(f"数据解析：version:[{version}], ip:[{ip}], port:[{port}], state:[{hex(state)}]")
             
             if state == 0x01:  # Status
-                server.logger.info("伪装服务器收到了一次状态请求")
+                conn.note("状态请求")
                 # https://minecraft.wiki/w/Minecraft_Wiki:Projects/wiki.vg_merge/Server_List_Ping#Current_(1.7+)
-                return "status_request"
+                return "status_request", version
             elif state == 0x02:  # Login
-                server.logger.info("伪装服务器收到了一次登录请求")
-                return "login_request"
+                conn.note("登录请求")
+                return "login_request", version
             elif state == 0x03:  # Transfer
-                server.logger.info("伪装服务器收到了一次转移请求")
-                return "transfer_request"
+                conn.note("转移请求")
+                return "transfer_request", version
             else:
-                server.logger.info("伪装服务器收到了一次未知请求")
-                return "unknown_request"
+                conn.note("未知请求")
+                return "unknown_request", version
         except BytesReaderError as e:
-            server.logger.warning(f"解析handshaking数据包出错: {e}")
-            return "unknown_request"
+            conn.note(f"握手解析出错[{e}]")
+            return "unknown_request", conn.protocol
+    
+    def handle_login_start(self, conn, reader: BytesReader, server: PluginServerInterface):
+        """
+        登录请求，响应踢出消息，然后关闭伪服务端并启动服务器
+        返回True唤醒，False拒绝，None表示已发送加密请求，等待在线验证
+        """
+        name, player_uuid = read_login_start(reader, conn.protocol)
+        conn.note(f"玩家[{name}]" if player_uuid is None else f"玩家[{name}/{player_uuid}]")
+        if not self._check_login(conn, name, player_uuid):
+            return False
+        if self.auth is not None:
+            profile = self.auth.cached(name)
+            if profile is None:  # 开始加密握手，验证通过后再唤醒
+                packet, token = self.auth.build_encryption_request(conn.protocol)
+                conn.sock.sendall(packet)
+                conn.login = (name, token)
+                conn.note("发送加密请求")
+                return None
+            self._m_auth["cached"].inc()
+            conn.note("在线验证缓存命中")
+            if not self._check_login(conn, *profile):  # 用验证过的UUID再检查一次封禁
+                return False
+        if self.wake_guard is not None:
+            self.wake_guard.record_wake(name, conn.ip)
+        if self.config.proxy_mode:  # 代理模式：不踢出，请求启动服务器后保持连接
+            self.request_wake(server)
+            return True
+        # 使用新的响应函数发送踢出消息
+        self._kick(conn.sock)
+        if self.config.boot_status:
+            self.begin_boot(server)  # 继续监听，回复启动进度
+        else:
+            self.fs_stop = True  # 提醒服务器应该关闭
+        return True
+    
+    def _check_login(self, conn, name, player_uuid):
+        """只有能够进入服务器的玩家才唤醒，按代价从低到高检查，拒绝时发送对应的踢出消息"""
+        reason = self.ip_bans.lookup(conn.ip)  # 连接期间封禁列表可能已更新
+        if reason is not None:
+            return self._reject_login(conn, "ip_ban", f"IP已封禁[{reason}]", self.config.ip_ban_message)
+        if self.player_rule is not None and not self.player_rule(name):
+            return self._reject_login(conn, "name_rule", "玩家名不符合规则", self.config.name_reject_message)
+        reason = self.player_bans.lookup(name, player_uuid)
+        if reason is not None:
+            return self._reject_login(conn, "player_ban", f"玩家已封禁[{reason}]", self.config.player_ban_message)
+        if self.wake_guard is not None:
+            remaining = self.wake_guard.refused(name, conn.ip)
+            if remaining > 0:
+                conn.note(f"拒绝唤醒[剩余{remaining:.0f}s]")
+                self._kick(conn.sock, self.config.wake_ban_message)
+                return False
+        return True
+    
+    def handle_encryption_response(self, conn, reader: BytesReader, server: PluginServerInterface):
+        """校验加密响应并启用加密，之后的数据包(踢出消息)都需要加密发送"""
+        try:
+            secret = self.auth.read_encryption_response(reader, conn.protocol, conn.login[1])
+        except SignedResponseError as e:
+            self._m_auth["failed"].inc()
+            conn.sock = EncryptedSocket(conn.sock, e.secret)  # 客户端发出加密响应后已启用加密
+            return self._reject_login(conn, "online_auth", f"加密握手失败[{e}]", self.config.online_auth_message)
+        except AuthError as e:
+            self._m_auth["failed"].inc()
+            conn.note(f"加密握手失败[{e}]")
+            return False
+        conn.sock = EncryptedSocket(conn.sock, secret)
+        conn.auth_hash = self.auth.server_hash(secret)
+        conn.note("已加密")
+        return True
+    
+    def _query_session(self, server: PluginServerInterface, conn):
+        """查询会话服务器(阻塞)，返回(玩家名, UUID)，未通过或出错返回None"""
+        start_time = time.monotonic()
+        try:
+            profile = self.auth.has_joined(conn.login[0], conn.auth_hash)
+        except OSError as e:
+            self._m_auth["error"].inc()
+            conn.note(f"会话服务器出错[{e}]")
+            server.logger.warning(f"在线验证：查询会话服务器失败: {e}")
+            return None
+        finally:
+            self._m_session_time.observe(time.monotonic() - start_time)
+        self._m_auth["ok" if profile is not None else "failed"].inc()
+        return profile
+    
+    def _complete_auth(self, server: PluginServerInterface, conn, profile):
+        """
+        在线验证结束：通过时缓存结果并用验证过的玩家名和UUID再检查一次，返回是否应关闭伪装服务器并唤醒
+        加密的连接无法交给后端，代理模式下也发送踢出消息，由玩家在服务器启动后重新连接
+        """
+        if profile is None:
+            return self._reject_login(conn, "online_auth", "在线验证未通过", self.config.online_auth_message)
+        self.auth.remember(*profile)
+        conn.note(f"在线验证通过[{profile[1]}]")
+        if not self._check_login(conn, *profile):
+            return False
+        if self.wake_guard is not None:
+            self.wake_guard.record_wake(profile[0], conn.ip)
+        self._kick(conn.sock)
+        if self.config.proxy_mode:
+            self.request_wake(server)
+            return False
+        if self.config.boot_status:
+            self.begin_boot(server)
+            return False
+        return True
+    
+    @new_thread
+    def _auth_thread(self, server: PluginServerInterface, client_socket, conn):
+        """单线程模式下的在线验证：查询会话服务器后踢出，通过时关闭伪装服务器并唤醒"""
+        wake = False
+        try:
+            wake = self._complete_auth(server, conn, self._query_session(server, conn))
+        except OSError as e:
+            conn.note(f"连接出错[{e}]")
+        finally:
+            self._release(conn)
+            client_socket.close()
+            self._finish_connection(server, conn, "断开")
+        if wake:  # 由插件关闭伪装服务器后再启动服务器
+            self._start_server(server)
     
-    def handle_ping(self, client_socket, reader: BytesReader, server: PluginServerInterface):
-        server.logger.info("伪装服务器收到了一次ping")
+    def _reject_login(self, conn, kind, event, message):
+        """拒绝唤醒：发送对应的踢出消息，不启动服务器"""
+        self._m_login_rejected[kind].inc()
+        conn.note(event)
+        self._kick(conn.sock, message)
+        return False
+    
+    def request_wake(self, server: PluginServerInterface):
+        """代理模式下请求启动服务器，重复请求只启动一次"""
+        if self._backend_ready.is_set() or self._wake_requested:
+            return
+        self._wake_requested = True
+        if server.is_server_running() or server.is_server_startup():
+            return
+        server.logger.info("代理模式：收到登录请求，启动服务器")
+        self._start_server(server)
+    
+    def backend_ready(self, server: PluginServerInterface):
+        """服务器启动完成，开始转发等待中的和新的连接"""
+        self.end_boot()
+        self._wake_requested = False
+        self._backend_ready.set()
+        self._call_in_loop(lambda: self._async_backend_ready.set())
+        if self.config.proxy_mode:
+            server.logger.info("代理模式：服务器已就绪")
+    
+    def backend_stopped(self, server: PluginServerInterface):
+        """服务器已关闭，之后的连接重新由伪装服务器处理"""
+        self.end_boot()  # 启动失败时恢复休眠的状态响应
+        self._wake_requested = False
+        self._backend_ready.clear()
+        self._call_in_loop(lambda: self._async_backend_ready.clear())
+    
+    def _call_in_loop(self, callback):
+        """在asyncio模式的事件循环中执行回调"""
+        loop = self._async_loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(callback)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+    
+    def _kick(self, client_socket, message=None):
+        write_str_response(client_socket, 0x00, json.dumps({"text": self.config.kick_message if message is None else message}))
+    
+    @new_thread
+    def _proxy_thread(self, server: PluginServerInterface, client_socket, conn):
+        """单线程模式下的代理连接：等待服务器就绪，重放登录数据后双向转发"""
+        backend = None
+        self._proxy_sockets.add(client_socket)
+        try:
+            replay = b''
+            if conn is not None:
+                try:
+                    replay = self._hold_login(server, client_socket, conn)
+                finally:
+                    self._release(conn)  # 等待结束后不再占用伪装服务器的并发名额
+                if replay is None:
+                    return
+            backend = socket.create_connection((self.config.proxy_backend_ip, self.config.proxy_backend_port), timeout=5)
+            self._proxy_sockets.add(backend)
+            if replay:
+                backend.sendall(replay)
+            self._relay_sockets.update((client_socket, backend))
+            stats = relay_sockets(client_socket, backend, self.config.proxy_buffer_size)
+            self._record_relay(stats)
+            server.logger.info(f"代理连接结束：{stats.summary()}")
+        except (OSError, BytesReaderError) as e:
+            server.logger.warning(f"代理连接出错: {e}")
+        finally:
+            for sock in (client_socket, backend):
+                if sock is not None:
+                    self._proxy_sockets.discard(sock)
+                    self._relay_sockets.discard(sock)
+                    sock.close()
+    
+    def _record_relay(self, stats: RelayStats):
+        self._m_proxy_bytes["upstream"].inc(stats.upstream)
+        self._m_proxy_bytes["downstream"].inc(stats.downstream)
+    
+    def _hold_login(self, server: PluginServerInterface, client_socket, conn):
+        """保持登录连接直到服务器就绪，返回需要重放的数据，超时则踢出并返回None"""
+        start_time = time.monotonic()
+        deadline = start_time + self.config.proxy_wait_timeout
+        keepalive = conn.protocol is not None and conn.protocol >= LOGIN_PLUGIN_MIN_PROTOCOL
+        sent = 0
+        while not self._backend_ready.wait(max(min(self.config.proxy_keepalive_sec, deadline - time.monotonic()), 0)):
+            if self.fs_stop or time.monotonic() >= deadline:
+                server.logger.warning("代理模式：等待服务器启动超时，发送踢出消息")
+                self._kick(client_socket)
+                return None
+            if keepalive:  # 发送登录插件请求，防止客户端30s读取超时
+                client_socket.sendall(build_login_plugin_request(sent))
+                sent += 1
+        
+        # 丢弃客户端对保活请求的响应，剩余数据一并转发
+        framer = PacketFramer(max_packet_size=FS_MAX_PACKET_SIZE)
+        client_socket.settimeout(5)
+        while sent > 0:
+            n = client_socket.recv_into(framer.recv_buffer())
+            if n == 0:
+                raise ConnectionError("连接已关闭")
+            framer.commit(n)
+            count, unexpected = count_plugin_responses(framer)
+            if unexpected:
+                raise BytesReaderError("Unexpected packet while waiting")
+            sent -= count
+        self._m_proxy_wait.observe(time.monotonic() - start_time)
+        server.logger.info(f"代理模式：等待{time.monotonic() - start_time:.1f}s后服务器就绪，开始转发")
+        return bytes(conn.replay) + bytes(framer.pending())
+    
+    async def _proxy_async(self, server: PluginServerInterface, reader, writer, conn):
+        """_proxy_thread的asyncio版本"""
+        backend_writer = None
+        try:
+            replay = b''
+            if conn is not None:
+                try:
+                    replay = await self._hold_login_async(server, reader, writer, conn)
+                finally:
+                    self._release(conn)
+                if replay is None:
+                    return
+            backend_reader, backend_writer = await asyncio.wait_for(
+                asyncio.open_connection(self.config.proxy_backend_ip, self.config.proxy_backend_port), 5)
+            if replay:
+                backend_writer.write(replay)
+            self._async_relays.add(asyncio.current_task())
+            stats = await relay_streams(reader, writer, backend_reader, backend_writer, self.config.proxy_buffer_size)
+            self._record_relay(stats)
+            server.logger.info(f"代理连接结束：{stats.summary()}")
+        except (OSError, asyncio.TimeoutError, BytesReaderError) as e:
+            server.logger.warning(f"代理连接出错: {e}")
+        finally:
+            self._async_relays.discard(asyncio.current_task())
+            if backend_writer is not None:
+                backend_writer.close()
+    
+    async def _hold_login_async(self, server: PluginServerInterface, reader, writer, conn):
+        """_hold_login的asyncio版本"""
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        deadline = start_time + self.config.proxy_wait_timeout
+        keepalive = conn.protocol is not None and conn.protocol >= LOGIN_PLUGIN_MIN_PROTOCOL
+        sent = 0
+        while not self._async_backend_ready.is_set():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                server.logger.warning("代理模式：等待服务器启动超时，发送踢出消息")
+                self._kick(_AsyncClientSocket(writer))
+                await writer.drain()
+                return None
+            try:
+                await asyncio.wait_for(self._async_backend_ready.wait(), min(self.config.proxy_keepalive_sec, remaining))
+            except asyncio.TimeoutError:
+                if keepalive and loop.time() < deadline:
+                    writer.write(build_login_plugin_request(sent))
+                    sent += 1
+                    await writer.drain()
+        
+        framer = PacketFramer(max_packet_size=FS_MAX_PACKET_SIZE)
+        while sent > 0:
+            data = await asyncio.wait_for(reader.read(RECV_BUFFER_SIZE), 5)
+            if not data:
+                raise ConnectionError("连接已关闭")
+            framer.feed(data)
+            count, unexpected = count_plugin_responses(framer)
+            if unexpected:
+                raise BytesReaderError("Unexpected packet while waiting")
+            sent -= count
+        self._m_proxy_wait.observe(loop.time() - start_time)
+        server.logger.info(f"代理模式：等待{loop.time() - start_time:.1f}s后服务器就绪，开始转发")
+        return bytes(conn.replay) + bytes(framer.pending())
+    
+    def handle_ping(self, conn, reader: BytesReader, server: PluginServerInterface):
         # https://minecraft.wiki/w/Java_Edition_protocol#Pong_Response_(status)
         try:
             long_data = reader.read_long()
-            server.logger.info(f"数据解析：long_data[{long_data}]")
+            if conn.log_level == LOG_PACKET:
+                server.logger.info(f"数据解析：long_data[{long_data}]")
             
-            response = bytearray()
-            write_varint(response, 9)  # 包长度
-            write_varint(response, 1)  # 包ID (Pong Response)
-            write_long(response, long_data)
+            response = build_pong(long_data)
             
-            server.logger.info("响应pong")
-            client_socket.sendall(response)
+            conn.note("响应pong")
+            self._m_requests["ping"].inc()
+            conn.sock.sendall(response)
         except BytesReaderError as e:
-            server.logger.warning(f"解析ping数据包出错: {e}")
+            conn.note(f"ping解析出错[{e}]")
     
     def stop(self, server: PluginServerInterface):
         if not self.fs_is_running:
             server.logger.info("伪装服务器已是关闭状态")
             return True
         
+        # 单线程模式下shutdown监听socket立即唤醒accept，其他模式由事件循环关闭监听socket的副本
+        listener = self.server_socket if self._mode == "thread" else None
+        if not self._stop_listening(server, (listener, self._client_socket)):
+            server.logger.error("关闭伪装服务器失败: 等待超时")
+            return False
+        server.logger.info("伪装服务器已关闭")
+        return True
+    
+    def detach(self, server: PluginServerInterface):
+        """
+        插件重载：停止监听但不关闭监听socket，返回该socket交给重载后的模块，期间连接在backlog中排队而不是被拒绝
+        未在监听或服务器启动阶段(即将释放端口)时正常关闭并返回None
+        """
+        if not self.fs_is_running or self.booting:
+            self.stop(server)
+            return None
+        listener = self.server_socket
+        if not _is_listening(listener):  # 多进程模式：先加入SO_REUSEPORT组开始排队，再关闭工作进程，端口始终有socket监听
+            listener.listen(32)
+        self._detaching = True
+        if not self._stop_listening(server, (self._client_socket,), keep_relays=True):  # 监听socket不能shutdown，accept靠超时退出
+            self._detaching = False  # 监听线程退出时自行关闭
+            server.logger.error("伪装服务器停止监听超时，不交接监听socket")
+            return None
+        server.logger.info("伪装服务器已停止监听，监听socket交给重载后的插件")
+        return listener
+    
+    def _stop_listening(self, server: PluginServerInterface, sockets, keep_relays=False):
+        """设置关闭标签并唤醒监听，shutdown给出的socket，返回监听线程是否按时退出；keep_relays时不断开转发中的代理连接"""
         self.fs_stop = True  # 提醒服务器应该关闭
+        self._call_in_loop(lambda: self._async_stop.set())  # asyncio模式下唤醒事件循环，立即取消所有连接
+        if self._workers is not None:  # 多进程模式下通知工作进程关闭
+            self._workers.wakeup()
+        for sock in list(self._proxy_sockets):  # 断开代理模式下等待或转发中的连接
+            if keep_relays and sock in self._relay_sockets:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
         server.logger.info("正在关闭伪装服务器")
-        # 设置时间
-        count = 6  # 比socket timeout多1
-        while self.fs_is_running:  # 等待服务器关闭
-            if count == 0:
-                server.logger.error("关闭伪装服务器失败: 等待超时")
-                return False
-            count -= 1
-            time.sleep(1)
+        # 关闭监听socket和正在处理的连接，立即唤醒阻塞中的accept/recv
+        for sock in sockets:
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    sock.close()  # Windows下监听socket不支持shutdown，close同样可以唤醒accept
         
-        if self.server_socket:
-            server.logger.info("等待超时")
-            return False
-        else:
-            server.logger.info("伪装服务器已关闭")
-            return True
+        return self._stopped.wait(6)  # 等待监听线程退出
+
+
+def _is_listening(sock):
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN) != 0
+
+
+def _without_sample_ids(template):
+    """去掉示例玩家UUID后的状态模板，用于比较内容是否相同"""
+    players = dict(template["players"], sample=[sample["name"] for sample in template["players"]["sample"]])
+    return dict(template, players=players)
+
+
+def read_login_start(reader: BytesReader, protocol):
+    """
+    解析登录开始数据包，返回(玩家名, UUID或None)
+    https://minecraft.wiki/w/Java_Edition_protocol#Login_Start
+    UUID字段随版本变化：1.19.3~1.20.1为可选，1.20.2起必有；1.19~1.19.2还带有可选的签名数据
+    """
+    name = reader.read_str()
+    player_uuid = None
+    try:
+        if protocol is None or protocol < 759:  # 1.19之前只有玩家名
+            pass
+        elif protocol >= 764:  # 1.20.2+
+            player_uuid = reader.read_uuid()
+        elif protocol >= 761:  # 1.19.3 ~ 1.20.1
+            if reader.read_byte():
+                player_uuid = reader.read_uuid()
+        else:  # 1.19 ~ 1.19.2
+            if reader.read_byte():
+                reader.read_long()  # 过期时间
+                reader.read_bytes(reader.read_varint())  # 公钥
+                reader.read_bytes(reader.read_varint())  # 签名
+            if protocol >= 760 and reader.read_byte():
+                player_uuid = reader.read_uuid()
+    except BytesReaderError:
+        player_uuid = None  # 客户端版本与握手不符或数据不完整时只使用玩家名
+    return name, player_uuid
+
+
+# 连接状态，与握手数据包中的next state取值一致
+STATE_HANDSHAKING = 0
+STATE_STATUS = 1
+STATE_LOGIN = 2
+
+
+class ClientConnection:
+    """单个客户端连接的协议状态"""
+    
+    def __init__(self, sock, deadline_sec, address="", log_level=LOG_OFF, ip=""):
+        self.sock = sock  # 带sendall的socket或包装对象
+        self.address = address
+        self.ip = ip
+        self.started = time.monotonic()
+        self.deadline = self.started + deadline_sec  # 整个连接的截止时间
+        self.received = 0
+        self.packets = 0
+        self.log_level = log_level
+        self.events = []  # 汇总日志中的事件
+        self.admitted = False
+        self.framer = PacketFramer(max_packet_size=FS_MAX_PACKET_SIZE)
+        self.state = STATE_HANDSHAKING
+        self.protocol = None
+        self.result = None
+        self.status_sent = False
+        self.replay = bytearray()  # 代理模式下收到的原始数据
+        self.login = None  # 等待在线验证的(玩家名, 验证令牌)
+        self.auth_hash = None  # 加密握手得到的服务器哈希，用于查询会话服务器
+    
+    def note(self, event):
+        """记录一个事件，在连接结束时合并为一条汇总日志"""
+        if len(self.events) < 16:
+            self.events.append(event)
+
+
+class _AsyncClientSocket:
+    """将asyncio的StreamWriter包装为带sendall的对象，以复用同步的响应函数"""
+    
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+    
+    def sendall(self, data):
+        self.writer.write(data)
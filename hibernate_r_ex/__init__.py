@@ -1,3 +1,4 @@
+import os
 import re
 import time
 
@@ -7,7 +8,15 @@ from .byte_utils import *
 
 from .FakeServer import FakeServerSocket
 from .timer import TimerManager
+from .players import PlayerTracker
+from .metrics import metrics, MetricsHTTPServer
+from .prediction import Predictor
+from .thrash import WakeGuard
+from .lifecycle import Lifecycle, STATE_RUNNING, STATE_STOPPING, STATE_HIBERNATED, STATE_WAKING, STATE_STOPPED
+from .handover import Handover
 from .config import load_config_file
+from .config import reload_config_file
+from .config import get_config_file_path
 from .config import get_config
 
 
@@ -15,26 +24,80 @@ from .config import get_config
 timer_manager = None
 # 创建 fake_server_socket 实例
 fake_server_socket = None
+# 在线玩家集合，由登录/离开日志维护
+player_tracker = PlayerTracker()
+# 生命周期执行器，服务器和伪装服务器的启停在同一个线程中依次执行
+lifecycle = None
+# 到达预测，用于预热和推迟停服
+predictor = None
+# 频繁空唤醒保护，延长空闲等待时间并拒绝多次空唤醒的玩家名/IP
+wake_guard = None
+# Prometheus指标HTTP服务，metrics_port大于0时启用
+metrics_server = None
+# 插件卸载时留给重载后模块的监听socket、倒计时和缓存，由新模块的on_load接收
+handover = None
+
+# 生命周期指标
+m_wakeups = metrics.counter("hr_wakeups_total", "唤醒(启动服务器)次数")
+m_sleeps = metrics.counter("hr_sleeps_total", "休眠(关闭服务器)次数")
+m_startups = metrics.counter("hr_server_startups_total", "服务器启动完成次数")
+m_stops = {result: metrics.counter("hr_server_stops_total", "服务器关闭次数", {"result": result}) for result in ("normal", "crash")}
+m_boot_time = metrics.histogram("hr_server_boot_seconds", "服务器从进程启动到启动完成的耗时")
+boot_started_at = None
+# 伪装服务器自启动
+AUTOSTART_JOB = "fs_autostart"
+# 配置文件监视：上次检查时配置文件和服务器图标的修改时间
+CONFIG_WATCH_JOB = "config_watch"
+config_watch_stamp = None
 
 
 # 初始化插件
 def on_load(server: PluginServerInterface, prev_module):
     # 读取配置文件
     load_config_file(server)
+    # 接收重载前的模块交接的状态
+    previous = getattr(prev_module, "handover", None)
+    previous = previous.take() if previous is not None else None
+    listener = previous.listener if previous is not None else None
 
     global fake_server_socket
     global timer_manager
+    global predictor
+    global wake_guard
+    global lifecycle
 
     if fake_server_socket is None:
         fake_server_socket = FakeServerSocket(server) # 创建 fake_server_socket 实例
     if timer_manager is None:
-        timer_manager = TimerManager(server)#创建TimerManager实例
+        timer_manager = TimerManager(server, player_tracker)#创建TimerManager实例
+    if predictor is None:
+        predictor = Predictor(server, timer_manager.scheduler, get_config())#与计时器共用调度线程
+        timer_manager.predictor = predictor
+    if wake_guard is None:
+        wake_guard = WakeGuard(get_config())
+        fake_server_socket.wake_guard = wake_guard
+        timer_manager.wake_guard = wake_guard
+    fake_server_socket.player_rule = timer_manager.counts_as_player
+    if lifecycle is None:
+        if server.is_server_running():
+            initial_state = STATE_RUNNING
+        elif server.is_server_startup():
+            initial_state = STATE_WAKING
+        else:
+            initial_state = STATE_HIBERNATED
+        lifecycle = Lifecycle(server.logger, initial_state)
+    if previous is not None:
+        player_tracker.restore_state(previous.players)
+        fake_server_socket.adopt_status(previous.status)
 
 
     def command_help(source: CommandSource):
         source.reply(RText("!!hr timer start/stop -- (开启/停止)停服倒计时器", color=RColor.yellow))
         source.reply(RText("!!hr sleep s/fs -- 休眠(服务器/伪装服务器)", color=RColor.yellow))
         source.reply(RText("!!hr wakeup s/fs -- 唤醒(服务器/伪装服务器)", color=RColor.yellow))
+        source.reply(RText("!!hr capture [<count>|clear] -- 导出/清空伪装服务器最近收到的原始数据", color=RColor.yellow))
+        source.reply(RText("!!hr stats -- 查看运行统计", color=RColor.yellow))
+        source.reply(RText("!!hr reload -- 重载配置文件(不重启伪装服务器)", color=RColor.yellow))
 
     # 构建命令树
     builder = SimpleCommandBuilder()
@@ -42,49 +105,163 @@ def on_load(server: PluginServerInterface, prev_module):
     builder.command('!!hr timer start', lambda src: permission_test(src, timer_manager.start_timer,[src.get_server(), test_stop_server]))
     builder.command('!!hr timer stop', lambda src: permission_test(src,timer_manager.cancel_timer,[src.get_server()]))
     builder.command('!!hr sleep s', lambda src: permission_test(src,hr_sleep,[src.get_server()]))
-    builder.command('!!hr sleep fs', lambda src: permission_test(src,fake_server_socket.stop,[src.get_server()]))
+    builder.command('!!hr sleep fs', lambda src: permission_test(src,lifecycle.submit,[fake_server_socket.stop, src.get_server()]))
     builder.command('!!hr wakeup s', lambda src: permission_test(src,hr_wakeup,[src.get_server()]))
-    builder.command('!!hr wakeup fs', lambda src: permission_test(src,fake_server_socket.start,[src.get_server(), start_server]))
+    builder.command('!!hr wakeup fs', lambda src: permission_test(src,lifecycle.submit,[fake_server_socket.start, src.get_server(), start_server]))
+    builder.command('!!hr capture', lambda src: permission_test(src,hr_capture,[src]))
+    builder.command('!!hr capture <count>', lambda src, ctx: permission_test(src,hr_capture,[src, ctx['count']]))
+    builder.command('!!hr capture clear', lambda src: permission_test(src,hr_capture_clear,[src]))
+    builder.arg('count', lambda name: Integer(name).at_min(1))
+    builder.command('!!hr stats', lambda src: permission_test(src,hr_stats,[src]))
+    builder.command('!!hr reload', lambda src: permission_test(src,hr_reload,[src.get_server()]))
     builder.register(server)
 
+    if metrics_server is None:
+        start_metrics_server(server)
+    start_config_watch(server)
+
     server.logger.info("参数初始化完成")
 
     # 检查服务器状态并启动计时器或伪装服务器
-    if server.is_server_running():
+    if lifecycle.state == STATE_RUNNING:
         server.logger.info("服务器正在运行，启动计时器")
-        timer_manager.start_timer(server, test_stop_server)#启动时间事件
-    elif server.is_server_startup():
+        if previous is not None and previous.countdown is not None:
+            timer_manager.resume_timer(server, test_stop_server, stop_server, previous.countdown)#重载前的倒计时继续
+        else:
+            timer_manager.start_timer(server, test_stop_server)#启动时间事件
+        if get_config().proxy_mode:
+            fake_server_socket.backend_ready(server)
+            lifecycle.submit(fake_server_socket.start, server, start_server, listener)#代理模式下服务器运行时也需要监听并转发
+            listener = None
+    elif lifecycle.state == STATE_WAKING:
         server.logger.info("等待服务器启动后，再启动计时器")
+        if get_config().proxy_mode and listener is not None:
+            lifecycle.submit(fake_server_socket.start, server, start_server, listener)#代理模式下继续接收等待启动的连接
+            listener = None
     else:
+        predictor.start_prewarm(predicted_wakeup)
         start_wait_sec = get_config().start_wait_sec
-        if start_wait_sec >= 0:
+        if listener is not None:
+            server.logger.info("插件重载前伪装服务器正在监听，沿用监听socket立即启动")
+            lifecycle.submit(fake_server_socket.start, server, start_server, listener)
+            listener = None
+        elif start_wait_sec >= 0:
             server.logger.warning(f"服务器未运行，等待{start_wait_sec}s后启动伪装服务器")
-            wait_server_load(server, start_wait_sec)
+            #超时后交给生命周期线程检查，服务器进程启动时取消
+            timer_manager.scheduler.schedule(AUTOSTART_JOB, start_wait_sec, lifecycle.submit, autostart_fake_server, server, start_wait_sec)
         else:
             server.logger.warning("服务器未运行，伪装服务器自启动已取消")
+    if listener is not None:#交接的监听socket用不上，立即释放端口
+        listener.close()
         
         
 
-@new_thread
-def wait_server_load(server: PluginServerInterface, timeout):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if server.is_server_startup() or server.is_server_running():
-            server.logger.info("服务器已启动，伪装服务器自启动已取消")
-            return #服务器启动，跳过伪装服务器启动
-        time.sleep(0.1)
+def start_metrics_server(server: PluginServerInterface):
+    global metrics_server
+    if get_config().metrics_port <= 0:
+        return
+    try:
+        metrics_server = MetricsHTTPServer(metrics, get_config().metrics_host, get_config().metrics_port)
+        server.logger.info(f"指标服务已启动: http://{get_config().metrics_host}:{get_config().metrics_port}/metrics")
+    except OSError as e:
+        server.logger.error(f"指标服务启动失败: {e}")
+
+
+def stop_metrics_server():
+    global metrics_server
+    if metrics_server is not None:
+        metrics_server.close()
+        metrics_server = None
+
+
+# 手动重载配置
+def hr_reload(server: PluginServerInterface):
+    server.logger.info("事件：重载配置")
+    lifecycle.submit(reload_config, server)
+
+
+def reload_config(server: PluginServerInterface):
+    """重新读取配置，只重建受影响的派生数据，监听socket和正在进行的倒计时保持运行"""
+    try:
+        old_config, new_config = reload_config_file(server)
+    except Exception as e:
+        server.logger.error(f"配置重载失败，继续使用当前配置: {e}")
+        return False
+    fake_server_socket.reload_config(server)  # 状态响应、图标、准入和日志设置
+    timer_manager.reload_config(server)  # 倒计时时长和玩家规则
+    predictor.reload_config(new_config)
+    wake_guard.reload_config(new_config)
+    if lifecycle.state != STATE_HIBERNATED or not new_config.predict_enabled:
+        predictor.stop_prewarm()
+    else:
+        predictor.start_prewarm(predicted_wakeup)
+    if (old_config.metrics_host, old_config.metrics_port) != (new_config.metrics_host, new_config.metrics_port):
+        stop_metrics_server()
+        start_metrics_server(server)
+    start_config_watch(server)
+    server.logger.info("配置已重载")
+    return True
+
+
+def get_config_watch_stamp(server: PluginServerInterface):
+    stamp = []
+    for path in (get_config_file_path(server), get_config().server_icon):
+        try:
+            stamp.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def start_config_watch(server: PluginServerInterface):
+    """config_watch_sec大于0时在调度线程上定期检查配置文件和服务器图标"""
+    global config_watch_stamp
+    interval = get_config().config_watch_sec
+    if interval <= 0:
+        timer_manager.scheduler.cancel(CONFIG_WATCH_JOB)
+        return
+    config_watch_stamp = get_config_watch_stamp(server)
+    timer_manager.scheduler.schedule(CONFIG_WATCH_JOB, interval, lifecycle.submit, check_config_files, server)
+
+
+def check_config_files(server: PluginServerInterface):
+    global config_watch_stamp
+    stamp = get_config_watch_stamp(server)
+    if stamp[0] != config_watch_stamp[0]:
+        server.logger.info("检测到配置文件修改，自动重载")
+        if reload_config(server):
+            return  # 重载时已重新开始监视
+    elif stamp[1] != config_watch_stamp[1]:
+        server.logger.info("检测到服务器图标修改，重建状态响应")
+        fake_server_socket.refresh_status(server)
+    config_watch_stamp = stamp
+    timer_manager.scheduler.schedule(CONFIG_WATCH_JOB, get_config().config_watch_sec, lifecycle.submit, check_config_files, server)
+
+
+def autostart_fake_server(server: PluginServerInterface, timeout):
+    #插件加载后等待超时，服务器仍未启动时启动伪装服务器
+    if lifecycle.state != STATE_HIBERNATED or server.is_server_startup() or server.is_server_running():
+        server.logger.info("服务器已启动，伪装服务器自启动已取消")
+        return #服务器启动，跳过伪装服务器启动
     
-    #运行到此处代表超时未启动，判断服务器未运行
     server.logger.info(f"服务器超时{timeout}s未运行，正在启动伪装服务器")
     fake_server_socket.start(server, start_server)
 
 
 def on_unload(server: PluginServerInterface):
-    # 取消计时器
+    global handover
+    # 执行完已提交的启停命令，之后不再处理新的事件
+    lifecycle.close()
+    # 取消计时器，剩余时间留给重载后的模块
     global timer_manager
+    countdown = timer_manager.export_countdown()
     timer_manager.cancel_timer(server)
-    # 关闭伪装服务器
-    fake_server_socket.stop(server)
+    timer_manager.close()
+    # 伪装服务器停止监听但保留监听socket，重载后的模块接收前连接在backlog中排队，无人接收时宽限期后关闭
+    listener = fake_server_socket.detach(server)
+    handover = Handover(server.logger, listener, countdown, fake_server_socket.export_status(), player_tracker.export_state())
+    # 关闭指标服务
+    stop_metrics_server()
     server.logger.info("插件已卸载")
     
 
@@ -98,73 +275,174 @@ def permission_test(source: CommandSource, func, args = None):
         func(*args)
 
 # 手动休眠
-@new_thread
 def hr_sleep(server: PluginServerInterface):
     server.logger.info("事件：手动休眠")
-    if server.is_server_running() or server.is_server_startup():
-        global timer_manager
-        timer_manager.cancel_timer(server)
-        stop_server(server)
-    else:
-        server.logger.info("服务端已是关闭状态，跳过关闭")
+    lifecycle.submit(hibernate, server)
 
 # 手动唤醒
-@new_thread
 def hr_wakeup(server: PluginServerInterface):
     server.logger.info("事件：手动唤醒")
-    if fake_server_socket.stop(server):
-        if server.is_server_running() or server.is_server_startup():
-            server.logger.info("服务端已经是启动状态，跳过启动")
-        else:
-            start_server(server)
-    else:
-        server.logger.info("伪装服务器关闭失败，无法手动唤醒")
+    lifecycle.submit(wakeup, server)
+
+# 预测到玩家即将到达，提前唤醒
+def predicted_wakeup(server: PluginServerInterface):
+    server.logger.info("事件：预测唤醒")
+    lifecycle.submit(wakeup, server)
+
+# 以下由生命周期线程执行，状态检查和切换之间不会插入其他事件
+def wakeup(server: PluginServerInterface):
+    if lifecycle.state in (STATE_WAKING, STATE_RUNNING) or server.is_server_running() or server.is_server_startup():
+        server.logger.info("服务端已经是启动状态，跳过启动")
+        return
+    config = get_config()
+    if not config.proxy_mode and fake_server_socket.fs_is_running:#代理模式下监听保持运行，直接启动服务器
+        if config.boot_status:#保持监听回复启动进度，服务器绑定端口前再释放
+            fake_server_socket.enter_boot(server)
+        elif not fake_server_socket.stop(server):
+            server.logger.info("伪装服务器关闭失败，无法唤醒")
+            return
+    lifecycle.enter(STATE_WAKING)
+    predictor.stop_prewarm()
+    m_wakeups.inc()
+    if not server.start():
+        server.logger.error("服务器启动失败，恢复休眠")
+        lifecycle.enter(STATE_HIBERNATED)
+        fake_server_socket.end_boot()
+        fake_server_socket.start(server, start_server)
+        predictor.start_prewarm(predicted_wakeup)
+
+def hibernate(server: PluginServerInterface):
+    if lifecycle.state == STATE_STOPPING:
+        server.logger.info("服务端正在关闭，跳过关闭")
+        return
+    if not (server.is_server_running() or server.is_server_startup()):
+        server.logger.info("服务端已是关闭状态，跳过关闭")
+        return
+    lifecycle.enter(STATE_STOPPING)
+    timer_manager.cancel_timer(server)
+    m_sleeps.inc()
+    server.stop()
+
+# 导出伪装服务器抓包环
+def hr_capture(source: CommandSource, count = None):
+    capture = fake_server_socket.capture
+    if capture is None:
+        source.reply(RText("抓包未开启，请在配置中设置fs_capture_size", color=RColor.red))
+        return
+    lines = capture.dump(count)
+    source.reply(f"伪装服务器最近收到的数据({len(lines)}/{len(capture)}条)：")
+    for line in lines:
+        source.reply(line)
+
+def hr_capture_clear(source: CommandSource):
+    if fake_server_socket.capture is not None:
+        fake_server_socket.capture.clear()
+    source.reply("已清空抓包记录")
+
+# 查看运行统计
+def hr_stats(source: CommandSource):
+    source.reply("运行统计：")
+    for line in metrics.describe():
+        source.reply(line)
+
+# 服务器事件只提交给生命周期线程，不阻塞MCDR的事件处理
+def on_server_start(server: PluginServerInterface):
+    lifecycle.submit(server_starting, server, time.monotonic())
 
-# 服务器启动完成事件
-@new_thread
 def on_server_startup(server: PluginServerInterface):
-    global timer_manager
+    lifecycle.submit(server_ready, server)
+
+def on_server_stop(server: PluginServerInterface,  server_return_code: int):
+    lifecycle.submit(server_stopped, server, server_return_code)
+
+# 服务器进程启动(包括不经过插件的启动)
+def server_starting(server: PluginServerInterface, started_at):
+    global boot_started_at
+    boot_started_at = started_at
+    timer_manager.scheduler.cancel(AUTOSTART_JOB)
+    lifecycle.enter(STATE_WAKING)
+    predictor.stop_prewarm()
+    fake_server_socket.enter_boot(server)#伪装服务器仍在监听时回复启动进度
+
+# 服务器启动完成
+def server_ready(server: PluginServerInterface):
+    m_startups.inc()
+    if boot_started_at is not None:
+        m_boot_time.observe(time.monotonic() - boot_started_at)
+    lifecycle.enter(STATE_RUNNING)
+    predictor.reset_deferral()
+    player_tracker.reset()#刚启动的服务器没有玩家
     timer_manager.start_timer(server, test_stop_server)#启动事件
+    fake_server_socket.backend_ready(server)#代理模式下开始转发等待中的连接
     server.logger.info("事件：服务器启动")
 
-@new_thread
-def on_server_stop(server: PluginServerInterface,  server_return_code: int):
+# 服务器关闭
+def server_stopped(server: PluginServerInterface, server_return_code: int):
     server.logger.info("事件：服务器关闭")
-    global timer_manager
+    m_stops["normal" if server_return_code == 0 else "crash"].inc()
+    lifecycle.enter(STATE_HIBERNATED if server_return_code == 0 else STATE_STOPPED)
     timer_manager.cancel_timer(server)
+    player_tracker.reset()
+    fake_server_socket.backend_stopped(server)
     if server_return_code != 0:
+        wake_guard.clear_pending()
         server.logger.warning("意外的服务器关闭，不启动伪装服务器")
     else:
+        wake_guard.record_shutdown(server.logger)
         fake_server_socket.start(server, start_server)
+        predictor.start_prewarm(predicted_wakeup)
 
-# 主动关闭服务器
+# 请求关闭服务器(停服倒计时结束时调用)
 def stop_server(server: PluginServerInterface):
-    server.stop()
+    lifecycle.submit(hibernate, server)
 
-# 主动开启服务器
+# 请求开启服务器(伪装服务器收到登录请求时调用)
 def start_server(server: PluginServerInterface):
-    server.start()
+    lifecycle.submit(wakeup, server)
     
 LOGIN_PATTERN = re.compile(r'(?P<name>[^\[]+)\[(?P<ip>.*?)\] logged in with entity id \d+ at \(.+\)')
 LEAVE_PATTERN = re.compile(r'(?P<name>[^ ]+) left the game')
+# 先用子串判断再匹配正则，绝大多数日志行不需要执行正则
+LOGIN_MARK = "] logged in with entity id "
+LEAVE_SUFFIX = " left the game"
 
 def on_info(server: PluginServerInterface, info: Info) -> None:
     if info.is_from_server:
-        if (m := LOGIN_PATTERN.fullmatch(info.content)) is not None:
-            player_joined(server, m['name'], m['ip'])
-        if (m := LEAVE_PATTERN.fullmatch(info.content)) is not None:
-            player_left(server, m['name'])
+        content = info.content
+        if fake_server_socket.booting:#只有启动阶段才匹配进度和端口释放
+            boot_progress(server, content)
+        elif LOGIN_MARK in content:
+            if (m := LOGIN_PATTERN.fullmatch(content)) is not None:
+                player_joined(server, m['name'], m['ip'])
+        elif content.endswith(LEAVE_SUFFIX):
+            if (m := LEAVE_PATTERN.fullmatch(content)) is not None:
+                player_left(server, m['name'])
+
+def boot_progress(server: PluginServerInterface, content):
+    config = get_config()
+    if re.search(config.boot_release_pattern, content):
+        lifecycle.submit(fake_server_socket.release_port, server)
+    elif (m := re.search(config.boot_progress_pattern, content)) is not None:
+        progress = m.groupdict().get('progress') or m.group(0)
+        fake_server_socket.set_boot_progress(f"正在加载世界 {progress}")
 
 def player_joined(server, player, ip):
     server.logger.info(player + " [" + ip + "] join")
+    arrival = not any(not p.is_bot for p in player_tracker.players())#加入前没有真实玩家在线
+    player_tracker.joined(player, ip)
     if ip == "local":#is_bot
         server.logger.info("ip[local]为假人玩家，跳过")
         return
+    predictor.record_join(arrival)
+    wake_guard.record_join()
     #取消定时器
     timer_manager.cancel_timer(server)
 
 def player_left(server, player):
     server.logger.info(player + " left")
+    if not any(p.name == player and p.is_bot for p in player_tracker.players()):
+        predictor.record_leave()
+    player_tracker.left(player)
     #启动定时器
     timer_manager.start_timer(server,test_stop_server)
 
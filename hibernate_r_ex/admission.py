@@ -0,0 +1,90 @@
+import threading
+import time
+
+
+class AdmissionControl:
+    """
+    伪装服务器的准入控制：每个IP一个令牌桶，并限制同时处理的连接数
+    被拒绝和被丢弃的连接只计数，定期汇总输出一条日志，防止洪水攻击刷屏
+    """
+    
+    REPORT_INTERVAL = 60  # 汇总日志的最小间隔(秒)
+    
+    def __init__(self, rate_per_min, burst, max_connections, max_tracked_ips=4096, clock=time.monotonic):
+        self.rate = rate_per_min / 60.0  # 每秒补充的令牌数
+        self.burst = max(burst, 1)
+        self.max_connections = max_connections
+        self.max_tracked_ips = max_tracked_ips
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}  # ip -> [令牌数, 上次更新时间]
+        self.active = 0
+        self.counters = {"accepted": 0, "rejected_rate": 0, "rejected_full": 0, "rejected_banned": 0, "dropped_idle": 0, "dropped_deadline": 0}
+        self._reported = dict(self.counters)
+        self._last_report = clock()
+    
+    def configure(self, rate_per_min, burst, max_connections):
+        """配置重载时更新限制，已有的令牌桶和连接计数保留"""
+        with self._lock:
+            self.rate = rate_per_min / 60.0
+            self.burst = max(burst, 1)
+            self.max_connections = max_connections
+    
+    def admit(self, ip):
+        """判断是否接受来自ip的连接，接受后必须调用release"""
+        with self._lock:
+            now = self._clock()
+            if self.active >= self.max_connections:
+                self.counters["rejected_full"] += 1
+                return False
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                if len(self._buckets) >= self.max_tracked_ips:
+                    self._prune(now)
+                bucket = self._buckets[ip] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                self.counters["rejected_rate"] += 1
+                return False
+            bucket[0] -= 1
+            self.active += 1
+            self.counters["accepted"] += 1
+            return True
+    
+    def release(self):
+        with self._lock:
+            self.active -= 1
+    
+    def count(self, name):
+        """记录一次丢弃(封禁、空闲或超时)"""
+        with self._lock:
+            self.counters[name] += 1
+    
+    def merge(self, counts):
+        """累加伪装服务器工作进程中的计数"""
+        with self._lock:
+            for name, value in counts.items():
+                if name in self.counters:
+                    self.counters[name] += value
+    
+    def _prune(self, now):
+        """丢弃已经回满的令牌桶，仍然过多时清空"""
+        refill = self.burst / self.rate if self.rate > 0 else float('inf')
+        self._buckets = {ip: b for ip, b in self._buckets.items() if now - b[1] < refill}
+        if len(self._buckets) >= self.max_tracked_ips:
+            self._buckets.clear()
+    
+    def report(self, logger):
+        """距上次汇总超过REPORT_INTERVAL且有新的拒绝时输出一条汇总日志"""
+        with self._lock:
+            now = self._clock()
+            if now - self._last_report < self.REPORT_INTERVAL:
+                return
+            delta = {k: v - self._reported[k] for k, v in self.counters.items() if k != "accepted"}
+            self._reported = dict(self.counters)
+            self._last_report = now
+        if any(delta.values()):
+            logger.warning(f"伪装服务器准入控制：频率超限拒绝{delta['rejected_rate']}个，连接数已满拒绝{delta['rejected_full']}个，"
+                           f"IP封禁拒绝{delta['rejected_banned']}个，空闲丢弃{delta['dropped_idle']}个，超时丢弃{delta['dropped_deadline']}个")
@@ -0,0 +1,225 @@
+import datetime
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+
+CHECK_INTERVAL = 2  # 两次检查封禁文件修改时间的最小间隔(秒)，避免每个连接都stat一次
+_IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'  # ::ffff:0:0/96
+
+
+def parse_network(address, logger):
+    """解析IP或CIDR网段为(IP版本, 主机位数, 网络号)，无效时输出警告并返回None"""
+    address = str(address).strip()
+    if '/' not in address:  # 单个IP(封禁文件中的绝大多数条目)不经过ipaddress，加快大列表的重建
+        packed = pack_ip(address)
+        if packed is not None:
+            return packed[0], 0, packed[1]
+    try:
+        network = ipaddress.ip_network(address, strict=False)
+    except ValueError:
+        logger.warning(f"忽略无效的封禁IP: {address}")
+        return None
+    if network.version == 6 and network.prefixlen >= 96 and network.network_address.ipv4_mapped is not None:
+        network = ipaddress.ip_network(f"{network.network_address.ipv4_mapped}/{network.prefixlen - 96}")
+    host_bits = network.max_prefixlen - network.prefixlen
+    return network.version, host_bits, int(network.network_address) >> host_bits
+
+
+def pack_ip(ip):
+    """把地址字符串转换为(IP版本, 整数)，IPv4映射的IPv6地址按IPv4处理，无效时返回None"""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, ip.split('%', 1)[0])
+    except (OSError, ValueError):
+        return None
+    if packed[:12] == _IPV4_MAPPED_PREFIX:  # 双栈监听时IPv4客户端的地址
+        return 4, int.from_bytes(packed[12:], 'big')
+    return 6, int.from_bytes(packed, 'big')
+
+
+def parse_expires(value):
+    """解析服务器封禁文件中的过期时间，forever或无法解析时返回None(永久)"""
+    if not value or value == "forever":
+        return None
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S %z").timestamp()
+    except ValueError:
+        return None
+
+
+class BanFile:
+    """
+    服务器的封禁列表文件(banned-ips.json等)，只在修改时间变化时重新读取
+    读取失败时保留上次的内容
+    """
+    
+    def __init__(self, path, logger, clock=time.monotonic):
+        self.path = path
+        self.logger = logger
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = None
+        self.entries = []
+    
+    def refresh(self):
+        """文件有变化时重新读取，返回是否读取了新内容"""
+        if not self.path:
+            return False
+        with self._lock:
+            now = self._clock()
+            if self._checked is not None and now - self._checked < CHECK_INTERVAL:
+                return False
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            if mtime is None:
+                self.entries = []
+                return True
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    entries = json.load(file)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"读取封禁列表{self.path}失败，继续使用之前的内容: {e}")
+                return False
+            self.entries = entries if isinstance(entries, list) else []
+            return True
+
+
+class IPBanList:
+    """
+    IP/CIDR封禁表：按(IP版本, 前缀长度)分组，每组把网络号放入一个字典，
+    查询时只对表中出现过的前缀长度各做一次移位和哈希查找，耗时与条目数无关
+    条目来自服务器的banned-ips.json和插件配置中的banned_ips
+    """
+    
+    def __init__(self, server_file, extra, logger, clock=time.time):
+        self.logger = logger
+        self._clock = clock
+        self._file = BanFile(server_file, logger)
+        self._extra = list(extra)
+        self._extra_networks = self._parse_extra(extra)
+        self._index = {4: [], 6: []}  # 版本 -> [(主机位数, {网络号: 原因})]，按前缀从长到短
+        self._next_expiry = None  # 最早过期的条目的过期时间，到期后重建
+        self.size = 0
+        self._file.refresh()
+        self._rebuild()
+    
+    def configure(self, server_file, extra):
+        """配置重载，文件路径或插件列表变化时重建"""
+        if server_file == self._file.path and list(extra) == self._extra:
+            return
+        self._file = BanFile(server_file, self.logger)
+        self._extra = list(extra)
+        self._extra_networks = self._parse_extra(extra)
+        self._file.refresh()
+        self._rebuild()
+    
+    def _parse_extra(self, extra):
+        networks = (parse_network(item, self.logger) for item in extra)
+        return [(network, "插件封禁") for network in networks if network is not None]
+    
+    def _rebuild(self):
+        now = self._clock()
+        next_expiry = None
+        entries = []
+        for entry in self._file.entries:
+            if not isinstance(entry, dict):
+                continue
+            expires = parse_expires(entry.get("expires"))
+            if expires is not None:
+                if expires <= now:
+                    continue
+                next_expiry = expires if next_expiry is None else min(next_expiry, expires)
+            network = parse_network(entry.get("ip"), self.logger)
+            if network is not None:
+                entries.append((network, entry.get("reason") or "服务器封禁"))
+        
+        groups = {}
+        for (version, host_bits, value), reason in entries + self._extra_networks:
+            groups.setdefault((version, host_bits), {})[value] = reason
+        
+        index = {4: [], 6: []}
+        for (version, host_bits), networks in sorted(groups.items()):  # 先匹配更具体的网段
+            index[version].append((host_bits, networks))
+        self._index = index  # 整体替换，查询中的线程看到的要么是旧表要么是新表
+        self._next_expiry = next_expiry
+        self.size = sum(len(networks) for networks in groups.values())
+    
+    def lookup(self, ip):
+        """返回ip的封禁原因，未封禁返回None"""
+        if self._file.refresh() or (self._next_expiry is not None and self._clock() >= self._next_expiry):
+            self._rebuild()
+        packed = pack_ip(ip)
+        if packed is None:
+            return None
+        version, value = packed
+        for host_bits, networks in self._index[version]:
+            reason = networks.get(value >> host_bits)
+            if reason is not None:
+                return reason
+        return None
+
+
+class PlayerBanList:
+    """
+    服务器的玩家封禁列表(banned-players.json)，按小写玩家名和UUID建立索引
+    文件修改时间变化或有条目到期时重建
+    """
+    
+    def __init__(self, server_file, logger, clock=time.time):
+        self.logger = logger
+        self._clock = clock
+        self._file = BanFile(server_file, logger)
+        self._names = {}  # 小写玩家名 -> 原因
+        self._uuids = {}  # UUID字符串 -> 原因
+        self._next_expiry = None
+        self._file.refresh()
+        self._rebuild()
+    
+    def configure(self, server_file):
+        if server_file == self._file.path:
+            return
+        self._file = BanFile(server_file, self.logger)
+        self._file.refresh()
+        self._rebuild()
+    
+    def _rebuild(self):
+        now = self._clock()
+        names, uuids = {}, {}
+        next_expiry = None
+        for entry in self._file.entries:
+            if not isinstance(entry, dict):
+                continue
+            expires = parse_expires(entry.get("expires"))
+            if expires is not None:
+                if expires <= now:
+                    continue
+                next_expiry = expires if next_expiry is None else min(next_expiry, expires)
+            reason = entry.get("reason") or "服务器封禁"
+            if entry.get("name"):
+                names[str(entry["name"]).lower()] = reason
+            if entry.get("uuid"):
+                uuids[str(entry["uuid"]).lower()] = reason
+        self._names, self._uuids = names, uuids
+        self._next_expiry = next_expiry
+    
+    def lookup(self, name, player_uuid=None):
+        """返回玩家的封禁原因，未封禁返回None；有UUID时同时按UUID匹配(改名后仍然有效)"""
+        if self._file.refresh() or (self._next_expiry is not None and self._clock() >= self._next_expiry):
+            self._rebuild()
+        reason = self._names.get(name.lower())
+        if reason is None and player_uuid is not None:
+            reason = self._uuids.get(str(player_uuid))
+        return reason
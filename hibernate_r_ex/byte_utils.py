@@ -1,28 +1,11 @@
 import struct
-import socket
-import time
 import uuid
 
-
-def read_exactly(sock, n, timeout=5):
-    """读取指定长度的数据，超时或连接关闭时抛出异常"""
-    data = bytearray()
-    end_time = time.time() + timeout
-    while len(data) < n:
-        remaining = end_time - time.time()
-        if remaining <= 0:
-            raise socket.timeout(f'Timeout after {timeout} seconds')
-        sock.settimeout(remaining)
-        try:
-            chunk = sock.recv(n - len(data))
-            if not chunk:
-                raise ConnectionError("连接已关闭")
-            data.extend(chunk)
-        except socket.timeout:
-            raise
-        except:
-            raise
-    return bytes(data)
+# 预编译的定长数值格式，读取时使用unpack_from避免切片拷贝
+INT_STRUCT = struct.Struct(">i")
+USHORT_STRUCT = struct.Struct(">H")
+LONG_STRUCT = struct.Struct(">q")
+PONG_STRUCT = struct.Struct(">BBq")  # 长度(9) + 包ID(0x01) + 载荷
 
 
 def format_hex(data, sep=' ', prefix='', case='upper'):
@@ -48,7 +31,9 @@ class BytesReaderError(Exception):
 
 
 class BytesReader:
-    def __init__(self, data: bytes, i: int = 0):
+    """顺序读取协议数据，data可以是bytes或memoryview(零拷贝)"""
+    
+    def __init__(self, data, i: int = 0):
         self.data = data
         self.i = i  # 当前读取位置索引
     
@@ -59,6 +44,11 @@ class BytesReader:
         return self.data
     
     def read_varint(self):
+        byte_in = self.data[self.i]
+        if byte_in < 0x80:  # 单字节快速路径
+            self.i += 1
+            return byte_in
+        
         result = 0
         
         for j in range(6):
@@ -81,7 +71,7 @@ class BytesReader:
         
         old_i = self.i
         self.i += length
-        return self.data[old_i:self.i].decode('utf-8')
+        return str(self.data[old_i:self.i], 'utf-8')
     
     def read_bytes(self, size):
         if self.i + size > len(self.data):
@@ -105,7 +95,7 @@ class BytesReader:
         
         old_i = self.i
         self.i += 4
-        return struct.unpack(">i", self.data[old_i:self.i])[0]
+        return INT_STRUCT.unpack_from(self.data, old_i)[0]
     
     def read_ushort(self):
         if self.i + 2 > len(self.data):
@@ -113,7 +103,7 @@ class BytesReader:
         
         old_i = self.i
         self.i += 2
-        return struct.unpack(">H", self.data[old_i:self.i])[0]
+        return USHORT_STRUCT.unpack_from(self.data, old_i)[0]
     
     def read_long(self):
         if self.i + 8 > len(self.data):
@@ -121,7 +111,7 @@ class BytesReader:
         
         old_i = self.i
         self.i += 8
-        return struct.unpack(">q", self.data[old_i:self.i])[0]
+        return LONG_STRUCT.unpack_from(self.data, old_i)[0]
     
     def read_uuid(self):
         # 编码为无符号的 128 位整数uuid，16bytes
@@ -130,7 +120,7 @@ class BytesReader:
         
         old_i = self.i
         self.i += 16
-        return uuid.UUID(bytes=self.data[old_i:self.i])
+        return uuid.UUID(bytes=bytes(self.data[old_i:self.i]))
     
     def unread(self, length):
         if length > self.i:
@@ -139,15 +129,107 @@ class BytesReader:
         return self.i
 
 
+MAX_PACKET_SIZE = 2097151  # 协议允许的最大数据包长度(3字节VarInt)
+RECV_BUFFER_SIZE = 4096
+
+
+class PacketFramer:
+    """
+    增量解析VarInt长度前缀的数据包
+    数据通过recv_buffer()+commit()直接recv_into到可复用的缓冲区，或通过feed()写入，
+    next_packet()返回指向缓冲区的BytesReader(零拷贝)，仅在下一次recv_buffer()/feed()前有效
+    """
+    
+    def __init__(self, max_packet_size=MAX_PACKET_SIZE, buffer_size=RECV_BUFFER_SIZE):
+        self.max_packet_size = max_packet_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # 未处理数据起点
+        self._end = 0  # 有效数据终点
+        self._need = 0  # 当前未完整数据包所需的总字节数(从_start算起)
+    
+    def pending(self):
+        """返回尚未处理的数据"""
+        return self._view[self._start:self._end]
+    
+    def recv_buffer(self):
+        """返回可写入的空闲缓冲区，必要时整理或扩容以容纳正在接收的数据包"""
+        if self._start == self._end:
+            self._start = self._end = 0
+        
+        size = len(self._buffer)
+        pending = self._end - self._start
+        need = max(self._need, pending + 1)
+        if need > size:  # 扩容，新建缓冲区使旧的BytesReader保持有效
+            new_buffer = bytearray(max(need, size * 2))
+            new_view = memoryview(new_buffer)
+            new_view[:pending] = self._view[self._start:self._end]
+            self._buffer, self._view = new_buffer, new_view
+            self._start, self._end = 0, pending
+        elif self._start + need > size or self._end == size:  # 将剩余数据移动到缓冲区头部
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        return self._view[self._end:]
+    
+    def commit(self, n):
+        """确认recv_into写入了n字节"""
+        self._end += n
+    
+    def feed(self, data):
+        """写入一段数据"""
+        self._need = max(self._need, self._end - self._start + len(data))
+        self.recv_buffer()[:len(data)] = data
+        self.commit(len(data))
+    
+    def next_packet(self):
+        """取出下一个完整数据包(不含长度前缀)，数据不足时返回None"""
+        view = self._view
+        i = self._start
+        length = 0
+        for j in range(3):
+            if i >= self._end:
+                return None
+            byte_in = view[i]
+            i += 1
+            length |= (byte_in & 0x7F) << (j * 7)
+            if (byte_in & 0x80) != 0x80:
+                break
+        else:
+            raise BytesReaderError("Packet length varint too long")
+        
+        if length > self.max_packet_size:
+            raise BytesReaderError(f"Packet too large [{length}]>[{self.max_packet_size}]")
+        if self._end - i < length:
+            self._need = i - self._start + length
+            return None
+        
+        self._start = i + length
+        self._need = 0
+        return BytesReader(view[i:self._start])
+
+
+# 单字节VarInt的预编码结果
+_SMALL_VARINTS = [bytes((i,)) for i in range(0x80)]
+
+
+def encode_varint(value):
+    """将32位整数编码为VarInt，负数按补码处理"""
+    if 0 <= value < 0x80:
+        return _SMALL_VARINTS[value]
+    out = bytearray()
+    write_varint(out, value)
+    return bytes(out)
+
+
 def write_varint(byte, value):
-    while True:
-        part = value & 0x7F
+    if 0 <= value < 0x80:  # 单字节快速路径
+        byte.append(value)
+        return
+    value &= 0xFFFFFFFF
+    while value >= 0x80:
+        byte.append(value & 0x7F | 0x80)
         value >>= 7
-        if value != 0:
-            part |= 0x80
-        byte.append(part)
-        if value == 0:
-            break
+    byte.append(value)
 
 
 def write_byte(byte: bytearray, value):
@@ -155,26 +237,78 @@ def write_byte(byte: bytearray, value):
 
 
 def write_ushort(byte: bytearray, value):
-    byte += struct.pack(">H", value)
+    byte += USHORT_STRUCT.pack(value)
 
 
 def write_long(byte: bytearray, value):
-    byte += struct.pack(">q", value)
+    byte += LONG_STRUCT.pack(value)
 
 
 def write_utf(byte: bytearray, value):
-    write_varint(byte, len(value))
-    byte.extend(value.encode('utf-8'))
+    data = value.encode('utf-8')
+    write_varint(byte, len(data))  # 长度为utf-8编码后的字节数
+    byte += data
+
+
+class PacketWriter:
+    """
+    构建单个数据包：在缓冲区头部预留3字节(最大包长的VarInt长度)，
+    写完后回填长度前缀，整个过程只有一块缓冲区，不需要再拼接
+    """
+    
+    RESERVED = 3
+    
+    def __init__(self, packet_id):
+        self.buffer = bytearray(self.RESERVED)
+        write_varint(self.buffer, packet_id)
+    
+    def write_varint(self, value):
+        write_varint(self.buffer, value)
+        return self
+    
+    def write_byte(self, value):
+        self.buffer.append(value & 0xff)
+        return self
+    
+    def write_bytes(self, data):
+        self.buffer += data
+        return self
+    
+    def write_utf(self, value):
+        write_utf(self.buffer, value)
+        return self
+    
+    def write_ushort(self, value):
+        self.buffer += USHORT_STRUCT.pack(value)
+        return self
+    
+    def write_long(self, value):
+        self.buffer += LONG_STRUCT.pack(value)
+        return self
+    
+    def finish(self):
+        """回填长度前缀，返回完整数据包"""
+        length = len(self.buffer) - self.RESERVED
+        if length > MAX_PACKET_SIZE:  # 长度前缀超过预留的3字节
+            raise ValueError(f"数据包长度{length}超过上限{MAX_PACKET_SIZE}")
+        prefix = encode_varint(length)
+        start = self.RESERVED - len(prefix)
+        self.buffer[start:self.RESERVED] = prefix
+        return bytes(memoryview(self.buffer)[start:])
+
+
+def build_str_response(packet_id, response):
+    """构建带长度前缀的完整字符串响应数据包，可预先构建后重复发送"""
+    data = response.encode('utf-8')
+    body = encode_varint(packet_id) + encode_varint(len(data)) + data
+    return encode_varint(len(body)) + body
+
+
+def build_pong(value):
+    """构建Pong Response数据包，整包由一个预编译结构一次打包"""
+    return PONG_STRUCT.pack(9, 0x01, value)
 
 
 def write_str_response(client_socket, packet_id, response):
-    # 写入包头：packet_id
-    response_array = bytearray()
-    write_byte(response_array, packet_id)
-    # 写入字符串
-    write_utf(response_array, response)
-    # 写入长度
-    length = bytearray()
-    write_varint(length, len(response_array))
     # 发送数据
-    client_socket.sendall(bytes(length) + bytes(response_array))
\ No newline at end of file
+    client_socket.sendall(build_str_response(packet_id, response))
@@ -1,3 +1,5 @@
+import os
+
 from mcdreforged.api.all import *
 
 class Config(Serializable):
@@ -6,6 +8,7 @@ class Config(Serializable):
     blacklist_player: list = []
     whitelist_player: list = []
     whitelist_match_mode: bool = False
+    player_list_sync_sec: int = 1800  # 在线玩家集合由日志维护，超过此间隔(秒)未校准时才通过list命令重新获取
     ip: str = "0.0.0.0"
     port: int = 25565
     protocol: int = 2
@@ -14,6 +17,58 @@ class Config(Serializable):
     kick_message: str = "§e§l请求成功！\n\n§f服务器正在启动！请稍作等待后进入"
     server_icon: str = "./server/server-icon.png"
     samples: list = ["服务器正在休眠", "进入服务器以唤醒"]
+    follow_client_protocol: bool = False  # 状态响应中使用客户端的协议版本而不是protocol
+    listener_mode: str = "thread"  # thread: 单线程逐个处理连接 asyncio: 并发处理所有连接 process: 在多个工作进程中监听(需要fork和SO_REUSEPORT，例如Linux)
+    fs_workers: int = 0  # process模式的工作进程数，0为CPU核心数
+    fs_max_connections: int = 64  # 伪装服务器同时处理的最大连接数
+    fs_ip_rate_per_min: int = 30  # 每个IP每分钟允许的连接数
+    fs_ip_burst: int = 10  # 每个IP允许的突发连接数
+    fs_connection_deadline: float = 10  # 每个连接的总处理时间上限(秒)
+    fs_first_byte_timeout: float = 2  # 连接后多久未发送数据则丢弃(秒)
+    fs_log_level: str = "summary"  # off: 不输出连接日志 summary: 每个连接一条汇总 packet: 额外输出每个数据包的内容
+    fs_log_sample: int = 1  # 每N个连接输出一个的日志，唤醒服务器的登录请求总是输出
+    fs_capture_size: int = 0  # 保存最近收到的N段原始数据，可用!!hr capture导出，0为关闭
+    metrics_port: int = 0  # 大于0时在该端口以Prometheus文本格式提供/metrics
+    metrics_host: str = "127.0.0.1"
+    predict_enabled: bool = False  # 根据历史登录时间预测玩家到达，提前启动服务器并推迟停服
+    predict_lead_sec: int = 300  # 在预测的到达时间前多久启动服务器，应不小于服务器启动耗时
+    predict_threshold: float = 0.5  # 历史上同一时间段有玩家到达的周数比例达到此值时才预热/推迟
+    predict_defer_sec: int = 600  # 停服前检查此时间内是否可能有玩家加入，每次推迟的秒数
+    predict_max_defer_sec: int = 1800  # 每次空闲最多推迟停服的总秒数
+    predict_bucket_min: int = 15  # 一周按此分钟数划分时间段
+    predict_history_days: int = 56  # 登录历史的保留天数
+    predict_min_weeks: int = 2  # 历史至少覆盖的周数，不足时不预测
+    config_watch_sec: int = 0  # 大于0时按此间隔检查配置文件和服务器图标的修改时间，有变化时自动重载
+    thrash_window_sec: int = 3600  # 统计空唤醒(登录唤醒后直到关闭都无人进入)的时间窗(秒)
+    thrash_enter_cycles: int = 3  # 时间窗内空唤醒达到此次数时延长空闲等待时间
+    thrash_exit_cycles: int = 1  # 时间窗内空唤醒降到此次数及以下时恢复，应小于thrash_enter_cycles
+    thrash_wait_multiplier: float = 3.0  # 延长时空闲等待时间为wait_sec的倍数
+    thrash_max_wait_sec: int = 3600  # 延长后的空闲等待时间上限(秒)
+    wake_ban_after: int = 2  # 同一玩家名或IP在时间窗内空唤醒达到此次数时暂时拒绝其唤醒，0为关闭
+    wake_ban_sec: int = 1800  # 拒绝唤醒的时长(秒)
+    wake_ban_message: str = "§c你近期多次唤醒服务器后未进入\n§f请稍后再试"
+    server_banned_ips: str = "./server/banned-ips.json"  # 服务器的IP封禁列表，修改后自动重新读取，留空则不读取
+    banned_ips: list = []  # 插件额外封禁的IP或CIDR网段，例如"10.0.0.0/8"
+    ip_ban_message: str = "§c你的IP已被封禁"
+    server_banned_players: str = "./server/banned-players.json"  # 服务器的玩家封禁列表，修改后自动重新读取，留空则不读取
+    player_ban_message: str = "§c你已被服务器封禁"
+    name_reject_message: str = "§c你不在可以唤醒服务器的玩家名单中"  # 玩家名不符合黑名单/白名单规则时的踢出消息
+    online_auth: bool = False  # 唤醒前进行正版验证，需要安装cryptography库
+    session_server: str = "https://sessionserver.mojang.com"  # 会话服务器地址，可改为本地测试桩或第三方验证服务器
+    online_auth_timeout: float = 5  # 查询会话服务器的超时(秒)
+    online_auth_cache_sec: int = 600  # 验证通过的玩家名在此时间内重连不再重复验证，0为不缓存
+    online_auth_message: str = "§c正版验证失败，只有正版玩家可以唤醒服务器"
+    boot_status: bool = False  # 服务器启动期间伪装服务器继续响应状态请求并显示启动进度
+    boot_motd: str = "§e服务器正在启动，请稍候\n§7{progress}"  # {progress}替换为当前进度
+    boot_version_text: str = "§6Starting"
+    boot_progress_pattern: str = "Preparing spawn area: (?P<progress>\\d+%)"  # 从服务器日志中提取进度的正则
+    boot_release_pattern: str = "Starting minecraft server version"  # 匹配的日志出现后释放端口，必须在服务器绑定端口之前输出
+    proxy_mode: bool = False  # 透明代理唤醒：保持登录连接直到服务器启动，之后转发到proxy_backend_port，需要把服务器端口改为该端口
+    proxy_backend_ip: str = "127.0.0.1"
+    proxy_backend_port: int = 25566
+    proxy_buffer_size: int = 65536  # 每个转发方向的缓冲区大小
+    proxy_wait_timeout: int = 300  # 等待服务器启动的最长时间(秒)，超时则发送kick_message
+    proxy_keepalive_sec: int = 10  # 等待期间发送保活请求的间隔(秒)
     
     
 config: Config
@@ -21,10 +76,20 @@ config_path = "config.json"
 
 
 def get_config():
-    global config
     return config
 
 # 检查设置文件
 def load_config_file(server: PluginServerInterface):
     global config
     config = server.load_config_simple(config_path, target_class=Config)
+
+# 重新读取设置文件，读取失败时抛出异常并保留当前设置
+def reload_config_file(server: PluginServerInterface):
+    global config
+    new_config = server.load_config_simple(config_path, target_class=Config, failure_policy='raise')
+    old_config, config = config, new_config
+    return old_config, new_config
+
+# 设置文件的完整路径，用于检查修改时间
+def get_config_file_path(server: PluginServerInterface):
+    return os.path.join(server.get_data_folder(), config_path)
@@ -0,0 +1,42 @@
+import threading
+
+HANDOVER_GRACE_SEC = 10  # 插件卸载后等待重载的模块接收监听socket的时间，超时关闭
+
+
+class Handover:
+    """
+    插件重载时上一个模块交给新模块的状态：监听socket、倒计时剩余时间、状态响应缓存和在线玩家
+    新旧模块的类互不相同，socket以外只包含内置类型；卸载后没有模块接收时，宽限期结束关闭监听socket
+    """
+    
+    def __init__(self, logger, listener, countdown, status, players, grace_sec=HANDOVER_GRACE_SEC):
+        self.logger = logger
+        self.listener = listener  # 仍在监听但无人accept的socket，连接在backlog中排队
+        self.countdown = countdown  # TimerManager.export_countdown
+        self.status = status  # FakeServerSocket.export_status
+        self.players = players  # PlayerTracker.export_state
+        self._lock = threading.Lock()
+        self._taken = False
+        self._timer = None
+        if listener is not None:
+            self._timer = threading.Timer(grace_sec, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def take(self):
+        """新模块接收交接的状态，只能接收一次，之后宽限期关闭不再生效，返回自身或None"""
+        with self._lock:
+            if self._taken:
+                return None
+            self._taken = True
+        if self._timer is not None:
+            self._timer.cancel()
+        return self
+    
+    def _expire(self):
+        with self._lock:
+            if self._taken:
+                return
+            self._taken = True
+        self.listener.close()
+        self.logger.info("没有重载的插件接收监听socket，伪装服务器已关闭")
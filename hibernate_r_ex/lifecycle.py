@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+import traceback
+
+from .metrics import metrics
+
+# 生命周期状态
+STATE_RUNNING = "running"  # 服务器运行中
+STATE_STOPPING = "stopping"  # 已发出停服命令，等待服务器关闭
+STATE_HIBERNATED = "hibernated"  # 服务器已关闭，伪装服务器监听
+STATE_WAKING = "waking"  # 服务器启动中
+STATE_STOPPED = "stopped"  # 服务器意外关闭，不启动伪装服务器
+TRANSITIONAL_STATES = (STATE_WAKING, STATE_STOPPING)
+
+
+class Lifecycle:
+    """
+    生命周期执行器：服务器与伪装服务器的启停命令放入队列，由一个常驻线程依次执行
+    状态只在该线程内切换，不同事件的处理不会交错；过渡状态(唤醒/休眠)的耗时按切换记录
+    threaded为False时不启动线程，由外部调用run_pending在调用线程中执行(用于模拟)
+    """
+    
+    def __init__(self, logger, state, clock=time.monotonic, threaded=True):
+        self.logger = logger
+        self._clock = clock
+        self._queue = queue.SimpleQueue()
+        self.state = state
+        self.since = clock()
+        self._state_timer = metrics.state_timer("hr_server_state_seconds_total", "服务器各状态累计时长")
+        self._state_timer.enter(state)
+        metrics.gauge("hr_lifecycle_queue_size", "等待执行的生命周期命令数", func=self._queue.qsize)
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(target=self._run, name="HibernateR-Lifecycle", daemon=True)
+            self._thread.start()
+    
+    def submit(self, func, *args):
+        """可在任意线程调用，命令在生命周期线程中按提交顺序执行"""
+        self._queue.put((func, args))
+    
+    def enter(self, state):
+        """切换状态，只应在生命周期线程中调用(插件加载时除外)，返回离开的状态已持续的秒数"""
+        now = self._clock()
+        previous, elapsed = self.state, now - self.since
+        if state == previous:
+            return 0.0
+        self.state, self.since = state, now
+        self._state_timer.enter(state)
+        if previous in TRANSITIONAL_STATES:
+            metrics.histogram("hr_lifecycle_transition_seconds", "唤醒/休眠过渡耗时",
+                              {"transition": f"{previous}->{state}"}).observe(elapsed)
+            self.logger.info(f"生命周期：{previous} → {state}，用时{elapsed:.1f}s")
+        else:
+            self.logger.info(f"生命周期：{previous} → {state}")
+        return elapsed
+    
+    def in_worker(self):
+        return threading.current_thread() is self._thread
+    
+    def run_pending(self):
+        """不启动线程时在调用线程中执行已提交的命令(包括执行期间新提交的)，返回执行的命令数"""
+        count = 0
+        while not self._queue.empty():
+            self._execute(self._queue.get())
+            count += 1
+        return count
+    
+    def close(self, timeout=10):
+        """执行完已提交的命令后结束线程"""
+        if self._thread is None:
+            self.run_pending()
+            return
+        self._queue.put(None)
+        if not self.in_worker():
+            self._thread.join(timeout)
+    
+    def _run(self):
+        while True:
+            command = self._queue.get()
+            if command is None:
+                return
+            self._execute(command)
+    
+    def _execute(self, command):
+        func, args = command
+        try:
+            func(*args)
+        except Exception:
+            self.logger.error(f"生命周期命令执行出错: {traceback.format_exc()}")
@@ -0,0 +1,303 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 默认的耗时分桶(秒)，覆盖从状态响应到服务器启动的范围
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def _format_seconds(value):
+    if value < 1:
+        return f"{value * 1000:.1f}ms"
+    if value < 3600:
+        return f"{value:.1f}s"
+    return f"{value / 3600:.2f}h"
+
+
+class Counter:
+    """只增的计数器，func不为None时取值来自回调(用于暴露已有的计数)"""
+    
+    type = "counter"
+    
+    def __init__(self, lock, func=None):
+        self._lock = lock
+        self._func = func
+        self.value = 0
+    
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+    
+    def get(self):
+        return self._func() if self._func is not None else self.value
+    
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)}", self.get()
+    
+    def describe(self):
+        return f"{self.get():g}"
+
+
+class Gauge(Counter):
+    """可增减的瞬时值"""
+    
+    type = "gauge"
+    
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class Histogram:
+    """固定分桶的直方图，observe只做一次二分查找和几次加法"""
+    
+    type = "histogram"
+    
+    def __init__(self, lock, buckets=DEFAULT_BUCKETS):
+        self._lock = lock
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个是+Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+    
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+    
+    def time(self):
+        """with metrics.histogram(...).time(): 记录代码块耗时"""
+        return _Timer(self)
+    
+    def quantile(self, q):
+        """根据分桶估计分位数(返回所在桶的上界)"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            maximum = self.max
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, maximum)
+        return maximum
+    
+    def samples(self, name, labels):
+        with self._lock:
+            counts = list(self.counts)
+            total, value_sum = self.count, self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))}", cumulative
+        yield f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))}", total
+        yield f"{name}_sum{_format_labels(labels)}", value_sum
+        yield f"{name}_count{_format_labels(labels)}", total
+    
+    def describe(self):
+        if self.count == 0:
+            return "无记录"
+        return (f"{self.count}次，平均{_format_seconds(self.sum / self.count)}，p50≤{_format_seconds(self.quantile(0.5))}，"
+                f"p99≤{_format_seconds(self.quantile(0.99))}，最大{_format_seconds(self.max)}")
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class StateTimer:
+    """累计每个状态持续的时间，例如服务器运行和休眠的总时长"""
+    
+    type = "counter"
+    
+    def __init__(self, lock, clock=time.monotonic):
+        self._lock = lock
+        self._clock = clock
+        self.totals = {}
+        self.state = None
+        self.since = clock()
+    
+    def enter(self, state):
+        with self._lock:
+            now = self._clock()
+            if self.state is not None:
+                self.totals[self.state] = self.totals.get(self.state, 0.0) + now - self.since
+            self.state = state
+            self.since = now
+    
+    def snapshot(self):
+        """各状态的累计时长，包括当前状态已持续的时间"""
+        with self._lock:
+            totals = dict(self.totals)
+            if self.state is not None:
+                totals[self.state] = totals.get(self.state, 0.0) + self._clock() - self.since
+        return totals
+    
+    def samples(self, name, labels):
+        for state, value in self.snapshot().items():
+            yield f"{name}{_format_labels(labels, ('state', state))}", value
+    
+    def describe(self):
+        totals = self.snapshot()
+        if not totals:
+            return "无记录"
+        return "，".join(f"{state} {_format_seconds(value)}" for state, value in totals.items()) + f"(当前: {self.state})"
+
+
+class Metrics:
+    """
+    插件内的指标注册表，按(名称, 标签)存放计数器、直方图和状态计时
+    所有指标共用一把锁，更新只是几次加法，可以常开
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # (名称, 标签) -> 指标，保持注册顺序
+        self._help = {}
+    
+    def _get(self, factory, name, help_text, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        metric = self._metrics.get(key)
+        if metric is None or kwargs.get("func") is not None:  # 回调型指标重新注册时替换
+            metric = self._metrics[key] = factory(self._lock, **kwargs)
+            self._help.setdefault(name, help_text)
+        return metric
+    
+    def counter(self, name, help_text, labels=None, func=None) -> Counter:
+        return self._get(Counter, name, help_text, labels, func=func)
+    
+    def gauge(self, name, help_text, labels=None, func=None) -> Gauge:
+        return self._get(Gauge, name, help_text, labels, func=func)
+    
+    def histogram(self, name, help_text, labels=None, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+    
+    def state_timer(self, name, help_text, labels=None) -> StateTimer:
+        return self._get(StateTimer, name, help_text, labels)
+    
+    def export_totals(self):
+        """计数器和直方图的当前累计值(不含回调型指标)，用于汇总伪装服务器工作进程中的指标"""
+        totals = {}
+        with self._lock:
+            for key, metric in self._metrics.items():
+                if type(metric) is Counter and metric._func is None:
+                    totals[key] = metric.value
+                elif type(metric) is Histogram:
+                    totals[key] = (list(metric.counts), metric.sum, metric.count, metric.max)
+        return totals
+    
+    @staticmethod
+    def diff_totals(current, base):
+        """两次export_totals之间的增量，没有变化的指标不包含在内"""
+        delta = {}
+        for key, value in current.items():
+            old = base.get(key)
+            if isinstance(value, tuple):
+                if old is None:
+                    old = ([0] * len(value[0]), 0.0, 0, 0.0)
+                if value[2] != old[2]:
+                    delta[key] = ([a - b for a, b in zip(value[0], old[0])], value[1] - old[1], value[2] - old[2], value[3])
+            elif value != (old or 0):
+                delta[key] = value - (old or 0)
+        return delta
+    
+    def merge_totals(self, delta):
+        """把其他进程的指标增量累加到本进程的同名指标上，本进程没有注册的指标忽略"""
+        with self._lock:
+            for key, value in delta.items():
+                metric = self._metrics.get(key)
+                if isinstance(value, tuple):
+                    if type(metric) is Histogram and len(value[0]) == len(metric.counts):
+                        metric.counts = [a + b for a, b in zip(metric.counts, value[0])]
+                        metric.sum += value[1]
+                        metric.count += value[2]
+                        metric.max = max(metric.max, value[3])
+                elif type(metric) is Counter and metric._func is None:
+                    metric.value += value
+    
+    def renew_lock(self):
+        """fork出的子进程中调用：换用新锁，避免继承fork时被其他线程持有的锁"""
+        self._lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._lock = self._lock
+    
+    def render_prometheus(self):
+        """生成Prometheus文本格式"""
+        lines = []
+        described = set()
+        for (name, labels), metric in list(self._metrics.items()):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric.type}")
+            for sample, value in metric.samples(name, labels):
+                lines.append(f"{sample} {value!r}")
+        return "\n".join(lines) + "\n"
+    
+    def describe(self):
+        """!!hr stats使用的可读文本，每个指标一行"""
+        lines = []
+        for (name, labels), metric in list(self._metrics.items()):
+            lines.append(f"{self._help[name]}{_format_labels(labels)}: {metric.describe()}")
+        return lines
+
+
+class MetricsHTTPServer:
+    """在本地端口以Prometheus文本格式提供/metrics"""
+    
+    def __init__(self, metrics: Metrics, host, port):
+        handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="HibernateR-Metrics", daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics: Metrics = None
+    
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):  # 不输出访问日志
+        pass
+
+
+# 插件全局的指标注册表
+metrics = Metrics()
@@ -0,0 +1,226 @@
+import collections
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+import uuid
+
+try:  # 可选依赖，只有开启在线验证时需要
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    try:
+        from cryptography.hazmat.decrepit.ciphers.modes import CFB8
+    except ImportError:  # 43.0之前的版本
+        CFB8 = modes.CFB8
+except ImportError:
+    rsa = None
+
+from .byte_utils import BytesReader, PacketWriter
+
+AVAILABLE = rsa is not None
+SHOULD_AUTHENTICATE_MIN_PROTOCOL = 766  # 1.20.5起加密请求带有"是否进行验证"字段
+SIGNED_LOGIN_PROTOCOLS = (759, 760)  # 1.19~1.19.2的加密响应可以用签名代替验证令牌
+VERIFY_TOKEN_SIZE = 4
+CACHE_MAX_SIZE = 1024  # 验证结果缓存的最大条目数
+
+
+class AuthError(Exception):
+    pass
+
+
+class SignedResponseError(AuthError):
+    """客户端使用签名代替验证令牌：不支持验证，但共享密钥已解出，可以加密发送断开消息"""
+    
+    def __init__(self, secret):
+        super().__init__("客户端使用签名代替验证令牌，不支持")
+        self.secret = secret
+
+
+def server_hash(*parts):
+    """Minecraft的服务器哈希：SHA1摘要按有符号大整数输出为十六进制"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part)
+    value = int.from_bytes(digest.digest(), 'big', signed=True)
+    return format(value, 'x') if value >= 0 else '-' + format(-value, 'x')
+
+
+class EncryptedSocket:
+    """启用加密后的发送端，把数据经AES/CFB8加密后交给原来的socket或包装对象"""
+    
+    def __init__(self, sock, secret):
+        self.sock = sock
+        self._encryptor = Cipher(algorithms.AES(secret), CFB8(secret)).encryptor()
+    
+    def sendall(self, data):
+        self.sock.sendall(self._encryptor.update(bytes(data)))
+
+
+class SessionClient:
+    """
+    会话服务器的HTTP客户端，保持少量长连接复用，避免每次验证都重新建立TLS连接
+    连接出错时丢弃并用新连接重试一次
+    """
+    
+    def __init__(self, url, timeout, pool_size=4):
+        parsed = urllib.parse.urlsplit(url.rstrip('/'))
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"无效的会话服务器地址: {url}")
+        self.url = url
+        self._https = parsed.scheme == "https"
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._base_path = parsed.path
+        self.timeout = timeout
+        self._pool_size = pool_size
+        self._pool = []
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        factory = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+        return factory(self._host, self._port, timeout=self.timeout)
+    
+    def get(self, path, params):
+        """发送GET请求，返回(状态码, 响应体)"""
+        target = self._base_path + path + "?" + urllib.parse.urlencode(params)
+        for attempt in range(2):
+            with self._lock:
+                connection = self._pool.pop() if self._pool else None
+            reused = connection is not None
+            if connection is None:
+                connection = self._connect()
+            try:
+                connection.request("GET", target, headers={"Connection": "keep-alive"})
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if reused and attempt == 0:  # 空闲的长连接可能已被服务器关闭
+                    continue
+                if isinstance(e, OSError):
+                    raise
+                raise OSError(f"HTTP错误[{e!r}]") from e
+            if response.will_close:
+                connection.close()
+            else:
+                with self._lock:
+                    if len(self._pool) < self._pool_size:
+                        self._pool.append(connection)
+                        connection = None
+                if connection is not None:
+                    connection.close()
+            return response.status, body
+    
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, []
+        for connection in pool:
+            connection.close()
+
+
+class OnlineAuth:
+    """
+    伪装服务器的在线(正版)验证：与客户端完成加密握手后向会话服务器查询hasJoined，
+    验证通过的玩家名→UUID按TTL缓存，唤醒后玩家重连时不再重复验证
+    """
+    
+    def __init__(self, config, clock=time.monotonic):
+        if not AVAILABLE:
+            raise AuthError("在线验证需要安装cryptography库")
+        self._clock = clock
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+        self.public_key = self._key.public_key().public_bytes(serialization.Encoding.DER,
+                                                             serialization.PublicFormat.SubjectPublicKeyInfo)
+        self._cache = collections.OrderedDict()  # 小写玩家名 -> (玩家名, UUID, 过期时间)
+        self._cache_lock = threading.Lock()
+        self.session = None
+        self.configure(config)
+    
+    def configure(self, config):
+        self.cache_sec = config.online_auth_cache_sec
+        session = self.session
+        if session is None or session.url != config.session_server or session.timeout != config.online_auth_timeout:
+            self.session = SessionClient(config.session_server, config.online_auth_timeout)
+            if session is not None:
+                session.close()
+    
+    def close(self):
+        self.session.close()
+    
+    def cached(self, name):
+        """返回缓存中验证过的(玩家名, UUID)，没有或已过期返回None"""
+        with self._cache_lock:
+            entry = self._cache.get(name.lower())
+            if entry is None:
+                return None
+            if entry[2] <= self._clock():
+                del self._cache[name.lower()]
+                return None
+            return entry[0], entry[1]
+    
+    def remember(self, name, player_uuid):
+        if self.cache_sec <= 0:
+            return
+        with self._cache_lock:
+            self._cache[name.lower()] = (name, player_uuid, self._clock() + self.cache_sec)
+            self._cache.move_to_end(name.lower())
+            while len(self._cache) > CACHE_MAX_SIZE:
+                self._cache.popitem(last=False)
+    
+    def build_encryption_request(self, protocol):
+        """返回(加密请求数据包, 验证令牌)"""
+        # https://minecraft.wiki/w/Java_Edition_protocol#Encryption_Request
+        token = os.urandom(VERIFY_TOKEN_SIZE)
+        writer = (PacketWriter(0x01).write_utf("")  # 服务器ID，现在总是空字符串
+                  .write_varint(len(self.public_key)).write_bytes(self.public_key)
+                  .write_varint(len(token)).write_bytes(token))
+        if protocol is not None and protocol >= SHOULD_AUTHENTICATE_MIN_PROTOCOL:
+            writer.write_byte(1)
+        return writer.finish(), token
+    
+    def read_encryption_response(self, reader: BytesReader, protocol, token):
+        """解析加密响应并校验令牌，返回共享密钥"""
+        # https://minecraft.wiki/w/Java_Edition_protocol#Encryption_Response
+        encrypted_secret = bytes(reader.read_bytes(reader.read_varint()))
+        if protocol in SIGNED_LOGIN_PROTOCOLS and not reader.read_byte():
+            raise SignedResponseError(self._decrypt_secret(encrypted_secret))
+        encrypted_token = bytes(reader.read_bytes(reader.read_varint()))
+        secret = self._decrypt_secret(encrypted_secret)
+        if self._decrypt(encrypted_token) != token:
+            raise AuthError("验证令牌不匹配")
+        return secret
+    
+    def _decrypt(self, data):
+        try:
+            return self._key.decrypt(data, padding.PKCS1v15())
+        except ValueError as e:
+            raise AuthError(f"解密失败[{e}]")
+    
+    def _decrypt_secret(self, encrypted_secret):
+        secret = self._decrypt(encrypted_secret)
+        if len(secret) != 16:
+            raise AuthError("共享密钥长度错误")
+        return secret
+    
+    def server_hash(self, secret):
+        return server_hash(b"", secret, self.public_key)
+    
+    def has_joined(self, name, digest):
+        """
+        向会话服务器查询玩家是否已通过客户端加入本服务器(阻塞，应在监听线程外调用)
+        返回(玩家名, UUID)，未通过验证返回None，网络错误时抛出OSError
+        """
+        status, body = self.session.get("/session/minecraft/hasJoined", {"username": name, "serverId": digest})
+        if status == 204 or (status == 200 and not body):
+            return None
+        if status != 200:
+            raise OSError(f"会话服务器返回{status}")
+        try:
+            profile = json.loads(body)
+            return profile["name"], uuid.UUID(profile["id"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise OSError(f"会话服务器响应无效[{e}]")
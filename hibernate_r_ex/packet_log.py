@@ -0,0 +1,63 @@
+import collections
+import itertools
+import time
+from typing import NamedTuple
+
+from .byte_utils import format_hex
+
+# 伪装服务器日志级别
+LOG_OFF = "off"  # 不输出连接日志
+LOG_SUMMARY = "summary"  # 每个连接结束时输出一条汇总
+LOG_PACKET = "packet"  # 额外输出每个数据包的十六进制内容
+LOG_LEVELS = (LOG_OFF, LOG_SUMMARY, LOG_PACKET)
+
+CAPTURE_MAX_BYTES = 1024  # 抓包环中每条记录最多保存的字节数
+
+
+class LogSampler:
+    """每every个连接采样一个，用于在端口扫描等大量连接时限制日志量"""
+    
+    def __init__(self, every):
+        self.every = max(int(every), 1)
+        self._counter = itertools.count()
+    
+    def sample(self):
+        return next(self._counter) % self.every == 0
+
+
+class CapturedData(NamedTuple):
+    time: float
+    address: str
+    data: bytes  # 截断到CAPTURE_MAX_BYTES
+    size: int  # 原始长度
+
+
+class PacketCapture:
+    """
+    最近收到的原始数据的有界环形缓冲区，记录时只做一次拷贝，
+    十六进制格式化推迟到!!hr capture导出时进行
+    """
+    
+    def __init__(self, capacity):
+        self._ring = collections.deque(maxlen=capacity)
+    
+    def add(self, address, data):
+        self._ring.append(CapturedData(time.time(), address, bytes(data[:CAPTURE_MAX_BYTES]), len(data)))
+    
+    def clear(self):
+        self._ring.clear()
+    
+    def __len__(self):
+        return len(self._ring)
+    
+    def dump(self, limit=None):
+        """返回最近limit条记录的文本，从旧到新"""
+        entries = list(self._ring)
+        if limit is not None:
+            entries = entries[-limit:] if limit > 0 else []
+        lines = []
+        for entry in entries:
+            stamp = time.strftime("%H:%M:%S", time.localtime(entry.time)) + f".{int(entry.time * 1000) % 1000:03d}"
+            more = "..." if entry.size > len(entry.data) else ""
+            lines.append(f"{stamp} {entry.address} [{entry.size}]>[{format_hex(entry.data)}{more}]")
+        return lines
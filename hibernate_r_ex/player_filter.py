@@ -0,0 +1,71 @@
+import functools
+import re
+import warnings
+
+# 含反向引用的规则合并后组号会变化，需要单独匹配
+_BACKREF = re.compile(r'\\\d|\(\?P=')
+# 规则开头的全局标记，如(?i)
+_LEADING_FLAGS = re.compile(r'\(\?([aimsux]+)\)')
+
+
+def _scope_flags(pattern):
+    """开头的全局标记改为只作用于本规则的局部标记：(?i)abc -> (?i:abc)，合并后不影响其他规则"""
+    match = _LEADING_FLAGS.match(pattern)
+    if match is None:
+        return pattern
+    return f'(?{match.group(1)}:{pattern[match.end():]})'
+
+
+def _can_group(pattern):
+    """
+    规则能否放入非捕获组中合并，例如中间带全局标记的规则不能
+    3.11之前这样的标记只产生DeprecationWarning并作用于整个合并后的表达式，同样按不能合并处理
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            re.compile(f'(?:{pattern})')
+        return True
+    except (re.error, DeprecationWarning):
+        return False
+
+
+class PlayerFilter:
+    """
+    将名称规则(黑名单/白名单)编译为一个匹配器：
+    纯文本名称放入集合，正则规则合并为一个分支表达式，每个名称的判断结果缓存在有界LRU中
+    """
+    
+    def __init__(self, patterns, cache_size=4096):
+        self.literals = set()
+        regexes = []
+        self.separate = []  # 无法合并的规则
+        for pattern in patterns:
+            compiled = re.compile(pattern)  # 先单独编译，错误规则在此报错
+            if re.escape(pattern) == pattern:
+                self.literals.add(pattern)
+            elif _BACKREF.search(pattern) or not _can_group(_scope_flags(pattern)):
+                self.separate.append(compiled)
+            else:
+                regexes.append(_scope_flags(pattern))
+        
+        self.combined = re.compile('|'.join(f'(?:{pattern})' for pattern in regexes)) if regexes else None
+        
+        self.matches = functools.lru_cache(maxsize=cache_size)(self._match)
+    
+    def _match(self, name):
+        if name in self.literals:
+            return True
+        if self.combined is not None and self.combined.fullmatch(name) is not None:
+            return True
+        return any(p.fullmatch(name) for p in self.separate)
+    
+    def split(self, names):
+        """返回（匹配的名称列表，未匹配的名称列表）"""
+        matched, unmatched = [], []
+        for name in names:
+            if self.matches(name):
+                matched.append(name)
+            else:
+                unmatched.append(name)
+        return matched, unmatched
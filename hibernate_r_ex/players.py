@@ -0,0 +1,68 @@
+import threading
+import time
+from typing import NamedTuple
+
+
+class OnlinePlayer(NamedTuple):
+    name: str
+    ip: str
+    is_bot: bool
+
+
+class PlayerTracker:
+    """
+    根据服务器日志中的登录/离开事件维护在线玩家集合
+    空闲判断直接读取集合，只有长时间未同步时才需要通过list命令校准
+    """
+    
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._players = {}  # 玩家名 -> OnlinePlayer
+        self._synced_at = None  # 最近一次确认集合准确的时间
+    
+    def joined(self, name, ip):
+        with self._lock:
+            self._players[name] = OnlinePlayer(name, ip, ip == "local")  # ip为local的是假人
+    
+    def left(self, name):
+        with self._lock:
+            self._players.pop(name, None)
+    
+    def reset(self):
+        """服务器启动或关闭时调用，此时确定没有玩家在线"""
+        with self._lock:
+            self._players.clear()
+            self._synced_at = self._clock()
+    
+    def sync(self, names):
+        """用list命令的结果校准集合，保留已知玩家的ip信息"""
+        with self._lock:
+            self._players = {name: self._players.get(name) or OnlinePlayer(name, "", False) for name in names}
+            self._synced_at = self._clock()
+    
+    def export_state(self):
+        """插件重载时交给新模块：玩家列表转为普通元组，新旧模块的OnlinePlayer不是同一个类"""
+        with self._lock:
+            return [tuple(player) for player in self._players.values()], self._synced_at
+    
+    def restore_state(self, state):
+        players, synced_at = state
+        with self._lock:
+            self._players = {player[0]: OnlinePlayer(*player) for player in players}
+            self._synced_at = synced_at
+    
+    def needs_sync(self, interval):
+        """从未校准或距上次校准超过interval秒"""
+        return self._synced_at is None or self._clock() - self._synced_at >= interval
+    
+    def names(self):
+        with self._lock:
+            return list(self._players)
+    
+    def players(self):
+        with self._lock:
+            return list(self._players.values())
+    
+    def __len__(self):
+        return len(self._players)
@@ -0,0 +1,203 @@
+import math
+import os
+import struct
+import threading
+import time
+
+# 事件类型
+EVENT_ARRIVAL = 0  # 没有其他玩家在线时的加入，即一次"到达"
+EVENT_JOIN = 1
+EVENT_LEAVE = 2
+
+RECORD = struct.Struct("<IB")  # unix时间(秒) + 事件类型，每条5字节
+WEEK = 7 * 24 * 3600
+PREWARM_JOB = "prewarm"
+PREWARM_CHECK_INTERVAL = 60  # 休眠期间检查是否需要预热的间隔(秒)
+
+
+def local_time(timestamp):
+    """转换为本地时间的秒数，使时间段与玩家的作息对齐(自动处理夏令时)"""
+    return int(timestamp) + time.localtime(timestamp).tm_gmtoff
+
+
+class JoinHistory:
+    """
+    登录/离开时间的持久化记录，追加写入紧凑的二进制文件
+    加载时丢弃超过保留期的记录和写入中断的残缺记录
+    """
+    
+    def __init__(self, path, retention_days=56):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.events = []  # [(时间, 事件类型)]，按时间顺序
+        self._lock = threading.Lock()
+        self._load()
+    
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        usable = len(data) - len(data) % RECORD.size
+        events = list(RECORD.iter_unpack(data[:usable]))
+        cutoff = time.time() - self.retention
+        self.events = [event for event in events if event[0] >= cutoff]
+        if len(self.events) != len(events) or usable != len(data):
+            self._rewrite()
+    
+    def _rewrite(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(b''.join(RECORD.pack(*event) for event in self.events))
+        os.replace(temp_path, self.path)
+    
+    def record(self, kind, timestamp=None):
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        with self._lock:
+            self.events.append((timestamp, kind))
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'ab') as file:
+                file.write(RECORD.pack(timestamp, kind))
+        return timestamp
+
+
+class ArrivalModel:
+    """
+    一周内按时间段统计到达：每个时间段保存出现过到达的周编号，
+    某个时间窗的到达概率 = 窗口内出现过到达的周数 / 历史覆盖的周数
+    """
+    
+    def __init__(self, bucket_sec=900):
+        self.bucket_sec = bucket_sec
+        self.slot_count = -(-WEEK // bucket_sec)  # 时间段长度不能整除一周时，每周最后一个时间段较短
+        self._slots = [set() for _ in range(self.slot_count)]
+        self.first = None  # 最早的记录时间
+    
+    @classmethod
+    def build(cls, events, bucket_sec=900):
+        model = cls(bucket_sec)
+        for timestamp, kind in events:
+            model.add(timestamp, kind)
+        return model
+    
+    def add(self, timestamp, kind):
+        if self.first is None or timestamp < self.first:
+            self.first = timestamp
+        if kind == EVENT_ARRIVAL:
+            week, offset = divmod(local_time(timestamp), WEEK)
+            self._slots[offset // self.bucket_sec].add(week)  # 与probability相同，按一周内的偏移划分时间段
+    
+    def observed_weeks(self, now):
+        if self.first is None:
+            return 0
+        return max(math.ceil((now - self.first) / WEEK), 1)
+    
+    def probability(self, start, end, now=None):
+        """历史上[start, end)对应的每周时间窗内发生过到达的比例"""
+        weeks = self.observed_weeks(start if now is None else now)
+        if weeks == 0 or end <= start:
+            return 0.0
+        local = local_time(start)
+        local_end = local + int(end - start)
+        first_week = local // WEEK
+        hit = set()
+        while local < local_end:
+            week, offset = divmod(local, WEEK)
+            slot = offset // self.bucket_sec
+            # 跨越周边界的时间段，周编号减去跨越的周数后与起点对齐
+            hit.update(past - (week - first_week) for past in self._slots[slot])
+            local += min((slot + 1) * self.bucket_sec, WEEK) - offset  # 下一个时间段的起点
+        return min(len(hit) / weeks, 1.0)
+
+
+class Predictor:
+    """
+    根据到达模型在预计有玩家到达前提前启动服务器，并在即将有玩家加入时推迟停服
+    """
+    
+    def __init__(self, server, scheduler, config, clock=time.time):
+        self.server = server
+        self.scheduler = scheduler
+        self.config = config
+        self._clock = clock
+        self.history = JoinHistory(os.path.join(server.get_data_folder(), "join_history.bin"),
+                                   config.predict_history_days)
+        self.model = ArrivalModel.build(self.history.events, config.predict_bucket_min * 60)
+        self._hold_until = 0  # 预热过的时间窗结束前不再重复预热
+        self._deferred = 0  # 本次空闲期间已推迟停服的秒数
+    
+    @property
+    def enabled(self):
+        return self.config.predict_enabled
+    
+    def ready(self):
+        """历史覆盖的周数足够时才进行预测"""
+        return self.enabled and self.model.observed_weeks(self._clock()) >= self.config.predict_min_weeks
+    
+    def record_join(self, arrival):
+        self._deferred = 0
+        if not self.enabled:
+            return
+        kind = EVENT_ARRIVAL if arrival else EVENT_JOIN
+        timestamp = self.history.record(kind, self._clock())
+        self.model.add(timestamp, kind)
+    
+    def record_leave(self):
+        if self.enabled:
+            self.history.record(EVENT_LEAVE, self._clock())
+    
+    def start_prewarm(self, wake):
+        """服务器休眠后开始定期检查是否需要预热"""
+        if self.enabled:
+            self.scheduler.schedule(PREWARM_JOB, PREWARM_CHECK_INTERVAL, self._check_prewarm, wake)
+    
+    def stop_prewarm(self):
+        self.scheduler.cancel(PREWARM_JOB)
+    
+    def prewarm_due(self, now):
+        """now时刻是否应该预热：lead秒后的一个时间段内到达概率达到阈值"""
+        if now < self._hold_until or not self.ready():
+            return False
+        start = now + self.config.predict_lead_sec
+        end = start + self.model.bucket_sec
+        if self.model.probability(start, end, now) < self.config.predict_threshold:
+            return False
+        self._hold_until = end + self.config.predict_defer_sec
+        return True
+    
+    def _check_prewarm(self, wake):
+        if self.prewarm_due(self._clock()):
+            self.server.logger.info(f"预测{self.config.predict_lead_sec}s后将有玩家到达，提前启动服务器")
+            wake(self.server)
+            return
+        self.scheduler.schedule(PREWARM_JOB, PREWARM_CHECK_INTERVAL, self._check_prewarm, wake)
+    
+    def defer_delay(self):
+        """即将停服时调用，返回应推迟的秒数，0表示不推迟"""
+        if not self.ready():
+            return 0
+        budget = self.config.predict_max_defer_sec - self._deferred
+        if budget <= 0:
+            return 0
+        now = self._clock()
+        window = self.config.predict_defer_sec
+        probability = self.model.probability(now, now + window)
+        if probability < self.config.predict_threshold:
+            return 0
+        delay = min(window, budget)
+        self._deferred += delay
+        self.server.logger.info(f"{window}s内有玩家加入的概率为{probability:.0%}，推迟{delay}s停服")
+        return delay
+    
+    def reload_config(self, config):
+        """配置重载，时间段长度变化时用已有历史重建模型"""
+        rebuild = config.predict_bucket_min != self.config.predict_bucket_min
+        self.config = config
+        if rebuild:
+            self.model = ArrivalModel.build(self.history.events, config.predict_bucket_min * 60)
+    
+    def reset_deferral(self):
+        self._deferred = 0
@@ -0,0 +1,109 @@
+import asyncio
+import selectors
+import socket
+import time
+
+from .byte_utils import *
+
+
+# https://minecraft.wiki/w/Java_Edition_protocol#Login_Plugin_Request
+# 1.13(协议393)起登录阶段可以发送插件请求，客户端会回复"未理解"，可用作等待期间的保活
+LOGIN_PLUGIN_MIN_PROTOCOL = 393
+KEEPALIVE_CHANNEL = "hibernate_r_ex:wait"
+
+
+def build_login_plugin_request(message_id):
+    """构建登录插件请求数据包，用于保持等待中的登录连接"""
+    return PacketWriter(0x04).write_varint(message_id).write_utf(KEEPALIVE_CHANNEL).finish()
+
+
+def count_plugin_responses(framer: PacketFramer):
+    """从分帧器中取出登录插件响应，返回(数量, 是否遇到其它数据包)"""
+    count = 0
+    while (reader := framer.next_packet()) is not None:
+        if reader.read_varint() != 0x02:  # Login Plugin Response
+            return count, True
+        count += 1
+    return count, False
+
+
+class RelayStats:
+    """单个代理连接的转发统计"""
+    
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.upstream = 0  # 客户端->服务器字节数
+        self.downstream = 0  # 服务器->客户端字节数
+    
+    def summary(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-6)
+        total = self.upstream + self.downstream
+        return f"上行{self.upstream}字节 下行{self.downstream}字节 用时{elapsed:.1f}s 平均{total / elapsed / 1024:.1f}KB/s"
+
+
+def relay_sockets(client, backend, buffer_size=65536, stats: RelayStats = None):
+    """
+    在两个已连接的socket之间双向转发数据，直到两个方向都结束
+    每个方向使用一块预分配的缓冲区recv_into后直接发送，不产生额外拷贝
+    """
+    stats = stats or RelayStats()
+    sel = selectors.DefaultSelector()
+    # (目标socket, 缓冲区, 是否上行)
+    routes = {
+        client: (backend, memoryview(bytearray(buffer_size)), True),
+        backend: (client, memoryview(bytearray(buffer_size)), False),
+    }
+    for sock in routes:
+        sock.settimeout(30)  # 只影响sendall，防止对端停止读取时永久阻塞
+        sel.register(sock, selectors.EVENT_READ)
+    
+    try:
+        while routes:
+            for key, _ in sel.select():
+                src = key.fileobj
+                dst, view, upstream = routes[src]
+                try:
+                    n = src.recv_into(view)
+                except (ConnectionError, socket.timeout, OSError):
+                    n = 0
+                if n == 0:  # 此方向结束，半关闭对端写入
+                    sel.unregister(src)
+                    del routes[src]
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    continue
+                dst.sendall(view[:n])
+                if upstream:
+                    stats.upstream += n
+                else:
+                    stats.downstream += n
+    except (ConnectionError, socket.timeout, OSError):
+        pass
+    finally:
+        sel.close()
+    return stats
+
+
+async def relay_streams(client_reader, client_writer, backend_reader, backend_writer, buffer_size=65536,
+                        stats: RelayStats = None):
+    """relay_sockets的asyncio版本"""
+    stats = stats or RelayStats()
+    
+    async def pump(reader, writer, upstream):
+        try:
+            while data := await reader.read(buffer_size):
+                writer.write(data)
+                if upstream:
+                    stats.upstream += len(data)
+                else:
+                    stats.downstream += len(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError):
+            pass
+    
+    await asyncio.gather(pump(client_reader, backend_writer, True), pump(backend_reader, client_writer, False))
+    return stats
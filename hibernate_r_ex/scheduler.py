@@ -0,0 +1,116 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class Scheduler:
+    """
+    单线程定时调度器，所有倒计时共用一个常驻线程
+    任务按名称存放，同名任务重新调度会替换旧任务，调度和取消都是O(log n)且不创建线程
+    threaded为False时不启动线程，由外部按(虚拟)时钟调用run_pending执行到期任务
+    """
+    
+    def __init__(self, logger=None, clock=time.monotonic, name="HibernateR-Scheduler", threaded=True):
+        self._logger = logger
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._heap = []  # (截止时间, 序号, 名称)，取消的任务在弹出时惰性丢弃
+        self._jobs = {}  # 名称 -> (截止时间, 序号, 回调, 参数)
+        self._seq = itertools.count()
+        self._closed = False
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+    
+    def schedule(self, name, delay, callback, *args):
+        """在delay秒后执行callback，替换同名任务"""
+        with self._cond:
+            deadline = self._clock() + delay
+            seq = next(self._seq)
+            self._jobs[name] = (deadline, seq, callback, args)
+            heapq.heappush(self._heap, (deadline, seq, name))
+            if len(self._heap) > 2 * len(self._jobs) + 16:  # 清理过多的已取消任务
+                self._heap = [(job[0], job[1], key) for key, job in self._jobs.items()]
+                heapq.heapify(self._heap)
+            if self._heap[0][1] == seq:  # 新任务最早到期，唤醒调度线程重新计算等待时间
+                self._cond.notify()
+    
+    def cancel(self, name):
+        """取消任务，返回任务是否存在"""
+        with self._cond:
+            return self._jobs.pop(name, None) is not None
+    
+    def remaining(self, name):
+        """返回任务剩余秒数，不存在则返回None"""
+        with self._cond:
+            job = self._jobs.get(name)
+            return None if job is None else max(job[0] - self._clock(), 0.0)
+    
+    def next_deadline(self):
+        """最早的任务截止时间，没有任务时返回None"""
+        with self._cond:
+            while self._heap:
+                deadline, seq, name = self._heap[0]
+                job = self._jobs.get(name)
+                if job is not None and job[1] == seq:
+                    return deadline
+                heapq.heappop(self._heap)
+            return None
+    
+    def run_pending(self):
+        """在调用线程中执行所有已到期的任务(包括执行期间新调度且已到期的)，返回执行的任务数"""
+        count = 0
+        while True:
+            with self._cond:
+                job, _ = self._pop_due()
+            if job is None:
+                return count
+            self._execute(job)
+            count += 1
+    
+    def close(self):
+        """取消所有任务并结束调度线程"""
+        with self._cond:
+            self._closed = True
+            self._jobs.clear()
+            self._heap.clear()
+            self._cond.notify()
+    
+    def _pop_due(self):
+        """弹出一个到期任务，没有则返回距下一个任务的等待时间"""
+        while self._heap:
+            deadline, seq, name = self._heap[0]
+            job = self._jobs.get(name)
+            if job is None or job[1] != seq:  # 已被取消或替换
+                heapq.heappop(self._heap)
+                continue
+            wait = deadline - self._clock()
+            if wait > 0:
+                return None, wait
+            heapq.heappop(self._heap)
+            del self._jobs[name]
+            return job, 0
+        return None, None
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    job, wait = self._pop_due()
+                    if job is not None:
+                        break
+                    self._cond.wait(wait)
+            # 在锁外执行回调，回调中可以重新调度
+            self._execute(job)
+    
+    def _execute(self, job):
+        try:
+            job[2](*job[3])
+        except Exception:
+            if self._logger is not None:
+                self._logger.error(f"定时任务执行出错: {traceback.format_exc()}")
@@ -0,0 +1,124 @@
+import collections
+import threading
+import time
+
+from .metrics import metrics
+
+
+class WakeGuard:
+    """
+    防止服务器反复启停：记录由伪装服务器登录请求触发、但直到关闭都没有玩家进入的"空唤醒"，
+    时间窗内空唤醒过多时延长空闲等待时间(带滞回)，并暂时拒绝多次空唤醒的玩家名和IP再次唤醒
+    """
+    
+    def __init__(self, config, clock=time.monotonic):
+        self.config = config
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending = None  # 等待玩家进入的唤醒：(玩家名, IP)
+        self._cycles = collections.deque()  # 时间窗内空唤醒的时间
+        self._offenses = {}  # ("name"/"ip", 值) -> 空唤醒时间的deque
+        self._bans = {}  # ("name"/"ip", 值) -> 解除时间
+        self.stretched = False  # 是否正在延长空闲等待时间
+        self._m_empty = metrics.counter("hr_empty_wakes_total", "唤醒后无人进入就关闭的次数")
+        self._m_refused = metrics.counter("hr_wake_refused_total", "因多次空唤醒被拒绝的唤醒请求数")
+        metrics.gauge("hr_idle_timeout_stretched", "是否因频繁空唤醒延长了空闲等待时间", func=lambda: int(self.stretched))
+    
+    def reload_config(self, config):
+        with self._lock:
+            self.config = config
+    
+    def refused(self, name, ip):
+        """返回name或ip被拒绝唤醒的剩余秒数，0表示允许"""
+        with self._lock:
+            now = self._clock()
+            remaining = 0
+            for key in (("name", name), ("ip", ip)):
+                until = self._bans.get(key)
+                if until is None:
+                    continue
+                if until <= now:
+                    del self._bans[key]
+                else:
+                    remaining = max(remaining, until - now)
+        if remaining > 0:
+            self._m_refused.inc()
+        return remaining
+    
+    def record_wake(self, name, ip):
+        """伪装服务器收到登录请求并唤醒服务器"""
+        with self._lock:
+            self._pending = (name, ip)
+    
+    def record_join(self):
+        """有真实玩家进入服务器，本次唤醒有效"""
+        with self._lock:
+            self._pending = None
+    
+    def clear_pending(self):
+        """服务器意外关闭时不计入空唤醒"""
+        with self._lock:
+            self._pending = None
+    
+    def record_shutdown(self, logger):
+        """服务器关闭，如果唤醒后没有玩家进入则记为一次空唤醒"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if pending is None:
+                return
+            now = self._clock()
+            self._cycles.append(now)
+            banned = []
+            if self.config.wake_ban_after > 0:
+                for key in (("name", pending[0]), ("ip", pending[1])):
+                    offenses = self._offenses.setdefault(key, collections.deque())
+                    offenses.append(now)
+                    self._prune(offenses, now)
+                    if len(offenses) >= self.config.wake_ban_after:
+                        self._bans[key] = now + self.config.wake_ban_sec
+                        offenses.clear()
+                        banned.append(key[1])
+            self._prune_offenses(now)
+            changed = self._update_state(now)
+        self._m_empty.inc()
+        logger.info(f"唤醒服务器的{pending[0]}[{pending[1]}]直到关闭都未进入，记为一次空唤醒")
+        if banned:
+            logger.warning(f"{'、'.join(banned)}多次空唤醒，{self.config.wake_ban_sec}s内不允许再次唤醒服务器")
+        if changed:
+            self._log_state(logger)
+    
+    def idle_timeout(self, wait_sec, logger=None):
+        """返回当前应使用的空闲等待时间，频繁空唤醒时延长"""
+        with self._lock:
+            changed = self._update_state(self._clock())
+            stretched = self.stretched
+        if changed and logger is not None:
+            self._log_state(logger)
+        if not stretched:
+            return wait_sec
+        return max(wait_sec, min(wait_sec * self.config.thrash_wait_multiplier, self.config.thrash_max_wait_sec))
+    
+    def _prune(self, times, now):
+        while times and now - times[0] > self.config.thrash_window_sec:
+            times.popleft()
+    
+    def _prune_offenses(self, now):
+        for key in [key for key, times in self._offenses.items() if not times or now - times[-1] > self.config.thrash_window_sec]:
+            del self._offenses[key]
+    
+    def _update_state(self, now):
+        """按时间窗内的空唤醒次数切换延长状态：达到enter才进入，降到exit以下才退出，返回状态是否变化"""
+        self._prune(self._cycles, now)
+        if not self.stretched and len(self._cycles) >= self.config.thrash_enter_cycles:
+            self.stretched = True
+            return True
+        if self.stretched and len(self._cycles) <= self.config.thrash_exit_cycles:
+            self.stretched = False
+            return True
+        return False
+    
+    def _log_state(self, logger):
+        if self.stretched:
+            logger.warning(f"{self.config.thrash_window_sec}s内空唤醒{len(self._cycles)}次，延长空闲等待时间")
+        else:
+            logger.info("空唤醒次数已回落，恢复空闲等待时间")
@@ -1,26 +1,36 @@
-import re
 import threading
 
 from mcdreforged.api.all import *
 from .config import get_config
+from .scheduler import Scheduler
+from .players import PlayerTracker
+from .player_filter import PlayerFilter
+from .metrics import metrics
 import minecraft_data_api as api
 
+# 命名的倒计时：探测检查(确认是否无玩家)和真实停服
+PROBE_DEADLINE = "probe"
+SHUTDOWN_DEADLINE = "shutdown"
+PROBE_DELAY = 5
+
 class TimerManager:
 
-	def __init__(self, server: PluginServerInterface):
+	def __init__(self, server: PluginServerInterface, player_tracker: PlayerTracker, scheduler: Scheduler = None, threaded = True):
 		self._lock = threading.Lock()
-		self.current_timer = None
-		
-		config = get_config()
+		self._threaded = threaded#为False时在调度线程中直接查询玩家列表(用于模拟)
+		self._generation = 0#每次取消倒计时加一，后台查询结束后据此判断倒计时是否仍然有效
+		self.player_tracker = player_tracker
+		self.predictor = None#预测到达时推迟停服，由插件启用预测后设置
+		self.wake_guard = None#频繁空唤醒时延长空闲等待时间，由插件设置
+		self.scheduler = scheduler or Scheduler(server.logger)#所有倒计时共用一个调度线程，模拟时传入由虚拟时钟驱动的调度器
+		self._filter_source = None
+		self._apply_config(get_config())
 		
-		self.wait_sec = config.wait_sec
-		self.whitelist_match_mode = config.whitelist_match_mode
-		
-		if self.whitelist_match_mode:
-			self.player_patterns = [re.compile(p) for p in config.whitelist_player]  # 预编译正则
-		else:
-			self.player_patterns = [re.compile(p) for p in config.blacklist_player]# 预编译正则
 		
+		self._m_checks = metrics.counter("hr_idle_checks_total", "空闲检查次数")
+		self._m_list_time = metrics.histogram("hr_player_list_query_seconds", "通过list命令获取玩家列表的耗时")
+		self._m_list_failures = metrics.counter("hr_player_list_query_failures_total", "获取玩家列表失败次数")
+		metrics.gauge("hr_online_players", "在线玩家数", func=lambda: len(self.player_tracker))
 		
 		server.logger.info("定时服务初始化完成")
 
@@ -35,56 +45,125 @@ class TimerManager:
 			self._cancel_timer_impl(server)
 			server.logger.info("休眠倒计时取消")
 
+	def export_countdown(self):
+		#插件重载前导出正在进行的倒计时：(名称, 剩余秒数)，没有倒计时返回None
+		with self._lock:
+			for name in (SHUTDOWN_DEADLINE, PROBE_DEADLINE):
+				remaining = self.scheduler.remaining(name)
+				if remaining is not None:
+					return name, remaining
+		return None
+
+	def resume_timer(self, server: PluginServerInterface, test_stop_server, stop_server, countdown):
+		#插件重载后按重载前剩余的时间继续倒计时，空闲时间不会重新计算
+		#探测阶段到期后与start_timer相同调用test_stop_server，真实停服阶段到期后直接调用stop_server
+		name, remaining = countdown
+		final = name == SHUTDOWN_DEADLINE
+		with self._lock:
+			self._cancel_timer_impl(server)
+			self.scheduler.schedule(name, remaining, self.timing_event, server, stop_server if final else test_stop_server, final)
+			server.logger.info(f"休眠倒计时继续，剩余{remaining:.0f}s")
+
+	def reload_config(self, server: PluginServerInterface):
+		#配置重载：更新时长并按需重新编译玩家规则，正在进行的倒计时保持不变，新的时长在下次倒计时生效
+		with self._lock:
+			self._apply_config(get_config())
+		server.logger.info("定时服务配置已重载")
+
+	def _apply_config(self, config):
+		self.wait_sec = config.wait_sec
+		self.player_list_sync_sec = config.player_list_sync_sec
+		
+		patterns = config.whitelist_player if config.whitelist_match_mode else config.blacklist_player
+		source = (config.whitelist_match_mode, tuple(patterns))
+		if source != self._filter_source:#规则未变化时沿用已编译的匹配器和缓存
+			player_filter = PlayerFilter(patterns)# 预编译为单个匹配器
+			self.whitelist_match_mode, self.player_filter = config.whitelist_match_mode, player_filter
+			self._filter_source = source
+
+	def counts_as_player(self, name):
+		#玩家名是否算作真实玩家：白名单模式下需要匹配，黑名单模式下不能匹配
+		return self.player_filter.matches(name) == self.whitelist_match_mode
+
+	def close(self):
+		#取消所有倒计时并结束调度线程
+		self.scheduler.close()
+
 	def _start_timer_impl(self, server: PluginServerInterface, stop_server, wait):
 		#启动定时循环
 		#如果wait为false，则代表测试是否停服，直接设置为5s启动，否则进行等待
-		self.current_timer = threading.Timer(self.wait_sec if wait else 5, self.timing_event, [server,stop_server])
-		self.current_timer.start()
+		if wait:
+			wait_sec = self.wait_sec if self.wake_guard is None else self.wake_guard.idle_timeout(self.wait_sec, server.logger)
+			self.scheduler.schedule(SHUTDOWN_DEADLINE, wait_sec, self.timing_event, server, stop_server, True)
+		else:
+			self.scheduler.schedule(PROBE_DEADLINE, PROBE_DELAY, self.timing_event, server, stop_server)
 
 	def _cancel_timer_impl(self, server: PluginServerInterface):
 		#取消定时循环
-		if self.current_timer is not None:
-			self.current_timer.cancel()
-			self.current_timer = None
+		self.scheduler.cancel(PROBE_DEADLINE)
+		self.scheduler.cancel(SHUTDOWN_DEADLINE)
+		self._generation += 1
 
-	def timing_event(self, server: PluginServerInterface, stop_server):
+	def timing_event(self, server: PluginServerInterface, stop_server, final = False):
 		if server.is_server_running() or server.is_server_startup():
 			server.logger.info("时间事件激活，检查玩家在线情况")
-			def filter_players(player_list, patterns):
-				"""返回（合法玩家列表，被过滤玩家列表）"""
-				matched, unmatched = [], []
-				for player in player_list:
-					if any(p.fullmatch(player) for p in patterns):
-						matched.append(player)
-					else:
-						unmatched.append(player)
-				return matched, unmatched
-		
+			self._m_checks.inc()
+			#在线玩家集合由登录/离开日志维护，只有长时间未校准时才发送list命令
+			if self.player_tracker.needs_sync(self.player_list_sync_sec):
+				#list命令最多等待10s，放到单独的线程中，不阻塞共用调度线程上的其他倒计时
+				if self._threaded:
+					threading.Thread(target=self._sync_and_check, args=(server, stop_server, final, self._generation),
+									 name="HibernateR-PlayerList", daemon=True).start()
+				else:
+					self._sync_and_check(server, stop_server, final, self._generation)
+				return
+			self._check_players(server, stop_server, final)
+		else:
+			server.logger.info("服务器未启动，跳过")
 
+	def _sync_and_check(self, server: PluginServerInterface, stop_server, final, generation):
+		#通过list命令校准在线玩家后再检查，查询期间倒计时被取消或重新开始时放弃本次检查
+		with self._m_list_time.time():
 			result = api.get_server_player_list(timeout=10.0)#延迟10s
-			if result is None:
-				server.logger.error("获取玩家列表失败，跳过")
+		if result is None:
+			self._m_list_failures.inc()
+			server.logger.warning("获取玩家列表失败，使用日志记录的在线玩家")
+		else:
+			self.player_tracker.sync(list(map(str, result[2])))
+		with self._lock:
+			if generation != self._generation:
+				server.logger.info("获取玩家列表期间倒计时已变化，跳过本次检查")
 				return
-			else:
-				player_list = list(map(str, result[2]))
-				matched, unmatched = filter_players(player_list, self.player_patterns)
-				
-				server.logger.info(f"玩家数量：{result[0]}/{result[1]}，匹配模式：{ '白名单' if self.whitelist_match_mode else '黑名单' }，已匹配：{matched}，未匹配：{unmatched}")
-				
-			# 白名单情况下，只要有白名单玩家就不关服
-			# 黑名单模式下，只要有玩家都在黑名单，则关服
+		self._check_players(server, stop_server, final)
+
+	def _check_players(self, server: PluginServerInterface, stop_server, final):
+		#按玩家规则判断在线玩家，没有需要保留的玩家时尝试停服
+		player_list = self.player_tracker.names()
+		matched, unmatched = self.player_filter.split(player_list)
 		
-			if self.whitelist_match_mode:
-				if len(matched) == 0:
-					server.logger.info("服务器无白名单玩家，尝试关闭服务器")
-					stop_server(server)  # 关闭服务器
-				else:
-					server.logger.info("服务器有白名单玩家，跳过")
+		server.logger.info(f"玩家数量：{len(player_list)}，匹配模式：{ '白名单' if self.whitelist_match_mode else '黑名单' }，已匹配：{matched}，未匹配：{unmatched}")
+			
+		# 白名单情况下，只要有白名单玩家就不关服
+		# 黑名单模式下，只要有玩家都在黑名单，则关服
+	
+		if self.whitelist_match_mode:
+			if len(matched) == 0:
+				server.logger.info("服务器无白名单玩家，尝试关闭服务器")
+				self._try_stop(server, stop_server, final)  # 关闭服务器
 			else:
-				if len(unmatched) == 0: # 未匹配为0，全在黑名单
-					server.logger.info("服务器仅有黑名单玩家，尝试关闭服务器")
-					stop_server(server)  # 关闭服务器
-				else:
-					server.logger.info("服务器有非黑名单玩家，跳过")
+				server.logger.info("服务器有白名单玩家，跳过")
 		else:
-			server.logger.info("服务器未启动，跳过")
\ No newline at end of file
+			if len(unmatched) == 0: # 未匹配为0，全在黑名单
+				server.logger.info("服务器仅有黑名单玩家，尝试关闭服务器")
+				self._try_stop(server, stop_server, final)  # 关闭服务器
+			else:
+				server.logger.info("服务器有非黑名单玩家，跳过")
+
+	def _try_stop(self, server: PluginServerInterface, stop_server, final):
+		#真实停服前询问预测器，预计很快有玩家加入时推迟停服
+		if final and self.predictor is not None:
+			delay = self.predictor.defer_delay()
+			if delay > 0:
+				self.scheduler.schedule(SHUTDOWN_DEADLINE, delay, self.timing_event, server, stop_server, True)
+				return
+		stop_server(server)
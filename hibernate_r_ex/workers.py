@@ -0,0 +1,292 @@
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import socket
+import threading
+import time
+import warnings
+
+from .metrics import metrics
+
+METRICS_INTERVAL = 5  # 工作进程汇报指标的间隔(秒)
+STOP_TIMEOUT = 5  # 等待工作进程退出的时间，超时后强制结束
+FORWARDED_TARGETS = ("wake_guard", "auth")  # 工作进程可以转发方法调用的插件进程对象
+
+
+def reuse_port_available():
+    """当前系统能否使用多进程监听：需要fork和SO_REUSEPORT"""
+    return hasattr(socket, "SO_REUSEPORT") and "fork" in multiprocessing.get_all_start_methods()
+
+
+def renew_locks(*objects):
+    """
+    fork只复制调用线程，其他线程在fork时持有的锁在子进程中永远不会释放
+    工作进程启动后给继承来的对象换上新锁
+    """
+    for obj in objects:
+        if obj is not None and hasattr(obj, "_lock"):
+            obj._lock = threading.Lock()
+
+
+class WorkerChannel:
+    """工作进程一端的管道，多个线程共用，发送时加锁"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+    
+    def send(self, message):
+        with self._lock:
+            try:
+                self.conn.send(message)
+            except (OSError, ValueError):  # 插件进程已关闭管道
+                pass
+
+
+class WorkerLogger:
+    """工作进程中的logger，日志通过管道交给插件进程输出；channel为None时丢弃"""
+    
+    def __init__(self, channel):
+        self.channel = channel
+    
+    def _send(self, level, message):
+        if self.channel is not None:
+            self.channel.send(("log", level, str(message)))
+    
+    def debug(self, message):
+        self._send("debug", message)
+    
+    def info(self, message):
+        self._send("info", message)
+    
+    def warning(self, message):
+        self._send("warning", message)
+    
+    def error(self, message):
+        self._send("error", message)
+
+
+class WorkerServer:
+    """工作进程中代替PluginServerInterface，只提供监听代码用到的部分"""
+    
+    def __init__(self, channel):
+        self.logger = WorkerLogger(channel)
+    
+    def is_server_running(self):
+        return False  # 工作进程只在服务器休眠或启动中运行
+    
+    def is_server_startup(self):
+        return False
+
+
+class Forwarding:
+    """工作进程中的代理对象：methods中的方法在本进程执行后，再转发给插件进程中的同一个对象执行"""
+    
+    def __init__(self, target, channel, name, methods):
+        self._target = target
+        self._channel = channel
+        self._name = name
+        self._methods = methods
+    
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if attr not in self._methods:
+            return value
+        
+        def forward(*args):
+            result = value(*args)
+            self._channel.send(("call", self._name, attr, args))
+            return result
+        return forward
+
+
+class MetricsReporter:
+    """工作进程中定期把指标和准入计数的增量发送给插件进程"""
+    
+    def __init__(self, channel, admission):
+        self.channel = channel
+        self.admission = admission
+        self._base = metrics.export_totals()  # fork时继承的值已经在插件进程中
+        self._admission_base = dict(admission.counters)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def flush(self):
+        current = metrics.export_totals()
+        counts = dict(self.admission.counters)
+        delta = metrics.diff_totals(current, self._base)
+        admission_delta = {name: value - self._admission_base.get(name, 0) for name, value in counts.items()
+                           if value != self._admission_base.get(name, 0)}
+        self._base, self._admission_base = current, counts
+        if delta or admission_delta:
+            self.channel.send(("metrics", delta, admission_delta))
+    
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+    
+    def _run(self):
+        while not self._stop.wait(METRICS_INTERVAL):
+            self.flush()
+
+
+class _Worker:
+    def __init__(self, process, conn, index):
+        self.process = process
+        self.conn = conn
+        self.index = index
+        self.exited = False  # 已收到退出消息，之后的管道关闭是正常退出
+        self.result = None  # 退出消息中的监听结果
+
+
+class WorkerPool:
+    """
+    伪装服务器的多进程监听：fork出多个工作进程，各自用SO_REUSEPORT绑定同一端口，由内核把连接分散到不同的核心，
+    MCDR进程繁忙时不影响ping的响应。工作进程继承fork时预编码的状态响应、封禁列表和准入设置，
+    日志、唤醒请求和指标通过管道交给插件进程；插件进程向工作进程发送启动进度和关闭命令
+    run在伪装服务器的监听线程中执行，其他方法可在任意线程调用
+    """
+    
+    def __init__(self, fs, server, count):
+        self.fs = fs
+        self.server = server
+        self.count = max(count, 1)
+        self._context = multiprocessing.get_context("fork")
+        self._workers = []
+        self._index = itertools.count(1)
+        self._wake_reader, self._wake_writer = self._context.Pipe(duplex=False)  # 唤醒run的等待
+        self._wake_lock = threading.Lock()
+        self._refresh = False
+    
+    def wakeup(self):
+        """让run立即检查关闭和重建请求"""
+        with self._wake_lock:
+            try:
+                self._wake_writer.send_bytes(b"1")
+            except OSError:
+                pass
+    
+    def request_refresh(self):
+        """状态响应或配置变化后，用新的状态fork一组工作进程替换现有的，替换期间端口始终有进程监听"""
+        self._refresh = True
+        self.wakeup()
+    
+    def broadcast(self, message):
+        for worker in list(self._workers):
+            try:
+                worker.conn.send(message)
+            except (OSError, ValueError):
+                pass
+    
+    def run(self):
+        """启动工作进程并处理它们的消息，直到关闭或收到唤醒服务器的登录请求，返回与其他监听模式相同的结果"""
+        self._spawn(self.count)
+        try:
+            while self._workers:
+                if self.fs.fs_stop:
+                    return None
+                if self._refresh:
+                    self._refresh = False
+                    old = list(self._workers)
+                    self._spawn(self.count)
+                    self._stop_workers(old)
+                conns = [worker.conn for worker in self._workers]
+                for conn in multiprocessing.connection.wait(conns + [self._wake_reader], timeout=1):
+                    if conn is self._wake_reader:
+                        self._wake_reader.recv_bytes()
+                        continue
+                    worker = next(w for w in self._workers if w.conn is conn)
+                    if self._receive(worker) == "login_request":
+                        return "login_request"
+            self.server.logger.error("所有伪装服务器工作进程都已退出")
+            return None
+        finally:
+            self._stop_workers(list(self._workers))
+            self._wake_reader.close()
+            self._wake_writer.close()
+    
+    def _spawn(self, count):
+        for _ in range(count):
+            index = next(self._index)
+            parent_conn, child_conn = self._context.Pipe()
+            process = self._context.Process(target=self.fs._run_worker, args=(child_conn, self),
+                                            name=f"HibernateR-FakeServer-{index}", daemon=True)
+            with warnings.catch_warnings():  # 多线程进程中fork的警告，工作进程启动后会换掉继承的锁
+                warnings.simplefilter("ignore", DeprecationWarning)
+                process.start()
+            child_conn.close()  # 只保留工作进程中的一端，工作进程退出时本端才能收到EOF
+            self._workers.append(_Worker(process, parent_conn, index))
+    
+    def detach_in_child(self):
+        """工作进程中调用：关闭从插件进程继承的其他管道"""
+        for worker in self._workers:
+            worker.conn.close()
+        self._workers = []
+        self._wake_reader.close()
+        self._wake_writer.close()
+    
+    def _receive(self, worker, stopping=False):
+        """处理一条消息，返回"login_request"表示应唤醒服务器；工作进程退出时从列表中移除"""
+        try:
+            message = worker.conn.recv()
+        except (EOFError, OSError):
+            self._remove(worker)
+            if stopping:
+                return None
+            if not worker.exited:
+                self.server.logger.warning(f"伪装服务器工作进程{worker.index}意外退出，重新启动")
+                self._spawn(1)
+            elif worker.result is not None:  # 启动阶段仍需监听，补上自行退出的工作进程
+                self.server.logger.warning(f"伪装服务器工作进程{worker.index}已自行退出，重新启动")
+                self._spawn(1)
+            else:
+                self.server.logger.error(f"伪装服务器工作进程{worker.index}监听失败并退出，剩余{len(self._workers)}个")
+            return None
+        kind = message[0]
+        if kind == "log":
+            getattr(self.server.logger, message[1])(f"[工作进程{worker.index}] {message[2]}")
+        elif kind == "metrics":
+            metrics.merge_totals(message[1])
+            self.fs.admission.merge(message[2])
+        elif kind == "call":
+            target = getattr(self.fs, message[1], None) if message[1] in FORWARDED_TARGETS else None
+            if target is not None:
+                getattr(target, message[2])(*message[3])
+        elif kind == "wake" and not stopping:
+            if self.fs.config.boot_status:  # 工作进程继续监听并回复启动进度
+                self.fs.begin_boot(self.server)
+            else:
+                return "login_request"
+        elif kind == "exit":
+            worker.exited = True
+            worker.result = message[1]
+        return None
+    
+    def _remove(self, worker):
+        if worker in self._workers:
+            self._workers.remove(worker)
+        worker.conn.close()
+        worker.process.join(STOP_TIMEOUT)
+    
+    def _stop_workers(self, workers):
+        """通知工作进程关闭监听并等待退出，期间继续转发它们的日志和指标，超时则强制结束"""
+        for worker in workers:
+            try:
+                worker.conn.send(("stop",))
+            except (OSError, ValueError):
+                pass
+        deadline = time.monotonic() + STOP_TIMEOUT
+        pending = [worker for worker in workers if worker in self._workers]
+        while pending and time.monotonic() < deadline:
+            conns = [worker.conn for worker in pending]
+            for conn in multiprocessing.connection.wait(conns, timeout=max(deadline - time.monotonic(), 0)):
+                worker = next(w for w in pending if w.conn is conn)
+                self._receive(worker, stopping=True)
+            pending = [worker for worker in pending if worker in self._workers]
+        for worker in pending:
+            self.server.logger.warning(f"伪装服务器工作进程{worker.index}未能按时退出，强制结束")
+            worker.process.terminate()
+            worker.exited = True
+            self._remove(worker)
@@ -0,0 +1,65 @@
+"""
+工具脚本共用的桩对象：在MCDR之外导入插件包并驱动它
+minecraft_data_api是MCDR插件而不是pip包，这里用桩模块代替
+"""
+import logging
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+if 'minecraft_data_api' not in sys.modules:
+    api = types.ModuleType('minecraft_data_api')
+    api.online_players = []
+    
+    def get_server_player_list(timeout=10.0):
+        return len(api.online_players), 20, list(api.online_players)
+    
+    api.get_server_player_list = get_server_player_list
+    sys.modules['minecraft_data_api'] = api
+
+
+class StubServer:
+    """最小的PluginServerInterface实现，只提供插件用到的方法"""
+    
+    def __init__(self, config: dict = None, log_level=logging.WARNING):
+        self.logger = logging.getLogger('hibernate_r_ex')
+        self.logger.setLevel(log_level)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+            self.logger.addHandler(handler)
+        self.config = config or {}
+        self.running = False
+        self.startup = False
+        self.start_count = 0
+        self.stop_count = 0
+    
+    def is_server_running(self):
+        return self.running
+    
+    def is_server_startup(self):
+        return self.startup
+    
+    def start(self):
+        self.start_count += 1
+        return True
+    
+    def stop(self):
+        self.stop_count += 1
+        return True
+    
+    def load_config_simple(self, file_name=None, target_class=None, **kwargs):
+        config = target_class.get_default()
+        for key, value in self.config.items():
+            setattr(config, key, value)
+        return config
+
+
+def load_plugin_config(server: StubServer):
+    from hibernate_r_ex import config
+    config.load_config_file(server)
+    return config.get_config()
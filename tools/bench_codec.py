@@ -0,0 +1,146 @@
+"""
+协议编解码微基准：先用随机数据校验新实现与旧实现结果一致(含往返)，再对比两者耗时
+用法: python tools/bench_codec.py [--count N] [--rounds R] [--check]
+--check只做校验不计时，校验失败时以非零状态退出
+"""
+import argparse
+import random
+import struct
+import timeit
+
+import _stubs  # noqa: F401
+from hibernate_r_ex.byte_utils import (MAX_PACKET_SIZE, BytesReader, PacketWriter, build_pong, build_str_response,
+                                       encode_varint, write_varint)
+
+
+# ---- 旧实现(参照) ----
+def old_write_varint(byte, value):
+    while True:
+        part = value & 0x7F
+        value >>= 7
+        if value != 0:
+            part |= 0x80
+        byte.append(part)
+        if value == 0:
+            break
+
+
+def old_build_str_response(packet_id, response):
+    body = bytearray()
+    body.append(packet_id)
+    data = response.encode('utf-8')
+    old_write_varint(body, len(data))
+    body.extend(data)
+    length = bytearray()
+    old_write_varint(length, len(body))
+    return bytes(length) + bytes(body)
+
+
+def old_pong(value):
+    response = bytearray()
+    old_write_varint(response, 9)
+    old_write_varint(response, 1)
+    response += struct.pack(">q", value)
+    return bytes(response)
+
+
+class OldBytesReader(BytesReader):
+    def read_varint(self):
+        result = 0
+        for j in range(5):
+            byte_in = self.data[self.i]
+            self.i += 1
+            result |= (byte_in & 0x7F) << (j * 7)
+            if (byte_in & 0x80) != 0x80:
+                break
+        return result
+    
+    def read_long(self):
+        old_i = self.i
+        self.i += 8
+        return struct.unpack(">q", self.data[old_i:self.i])[0]
+
+
+def read_ping(reader_class, data):
+    reader = reader_class(data)
+    reader.read_varint()
+    reader.read_varint()
+    return reader.read_long()
+
+
+def check(count, rng):
+    """随机校验：编码与旧实现一致，解码能还原"""
+    for _ in range(count):
+        value = rng.choice((rng.randrange(0, 0x80), rng.randrange(0, 0x4000), rng.randrange(0, 2 ** 31)))
+        old = bytearray()
+        old_write_varint(old, value)
+        new = bytearray()
+        write_varint(new, value)
+        assert bytes(old) == bytes(new) == encode_varint(value), value
+        assert BytesReader(new).read_varint() == value, value
+        
+        negative = -rng.randrange(1, 2 ** 31)
+        assert BytesReader(encode_varint(negative)).read_varint() == negative & 0xFFFFFFFF, negative  # 读取结果为无符号
+        
+        text = ''.join(chr(rng.choice((rng.randrange(0x20, 0x7f), rng.randrange(0x4e00, 0x9fff)))) for _ in range(rng.randrange(0, 300)))
+        packet = build_str_response(0x00, text)
+        framed = BytesReader(packet)
+        length = framed.read_varint()
+        assert length == len(packet) - framed.i, (length, text)
+        assert framed.read_varint() == 0x00 and framed.read_str() == text
+        if text.isascii():
+            assert packet == old_build_str_response(0x00, text)
+        assert PacketWriter(0x00).write_utf(text).finish() == packet, text
+        
+        long_value = rng.randrange(-2 ** 63, 2 ** 63)
+        pong = build_pong(long_value)
+        assert pong == old_pong(long_value) == PacketWriter(0x01).write_long(long_value).finish(), long_value
+        assert read_ping(OldBytesReader, pong) == read_ping(BytesReader, pong) == long_value
+
+
+def check_packet_sizes():
+    """PacketWriter在长度前缀的各个VarInt长度边界处正确回填，超过上限时报错而不是写出损坏的数据包"""
+    for length in (1, 0x7F, 0x80, 0x3FFF, 0x4000, MAX_PACKET_SIZE):
+        packet = PacketWriter(0x01).write_bytes(bytes(length - 1)).finish()
+        framed = BytesReader(packet)
+        assert framed.read_varint() == length == len(packet) - framed.i, length
+        assert framed.read_varint() == 0x01, length
+    try:
+        PacketWriter(0x01).write_bytes(bytes(MAX_PACKET_SIZE)).finish()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("超过MAX_PACKET_SIZE的数据包没有报错")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=20000, help='随机校验次数')
+    parser.add_argument('--rounds', type=int, default=200000)
+    parser.add_argument('--check', action='store_true', help='只做校验，不对比耗时')
+    args = parser.parse_args()
+    
+    check(args.count, random.Random(0))
+    check_packet_sizes()
+    print(f"校验通过: {args.count}组随机数据")
+    if args.check:
+        return
+    
+    status = '{"version":{"name":"1.21","protocol":767},"description":{"text":"休眠中"}}'
+    pong_data = old_pong(123456789)
+    cases = [
+        ("varint(1字节)", lambda: old_write_varint(bytearray(), 42), lambda: write_varint(bytearray(), 42)),
+        ("varint(3字节)", lambda: old_write_varint(bytearray(), 70000), lambda: write_varint(bytearray(), 70000)),
+        ("状态响应", lambda: old_build_str_response(0, status), lambda: build_str_response(0, status)),
+        ("pong响应", lambda: old_pong(123456789), lambda: build_pong(123456789)),
+        ("解析ping", lambda: read_ping(OldBytesReader, pong_data), lambda: read_ping(BytesReader, pong_data)),
+    ]
+    for name, old, new in cases:
+        old_time = timeit.timeit(old, number=args.rounds)
+        new_time = timeit.timeit(new, number=args.rounds)
+        print(f"{name:<14} 旧实现 {old_time / args.rounds * 1e9:8.0f}ns  新实现 {new_time / args.rounds * 1e9:8.0f}ns  "
+              f"加速 {old_time / new_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
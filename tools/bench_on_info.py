@@ -0,0 +1,123 @@
+"""
+on_info热路径基准：将服务器日志逐行回放给on_info，报告每秒处理的行数
+用法: python tools/bench_on_info.py [latest.log ...] [--lines N]
+不指定日志文件时生成一份模拟的模组服日志(聊天、区块警告、模组输出和少量进出服)
+"""
+import argparse
+import random
+import re
+import time
+
+import _stubs
+import hibernate_r_ex as plugin
+
+# 原始日志行的前缀，例如 "[12:34:56] [Server thread/INFO]: "
+LOG_PREFIX = re.compile(r'^\[[^\]]*\] \[[^\]]*\]: ')
+
+
+class ReplayInfo:
+    """回放用的Info，只提供on_info用到的属性"""
+    
+    def __init__(self, content):
+        self.content = content
+        self.is_from_server = True
+
+
+class NullTimerManager:
+    def start_timer(self, *args, **kwargs):
+        pass
+    
+    def cancel_timer(self, *args, **kwargs):
+        pass
+
+
+class NullPredictor:
+    def record_join(self, arrival):
+        pass
+    
+    def record_leave(self):
+        pass
+
+
+class NullWakeGuard:
+    def record_join(self):
+        pass
+
+
+class IdleFakeServer:
+    """伪装服务器不在启动阶段，on_info走进出服匹配的路径"""
+    booting = False
+
+
+def synthetic_log(count, rng):
+    names = [f"Player{i}" for i in range(20)]
+    templates = [
+        lambda: f"<{rng.choice(names)}> " + "hello world " * rng.randrange(1, 20),
+        lambda: "Can't keep up! Is the server overloaded? Running 2345ms or 46 ticks behind",
+        lambda: f"[Mod/ChunkLoader] Chunk [{rng.randrange(-999, 999)}, {rng.randrange(-999, 999)}] loaded with "
+                + "x" * rng.randrange(50, 400),
+        lambda: f"{rng.choice(names)} moved too quickly! {rng.random():.4f},{rng.random():.4f},{rng.random():.4f}",
+        lambda: "[" * rng.randrange(1, 5) + "Mixin] something something " * rng.randrange(1, 10),
+    ]
+    lines = []
+    for i in range(count):
+        if i % 500 == 0:
+            name = rng.choice(names)
+            lines.append(f"{name}[/127.0.0.1:{rng.randrange(1024, 65535)}] logged in with entity id {i} at (1.5, 64.0, -3.2)")
+        elif i % 500 == 250:
+            lines.append(f"{rng.choice(names)} left the game")
+        else:
+            lines.append(rng.choice(templates)())
+    return lines
+
+
+def read_logs(paths):
+    lines = []
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                lines.append(LOG_PREFIX.sub('', line.rstrip('\r\n'), count=1))
+    return lines
+
+
+def regex_only(server, info):
+    """前置过滤之前的实现，作为对照"""
+    if info.is_from_server:
+        if (m := plugin.LOGIN_PATTERN.fullmatch(info.content)) is not None:
+            plugin.player_joined(server, m['name'], m['ip'])
+        if (m := plugin.LEAVE_PATTERN.fullmatch(info.content)) is not None:
+            plugin.player_left(server, m['name'])
+
+
+def replay(handler, server, infos, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for info in infos:
+            handler(server, info)
+    return len(infos) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('logs', nargs='*', help='服务器日志文件')
+    parser.add_argument('--lines', type=int, default=200000, help='模拟日志的行数')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    lines = read_logs(args.logs) if args.logs else synthetic_log(args.lines, random.Random(0))
+    infos = [ReplayInfo(line) for line in lines]
+    server = _stubs.StubServer()
+    plugin.timer_manager = NullTimerManager()
+    plugin.predictor = NullPredictor()
+    plugin.wake_guard = NullWakeGuard()
+    plugin.fake_server_socket = IdleFakeServer()
+    
+    print(f"回放{len(infos)}行 x {args.repeat}次")
+    baseline = replay(regex_only, server, infos, args.repeat)
+    current = replay(plugin.on_info, server, infos, args.repeat)
+    print(f"仅正则      {baseline:>12,.0f} 行/秒")
+    print(f"前置过滤    {current:>12,.0f} 行/秒  {current / baseline:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+玩家过滤微基准：对比逐个正则fullmatch与PlayerFilter(集合+合并正则+LRU缓存)
+用法: python tools/bench_player_filter.py [--patterns N] [--players M] [--rounds R]
+"""
+import argparse
+import random
+import re
+import string
+import timeit
+
+import _stubs  # noqa: F401
+from hibernate_r_ex.player_filter import PlayerFilter
+
+
+def make_patterns(count, rng):
+    """一半纯文本名称，一半类似假人前缀的正则"""
+    patterns = []
+    for i in range(count):
+        if i % 2 == 0:
+            patterns.append(''.join(rng.choices(string.ascii_letters, k=10)))
+        else:
+            patterns.append(f"bot{i}_.*")
+    return patterns
+
+
+def make_players(count, patterns, rng):
+    players = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:  # 命中纯文本
+            players.append(patterns[rng.randrange(0, len(patterns), 2)])
+        elif kind == 1:  # 命中正则
+            players.append(f"bot{rng.randrange(1, len(patterns), 2)}_{i}")
+        else:  # 不命中
+            players.append(''.join(rng.choices(string.ascii_lowercase, k=12)))
+    return players
+
+
+def naive_split(names, compiled):
+    matched, unmatched = [], []
+    for name in names:
+        if any(p.fullmatch(name) for p in compiled):
+            matched.append(name)
+        else:
+            unmatched.append(name)
+    return matched, unmatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--patterns', type=int, default=500)
+    parser.add_argument('--players', type=int, default=60)
+    parser.add_argument('--rounds', type=int, default=200, help='模拟的检查次数')
+    args = parser.parse_args()
+    
+    rng = random.Random(0)
+    patterns = make_patterns(args.patterns, rng)
+    players = make_players(args.players, patterns, rng)
+    compiled = [re.compile(p) for p in patterns]
+    player_filter = PlayerFilter(patterns)
+    assert naive_split(players, compiled) == player_filter.split(players), "结果与逐个匹配不一致"
+    
+    cold = PlayerFilter(patterns)
+    naive = timeit.timeit(lambda: naive_split(players, compiled), number=args.rounds)
+    compiled_cold = timeit.timeit(lambda: (cold.matches.cache_clear(), cold.split(players)), number=args.rounds)
+    compiled_warm = timeit.timeit(lambda: player_filter.split(players), number=args.rounds)
+    
+    print(f"{args.patterns}条规则 x {args.players}名玩家，{args.rounds}次检查")
+    for name, elapsed in (("逐个fullmatch", naive), ("合并正则(无缓存)", compiled_cold), ("合并正则+LRU", compiled_warm)):
+        print(f"{name:<16}{elapsed / args.rounds * 1e6:>10.1f}us/次  {naive / elapsed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
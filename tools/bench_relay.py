@@ -0,0 +1,116 @@
+"""
+代理转发基准测试：对比直连与经过relay_sockets/relay_streams转发时的吞吐量和往返延迟
+用法: python tools/bench_relay.py [--size MB] [--rounds N] [--buffer BYTES]
+"""
+import argparse
+import asyncio
+import socket
+import statistics
+import threading
+import time
+
+import _stubs  # noqa: F401
+from hibernate_r_ex.proxy import relay_sockets, relay_streams
+
+
+def echo_server():
+    """本地回显服务器，代替后端"""
+    listener = socket.create_server(('127.0.0.1', 0))
+    
+    def serve(conn):
+        with conn:
+            while data := conn.recv(65536):
+                conn.sendall(data)
+    
+    def accept_loop():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+    
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def thread_relay(backend_port, buffer_size):
+    listener = socket.create_server(('127.0.0.1', 0))
+    
+    def accept_loop():
+        while True:
+            client, _ = listener.accept()
+            backend = socket.create_connection(('127.0.0.1', backend_port))
+            threading.Thread(target=relay_sockets, args=(client, backend, buffer_size), daemon=True).start()
+    
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def asyncio_relay(backend_port, buffer_size):
+    ready = threading.Event()
+    port = []
+    
+    async def handle(reader, writer):
+        backend_reader, backend_writer = await asyncio.open_connection('127.0.0.1', backend_port)
+        await relay_streams(reader, writer, backend_reader, backend_writer, buffer_size)
+        backend_writer.close()
+        writer.close()
+    
+    async def main():
+        listener = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port.append(listener.sockets[0].getsockname()[1])
+        ready.set()
+        await asyncio.Event().wait()
+    
+    threading.Thread(target=asyncio.run, args=(main(),), daemon=True).start()
+    ready.wait()
+    return port[0]
+
+
+def measure(port, size, rounds):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # 往返延迟：小包ping-pong
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        sock.sendall(b'p' * 32)
+        received = 0
+        while received < 32:
+            received += len(sock.recv(64))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    # 吞吐量：一边发送一边接收回显
+    payload = b'x' * 65536
+    sender = threading.Thread(target=lambda: [sock.sendall(payload) for _ in range(size // len(payload))])
+    start = time.perf_counter()
+    sender.start()
+    received = 0
+    while received < size // len(payload) * len(payload):
+        received += len(sock.recv(262144))
+    elapsed = time.perf_counter() - start
+    sender.join()
+    sock.close()
+    return statistics.median(latencies), sorted(latencies)[int(len(latencies) * 0.99)], received / elapsed / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help='吞吐量测试的数据量(MB)')
+    parser.add_argument('--rounds', type=int, default=2000, help='延迟测试的往返次数')
+    parser.add_argument('--buffer', type=int, default=65536, help='转发缓冲区大小(proxy_buffer_size)')
+    args = parser.parse_args()
+    
+    backend_port = echo_server()
+    targets = [
+        ('direct', backend_port),
+        ('thread relay', thread_relay(backend_port, args.buffer)),
+        ('asyncio relay', asyncio_relay(backend_port, args.buffer)),
+    ]
+    base_p50 = None
+    print(f"{'mode':<14}{'p50 rtt(us)':>12}{'p99 rtt(us)':>12}{'added(us)':>11}{'MB/s':>10}")
+    for name, port in targets:
+        p50, p99, throughput = measure(port, args.size * 1024 * 1024, args.rounds)
+        base_p50 = p50 if base_p50 is None else base_p50
+        print(f"{name:<14}{p50:>12.1f}{p99:>12.1f}{p50 - base_p50:>11.1f}{throughput:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+到达预测离线评估：读取插件记录的登录历史，逐周用之前的历史建立模型，在该周内模拟预热和推迟停服，报告命中率
+用法: python tools/eval_prediction.py <join_history.bin> [--lead 300] [--threshold 0.5] [--bucket-min 15] [--defer 600] [--max-defer 1800] [--wait 600] [--min-weeks 2]
+"""
+import argparse
+import bisect
+import time
+
+import _stubs  # noqa: F401
+from hibernate_r_ex.prediction import EVENT_ARRIVAL, EVENT_LEAVE, WEEK, PREWARM_CHECK_INTERVAL, ArrivalModel, JoinHistory
+
+
+def evaluate_prewarm(model, arrivals, start, end, args):
+    """按插件的检查间隔模拟预热，返回(被预热覆盖的到达数, 预热次数, 无人到达的预热次数)"""
+    covered = set()
+    triggers = wasted = 0
+    hold_until = 0
+    now = start
+    while now < end:
+        window_start = now + args.lead
+        window_end = window_start + model.bucket_sec
+        if now >= hold_until and model.probability(window_start, window_end, now) >= args.threshold:
+            triggers += 1
+            hold_until = window_end + args.defer
+            # 预热后服务器至少保持到时间窗结束后的推迟期，期间的到达都不用等待启动
+            first = bisect.bisect_left(arrivals, now + args.lead)
+            last = bisect.bisect_left(arrivals, hold_until)
+            if first == last:
+                wasted += 1
+            covered.update(range(first, last))
+        now += PREWARM_CHECK_INTERVAL
+    in_range = [i for i in covered if start <= arrivals[i] < end]
+    return len(in_range), triggers, wasted
+
+
+def evaluate_defer(model, events, arrivals, start, end, args):
+    """对每次最后一名玩家离开的停服时刻判断是否推迟，返回(推迟后等到玩家, 推迟但无人加入, 未推迟但很快有人加入)"""
+    useful = wasted = missed = 0
+    for index, (timestamp, kind) in enumerate(events):
+        if kind != EVENT_LEAVE or not start <= timestamp < end:
+            continue
+        if index + 1 < len(events) and events[index + 1][1] != EVENT_ARRIVAL:
+            continue  # 之后不是到达，说明离开后仍有玩家在线
+        stop_at = timestamp + args.wait
+        next_arrival = arrivals[bisect.bisect_right(arrivals, timestamp)] if arrivals[-1] > timestamp else None
+        if next_arrival is not None and next_arrival <= stop_at:
+            continue  # 等待期间已有玩家加入，不会停服
+        deferred = 0
+        while deferred < args.max_defer and model.probability(stop_at + deferred, stop_at + deferred + args.defer) >= args.threshold:
+            deferred += min(args.defer, args.max_defer - deferred)
+        if deferred:
+            if next_arrival is not None and next_arrival <= stop_at + deferred:
+                useful += 1
+            else:
+                wasted += 1
+        elif next_arrival is not None and next_arrival <= stop_at + args.defer:
+            missed += 1
+    return useful, wasted, missed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('history')
+    parser.add_argument('--lead', type=int, default=300)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--bucket-min', type=int, default=15)
+    parser.add_argument('--defer', type=int, default=600)
+    parser.add_argument('--max-defer', type=int, default=1800)
+    parser.add_argument('--wait', type=int, default=600, help='配置中的wait_sec')
+    parser.add_argument('--min-weeks', type=int, default=2)
+    args = parser.parse_args()
+    
+    events = sorted(JoinHistory(args.history, retention_days=10 ** 5).events)
+    arrivals = [timestamp for timestamp, kind in events if kind == EVENT_ARRIVAL]
+    if not arrivals:
+        print("历史中没有到达记录")
+        return
+    
+    first = events[0][0]
+    week_start = first + args.min_weeks * WEEK
+    columns = ("arrivals", "covered", "triggers", "wasted", "useful", "defer_wasted", "missed")
+    totals = dict.fromkeys(columns, 0)
+    print(f"记录{len(events)}条，到达{len(arrivals)}次，时间 {time.strftime('%Y-%m-%d', time.localtime(first))} ~ "
+          f"{time.strftime('%Y-%m-%d', time.localtime(events[-1][0]))}")
+    print(f"{'评估周':<12}{'到达':>6}{'预热覆盖':>10}{'预热次数':>10}{'空预热':>8}{'推迟有效':>10}{'推迟无效':>10}{'漏推迟':>8}")
+    while week_start <= events[-1][0]:
+        week_end = week_start + WEEK
+        model = ArrivalModel.build([event for event in events if event[0] < week_start], args.bucket_min * 60)
+        week_arrivals = sum(1 for timestamp in arrivals if week_start <= timestamp < week_end)
+        row = (week_arrivals,
+               *evaluate_prewarm(model, arrivals, week_start, week_end, args),
+               *evaluate_defer(model, events, arrivals, week_start, week_end, args))
+        for name, value in zip(columns, row):
+            totals[name] += value
+        print(f"{time.strftime('%Y-%m-%d', time.localtime(week_start)):<12}{row[0]:>6}{row[1]:>10}{row[2]:>10}"
+              f"{row[3]:>8}{row[4]:>10}{row[5]:>10}{row[6]:>8}")
+        week_start = week_end
+    
+    print(f"预热命中率: {totals['covered'] / max(totals['arrivals'], 1):.1%}"
+          f"（{totals['covered']}/{totals['arrivals']}次到达无需等待启动），"
+          f"预热准确率: {(totals['triggers'] - totals['wasted']) / max(totals['triggers'], 1):.1%}")
+    print(f"推迟停服: 有效{totals['useful']}次，无效{totals['defer_wasted']}次，漏推迟{totals['missed']}次")
+
+
+if __name__ == '__main__':
+    main()
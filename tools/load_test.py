@@ -0,0 +1,193 @@
+"""
+伪装服务器压力测试：在本地启动FakeServerSocket，用N个并发客户端持续发送
+新版握手+状态+ping、1.6旧版ping、畸形数据包和空闲连接，报告吞吐量与状态请求延迟分位数
+用法: python tools/load_test.py [--mode thread|asyncio] [--clients N] [--duration S] [--mix status=90,legacy=5,...]
+"""
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import time
+
+import _stubs
+from hibernate_r_ex.byte_utils import write_varint, write_utf, write_ushort, write_long, PacketFramer
+from hibernate_r_ex.FakeServer import FakeServerSocket
+
+SCENARIOS = ("status", "legacy", "malformed", "idle")
+
+
+def build_packet(packet_id, payload=b''):
+    body = bytearray()
+    write_varint(body, packet_id)
+    body += payload
+    packet = bytearray()
+    write_varint(packet, len(body))
+    return bytes(packet + body)
+
+
+def build_handshake(protocol, host, port, state):
+    payload = bytearray()
+    write_varint(payload, protocol)
+    write_utf(payload, host)
+    write_ushort(payload, port)
+    write_varint(payload, state)
+    return build_packet(0x00, payload)
+
+
+async def read_packet(reader, framer):
+    while (packet := framer.next_packet()) is None:
+        data = await reader.read(65536)
+        if not data:
+            raise ConnectionError("连接已关闭")
+        framer.feed(data)
+    return packet
+
+
+async def run_status(host, port, rng):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        framer = PacketFramer()
+        writer.write(build_handshake(rng.choice((47, 340, 767, 769)), host, port, 1) + build_packet(0x00))
+        status = await read_packet(reader, framer)
+        if status.read_varint() != 0x00:
+            raise ValueError("状态响应ID错误")
+        payload = bytearray()
+        write_long(payload, rng.getrandbits(63))
+        writer.write(build_packet(0x01, payload))
+        pong = await read_packet(reader, framer)
+        if pong.read_varint() != 0x01 or pong.read_long() != struct.unpack(">q", payload)[0]:
+            raise ValueError("pong不匹配")
+    finally:
+        writer.close()
+
+
+async def run_legacy(host, port, rng):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(b'\xfe\x01\xfa')
+        if (await reader.readexactly(3))[0] != 0xFF:
+            raise ValueError("旧版ping响应错误")
+    finally:
+        writer.close()
+
+
+async def run_malformed(host, port, rng):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        kind = rng.randrange(3)
+        if kind == 0:  # 随机数据
+            writer.write(rng.randbytes(rng.randrange(1, 64)))
+        elif kind == 1:  # 长度超过上限
+            writer.write(b'\xff\xff\x7f' + b'\x00' * 16)
+        else:  # 错误的状态
+            writer.write(build_handshake(767, host, port, 9))
+        await asyncio.wait_for(reader.read(), 15)  # 等待服务器断开
+    finally:
+        writer.close()
+
+
+async def run_idle(host, port, rng, idle_sec):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await asyncio.wait_for(reader.read(), idle_sec)  # 服务器应主动断开空闲连接
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+
+
+class Results:
+    def __init__(self):
+        self.ok = {name: 0 for name in SCENARIOS}
+        self.failed = {name: 0 for name in SCENARIOS}
+        self.status_latency = []
+    
+    def percentile(self, p):
+        if not self.status_latency:
+            return float('nan')
+        data = sorted(self.status_latency)
+        return data[min(int(len(data) * p), len(data) - 1)] * 1000
+
+
+async def client_loop(host, port, deadline, mix, results, seed, idle_sec):
+    rng = random.Random(seed)
+    names, weights = zip(*mix.items())
+    while time.perf_counter() < deadline:
+        scenario = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            if scenario == "status":
+                await run_status(host, port, rng)
+                results.status_latency.append(time.perf_counter() - start)
+            elif scenario == "legacy":
+                await run_legacy(host, port, rng)
+            elif scenario == "malformed":
+                await run_malformed(host, port, rng)
+            else:
+                await run_idle(host, port, rng, idle_sec)
+            results.ok[scenario] += 1
+        except Exception:  # 连接被拒绝、超时或响应错误
+            results.failed[scenario] += 1
+
+
+async def drive(host, port, clients, duration, mix, idle_sec):
+    results = Results()
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client_loop(host, port, deadline, mix, results, i, idle_sec) for i in range(clients)))
+    return results
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"未知场景: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', choices=('thread', 'asyncio', 'process'), default='asyncio', help='listener_mode')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix("status=90,legacy=4,malformed=4,idle=2"))
+    parser.add_argument('--idle-sec', type=float, default=30, help='空闲客户端最长保持时间')
+    parser.add_argument('--admission', action='store_true', help='使用默认的准入控制配置(默认关闭限制以测量原始性能)')
+    args = parser.parse_args()
+    
+    port = free_port()
+    config = {'listener_mode': args.mode, 'ip': '127.0.0.1', 'port': port, 'server_icon': ''}
+    if not args.admission:
+        config.update(fs_ip_rate_per_min=10 ** 9, fs_ip_burst=10 ** 9, fs_max_connections=10 ** 6)
+    server = _stubs.StubServer(config)
+    _stubs.load_plugin_config(server)
+    fake_server = FakeServerSocket(server)
+    fake_server.start(server, lambda s: None)
+    time.sleep(0.5)
+    
+    start = time.perf_counter()
+    results = asyncio.run(drive('127.0.0.1', port, args.clients, args.duration, args.mix, args.idle_sec))
+    elapsed = time.perf_counter() - start
+    fake_server.stop(server)
+    
+    total_ok = sum(results.ok.values())
+    print(f"模式={args.mode} 客户端={args.clients} 用时={elapsed:.1f}s")
+    for name in SCENARIOS:
+        if name in args.mix:
+            print(f"  {name:<10} 成功{results.ok[name]:>8} 失败{results.failed[name]:>6}")
+    print(f"吞吐量: {total_ok / elapsed:.0f} 连接/秒，状态请求 {results.ok['status'] / elapsed:.0f} 次/秒")
+    print(f"状态延迟: p50={results.percentile(0.5):.2f}ms p99={results.percentile(0.99):.2f}ms "
+          f"p999={results.percentile(0.999):.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,439 @@
+"""
+休眠策略回放模拟：用虚拟时钟把服务器日志中的玩家进出按原时间回放给插件，报告服务器运行时长、启动次数和玩家等待时间
+用法: python tools/simulate.py [latest.log 2024-01-01-1.log.gz ...] [--days 7] [--wait 600] [--probe 5] [--boot 60] [--stop 10] [--set key=value ...]
+不指定日志文件时生成一周的模拟进出记录；--set可覆盖任意配置项，值按JSON解析，例如 --set 'blacklist_player=["^bot_"]'
+"""
+import argparse
+import bisect
+import datetime
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+from typing import NamedTuple
+
+import _stubs
+import minecraft_data_api as api
+import hibernate_r_ex as plugin
+from hibernate_r_ex import timer
+from hibernate_r_ex.lifecycle import Lifecycle, STATE_HIBERNATED
+from hibernate_r_ex.players import PlayerTracker
+from hibernate_r_ex.prediction import Predictor
+from hibernate_r_ex.scheduler import Scheduler
+from hibernate_r_ex.thrash import WakeGuard
+from hibernate_r_ex.timer import TimerManager
+
+DAY = 86400
+# 原版/Paper的"[12:34:56] [Server thread/INFO]: "和Forge的"[01Jan2024 12:34:56.789] [Server thread/INFO] [minecraft/...]: "
+LOG_LINE = re.compile(r'^\[(?:(?P<date>\d{2}[A-Za-z]{3}\d{4}) )?(?P<time>\d{2}:\d{2}:\d{2})[^\]]*\] \[[^\]]*\](?: \[[^\]]*\])?: (?P<content>.*)$')
+LOG_FILE_DATE = re.compile(r'(\d{4}-\d{2}-\d{2})-\d+\.log')
+
+
+class Session(NamedTuple):
+    arrival: float  # 日志中的加入时间
+    name: str
+    ip: str
+    duration: float  # 在线时长
+
+
+class VirtualClock:
+    """模拟用的时钟，同时代替time.time和time.monotonic"""
+    
+    def __init__(self, now):
+        self.now = now
+    
+    def __call__(self):
+        return self.now
+
+
+def read_log(path):
+    """读取一个服务器日志文件，返回[(时间戳, 日志内容)]，日期取自文件名，latest.log取文件修改日期"""
+    match = LOG_FILE_DATE.search(os.path.basename(path))
+    if match is not None:
+        day = datetime.datetime.strptime(match.group(1), "%Y-%m-%d")
+    else:
+        day = datetime.datetime.fromtimestamp(os.path.getmtime(path)).replace(hour=0, minute=0, second=0, microsecond=0)
+    opener = gzip.open if path.endswith('.gz') else open
+    lines = []
+    last = None
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            m = LOG_LINE.match(line.rstrip('\r\n'))
+            if m is None:
+                continue
+            if m['date']:
+                day = datetime.datetime.strptime(m['date'], "%d%b%Y")
+            clock = datetime.datetime.strptime(m['time'], "%H:%M:%S").time()
+            stamp = datetime.datetime.combine(day.date(), clock).timestamp()
+            if last is not None and not m['date'] and stamp < last - 3600:  # 跨过午夜
+                day += datetime.timedelta(days=1)
+                stamp += DAY
+            last = stamp
+            lines.append((stamp, m['content']))
+    return lines
+
+
+def sessions_from_logs(paths):
+    """按玩家名把登录和之后的第一次离开配对为在线会话，没有离开记录的会话在该文件最后一行结束"""
+    sessions = []
+    for path in paths:
+        lines = read_log(path)
+        online = {}  # 玩家名 -> (加入时间, ip)
+        for stamp, content in lines:
+            if (m := plugin.LOGIN_PATTERN.fullmatch(content)) is not None:
+                online.setdefault(m['name'], (stamp, m['ip']))
+            elif (m := plugin.LEAVE_PATTERN.fullmatch(content)) is not None and m['name'] in online:
+                start, ip = online.pop(m['name'])
+                sessions.append(Session(start, m['name'], ip, stamp - start))
+        end = lines[-1][0] if lines else 0
+        sessions.extend(Session(start, name, ip, end - start) for name, (start, ip) in online.items())
+    return sorted(sessions)
+
+
+def synthetic_sessions(days, rng):
+    """生成模拟的进出记录：几名玩家主要在晚上游玩，偶尔在白天短暂上线，部分玩家会召唤假人"""
+    start = datetime.datetime(2024, 1, 1)  # 固定日期，同一个种子的结果可以复现
+    sessions = []
+    for day in range(days):
+        midnight = (start + datetime.timedelta(days=day)).timestamp()
+        for index in range(6):
+            name = f"Player{index}"
+            ip = f"/10.0.0.{index + 1}:{rng.randrange(1024, 65535)}"
+            if rng.random() < 0.6:
+                arrival = midnight + rng.gauss(20.5, 1.5) * 3600
+                duration = max(rng.expovariate(1 / 5400), 60)
+                sessions.append(Session(arrival, name, ip, duration))
+                if rng.random() < 0.3:  # 假人由在线玩家召唤
+                    sessions.append(Session(arrival + 120, f"bot_{name}", "local", duration - 180))
+            if rng.random() < 0.2:
+                sessions.append(Session(midnight + rng.uniform(9, 17) * 3600, name, ip, rng.uniform(30, 600)))
+    return sorted(session for session in sessions if session.duration > 0)
+
+
+class SimFakeServer:
+    """代替伪装服务器：不监听端口，只模拟登录请求的唤醒和拒绝"""
+    
+    def __init__(self):
+        self.fs_is_running = False
+        self.booting = False
+        self.wake_guard = None
+        self.player_rule = None
+        self._start_server = None
+    
+    def start(self, server, start_server):
+        if self.fs_is_running or server.is_server_running():
+            return False
+        self.fs_is_running = True
+        self._start_server = start_server
+        return True
+    
+    def stop(self, server):
+        self.fs_is_running = False
+        return True
+    
+    def login(self, server, name, ip):
+        """玩家连接伪装服务器，返回是否唤醒了服务器"""
+        if self.player_rule is not None and not self.player_rule(name):
+            return False
+        if self.wake_guard is not None:
+            if self.wake_guard.refused(name, ip) > 0:
+                return False
+            self.wake_guard.record_wake(name, ip)
+        self.fs_is_running = False  # 收到登录请求后监听退出，再请求启动服务器
+        self._start_server(server)
+        return True
+    
+    def enter_boot(self, server):
+        return False
+    
+    def end_boot(self):
+        pass
+    
+    def backend_ready(self, server):
+        pass
+    
+    def backend_stopped(self, server):
+        pass
+    
+    def refresh_status(self, server):
+        pass
+    
+    def reload_config(self, server):
+        pass
+
+
+class SimServer(_stubs.StubServer):
+    """模拟的服务器进程：启动和关闭按配置的耗时在虚拟时钟上完成，并调用插件的服务器事件"""
+    
+    def __init__(self, simulation, config, boot_sec, stop_sec, log_level):
+        super().__init__(config, log_level)
+        self.simulation = simulation
+        self.boot_sec = boot_sec
+        self.stop_sec = stop_sec
+        self.stopping = False
+        self.up_since = None
+        self.uptime = []  # [(启动时间, 关闭时间)]
+    
+    def start(self):
+        if self.running:
+            return False
+        self.start_count += 1
+        self.running = True
+        self.up_since = self.simulation.clock()
+        plugin.on_server_start(self)
+        self.simulation.call_later(self.boot_sec, self._started)
+        return True
+    
+    def _started(self):
+        if not self.running or self.stopping:
+            return
+        self.startup = True
+        plugin.on_server_startup(self)
+    
+    def stop(self):
+        if not self.running or self.stopping:
+            return False
+        self.stop_count += 1
+        self.stopping = True
+        self.simulation.call_later(self.stop_sec, self._stopped)
+        return True
+    
+    def _stopped(self):
+        self.running = self.startup = self.stopping = False
+        self.uptime.append((self.up_since, self.simulation.clock()))
+        self.up_since = None
+        self.simulation.disconnect_all()
+        plugin.on_server_stop(self, 0)
+    
+    def get_data_folder(self):
+        return self.simulation.data_folder
+
+
+class Simulation:
+    """
+    在虚拟时钟上回放在线会话：调度器和生命周期执行器不启动线程，每推进到一个事件时刻就执行到期的任务
+    玩家在服务器未就绪时排队等待，伪装服务器监听时由队首玩家的登录请求唤醒服务器
+    """
+    
+    def __init__(self, sessions, overrides, args):
+        self.clock = VirtualClock(sessions[0].arrival - 1)
+        self.data_folder = tempfile.mkdtemp(prefix="hr_simulate_")
+        self._events = []  # (时间, 序号, 回调, 参数)
+        self._seq = itertools.count()
+        self.online = {}  # 玩家名 -> 预计离开时间
+        self.waiting = []  # [(到达时间, 会话)]
+        self.waits = []  # [(到达时间, 等待秒数)]，非假人玩家每次到达一条
+        self.rejected = []  # 被拒绝唤醒的到达时间
+        self.skipped_bots = 0
+        
+        config = {"proxy_mode": False, "boot_status": False, "online_auth": False, "metrics_port": 0,
+                  "config_watch_sec": 0, "start_wait_sec": 0, "wait_sec": args.wait}
+        config.update(overrides)
+        self.server = SimServer(self, config, args.boot, args.stop, logging.INFO if args.verbose else logging.WARNING)
+        plugin_config = _stubs.load_plugin_config(self.server)
+        timer.PROBE_DELAY = args.probe
+        
+        # 按插件on_load的方式组装，时钟和调度器换成模拟的
+        self.scheduler = Scheduler(self.server.logger, clock=self.clock, threaded=False)
+        self.lifecycle = Lifecycle(self.server.logger, STATE_HIBERNATED, clock=self.clock, threaded=False)
+        plugin.player_tracker = PlayerTracker(clock=self.clock)
+        plugin.timer_manager = TimerManager(self.server, plugin.player_tracker, scheduler=self.scheduler, threaded=False)
+        plugin.predictor = Predictor(self.server, self.scheduler, plugin_config, clock=self.clock)
+        plugin.timer_manager.predictor = plugin.predictor
+        plugin.wake_guard = WakeGuard(plugin_config, clock=self.clock)
+        plugin.timer_manager.wake_guard = plugin.wake_guard
+        plugin.fake_server_socket = SimFakeServer()
+        plugin.fake_server_socket.wake_guard = plugin.wake_guard
+        plugin.fake_server_socket.player_rule = plugin.timer_manager.counts_as_player
+        plugin.lifecycle = self.lifecycle
+        plugin.fake_server_socket.start(self.server, plugin.start_server)
+        plugin.predictor.start_prewarm(plugin.predicted_wakeup)
+        
+        for session in sessions:
+            self.call_at(session.arrival, self._arrive, session)
+    
+    def call_at(self, when, callback, *args):
+        heapq.heappush(self._events, (when, next(self._seq), callback, args))
+    
+    def call_later(self, delay, callback, *args):
+        self.call_at(self.clock() + delay, callback, *args)
+    
+    def run(self, end):
+        while True:
+            self._settle()
+            deadlines = [self._events[0][0]] if self._events else []
+            if (deadline := self.scheduler.next_deadline()) is not None:
+                deadlines.append(deadline)
+            if not deadlines or min(deadlines) > end:
+                break
+            self.clock.now = max(self.clock.now, min(deadlines))
+            while self._events and self._events[0][0] <= self.clock.now:
+                _, _, callback, args = heapq.heappop(self._events)
+                callback(*args)
+        self.clock.now = end
+        if self.server.up_since is not None:
+            self.server.uptime.append((self.server.up_since, end))
+        for arrival, _ in self.waiting:  # 模拟结束时仍在等待的玩家
+            self.waits.append((arrival, end - arrival))
+    
+    def _settle(self):
+        """执行到期的定时任务、生命周期命令和排队玩家的登录，直到没有新的动作产生"""
+        while self.scheduler.run_pending() + self.lifecycle.run_pending() + self._admit_waiting():
+            pass
+    
+    def ready(self):
+        """服务器启动完成且没有正在关闭，玩家可以直接进入"""
+        return self.server.startup and not self.server.stopping
+    
+    def _admit_waiting(self):
+        if not self.waiting:
+            return 0
+        if self.ready():
+            waiting, self.waiting = self.waiting, []
+            for arrival, session in waiting:
+                self.waits.append((arrival, self.clock() - arrival))
+                self._join(session)
+            return len(waiting)
+        if self.server.running or not plugin.fake_server_socket.fs_is_running:
+            return 0
+        arrival, session = self.waiting[0]
+        if not plugin.fake_server_socket.login(self.server, session.name, session.ip):
+            self.waiting.pop(0)
+            self.rejected.append(arrival)
+        return 1
+    
+    def _arrive(self, session):
+        if session.ip == "local":  # 假人只能在服务器运行时由玩家召唤
+            if self.ready():
+                self._join(session)
+            else:
+                self.skipped_bots += 1
+            return
+        if self.ready() and not self.waiting:
+            self.waits.append((self.clock(), 0.0))
+            self._join(session)
+        else:
+            self.waiting.append((self.clock(), session))
+    
+    def _join(self, session):
+        leave_at = self.clock() + session.duration
+        if session.name in self.online:  # 上一次会话因等待推迟后与本次重叠，合并为一次
+            self.online[session.name] = max(self.online[session.name], leave_at)
+        else:
+            self.online[session.name] = leave_at
+            self._log(f"{session.name}[{session.ip}] logged in with entity id 0 at (0.5, 64.0, 0.5)")
+        self.call_at(self.online[session.name], self._leave, session.name)
+    
+    def _leave(self, name):
+        if self.online.get(name) == self.clock():
+            del self.online[name]
+            self._log(f"{name} left the game")
+    
+    def disconnect_all(self):
+        """服务器关闭时仍在线的玩家(假人或规则外的玩家)直接断开，不再产生离开日志"""
+        self.online.clear()
+        api.online_players = []
+    
+    def _log(self, content):
+        api.online_players = list(self.online)
+        plugin.on_info(self.server, _ReplayInfo(content))
+
+
+class _ReplayInfo:
+    def __init__(self, content):
+        self.content = content
+        self.is_from_server = True
+
+
+def uptime_by_day(intervals, days):
+    """把运行区间按本地日期切分，返回{日期: 秒数}"""
+    result = dict.fromkeys(days, 0.0)
+    for start, end in intervals:
+        while start < end:
+            day = datetime.date.fromtimestamp(start)
+            midnight = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()).timestamp()
+            result[day] = result.get(day, 0.0) + min(end, midnight) - start
+            start = midnight
+    return result
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def parse_overrides(items):
+    overrides = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('logs', nargs='*')
+    parser.add_argument('--days', type=int, default=7, help='只回放历史的前N天')
+    parser.add_argument('--wait', type=int, default=600, help='配置中的wait_sec')
+    parser.add_argument('--probe', type=float, default=timer.PROBE_DELAY, help='最后一名玩家离开后到检查在线玩家的秒数')
+    parser.add_argument('--boot', type=float, default=60, help='服务器启动耗时(秒)')
+    parser.add_argument('--stop', type=float, default=10, help='服务器关闭耗时(秒)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='覆盖配置项')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help='输出插件日志')
+    args = parser.parse_args()
+    
+    sessions = sessions_from_logs(args.logs) if args.logs else synthetic_sessions(args.days, random.Random(args.seed))
+    if not sessions:
+        print("日志中没有玩家进出记录")
+        return
+    first_day = datetime.date.fromtimestamp(sessions[0].arrival)
+    start = datetime.datetime.combine(first_day, datetime.time()).timestamp()
+    end = start + args.days * DAY
+    sessions = [session for session in sessions if session.arrival < end]
+    
+    simulation = Simulation(sessions, parse_overrides(args.set), args)
+    began = time.perf_counter()
+    simulation.run(end)
+    elapsed = time.perf_counter() - began
+    server = simulation.server
+    
+    days = [first_day + datetime.timedelta(days=i) for i in range(args.days)]
+    uptime = uptime_by_day(server.uptime, days)
+    boots = [boot for boot, _ in server.uptime]
+    print(f"回放{len(sessions)}次会话，{first_day} ~ {days[-1]}，wait_sec={args.wait}，探测{args.probe:g}s，"
+          f"启动{args.boot:g}s，模拟耗时{elapsed:.2f}s")
+    print(f"{'日期':<12}{'运行(h)':>9}{'启动次数':>10}{'到达':>6}{'需等待':>8}{'平均等待':>10}{'最长等待':>10}")
+    for day in days:
+        day_start = datetime.datetime.combine(day, datetime.time()).timestamp()
+        waits = [wait for arrival, wait in simulation.waits if day_start <= arrival < day_start + DAY]
+        waited = [wait for wait in waits if wait > 0]
+        day_boots = bisect.bisect_left(boots, day_start + DAY) - bisect.bisect_left(boots, day_start)
+        print(f"{str(day):<12}{uptime.get(day, 0.0) / 3600:>9.1f}{day_boots:>10}{len(waits):>6}{len(waited):>8}"
+              f"{sum(waited) / max(len(waited), 1):>9.0f}s{max(waited, default=0):>9.0f}s")
+    
+    total_uptime = sum(uptime.values())
+    waits = [wait for _, wait in simulation.waits]
+    waited = [wait for wait in waits if wait > 0]
+    print(f"运行时长: {total_uptime / 3600:.1f}h（{total_uptime / (end - start):.1%}），启动{server.start_count}次，"
+          f"关闭{server.stop_count}次")
+    print(f"玩家到达{len(waits)}次，需等待启动{len(waited)}次，等待时间 平均{sum(waited) / max(len(waited), 1):.0f}s "
+          f"p50 {percentile(waited, 0.5):.0f}s p90 {percentile(waited, 0.9):.0f}s 最长{max(waited, default=0):.0f}s，"
+          f"累计{sum(waited) / 60:.0f}min")
+    if simulation.rejected or simulation.skipped_bots:
+        print(f"被拒绝唤醒{len(simulation.rejected)}次，服务器未运行时的假人{simulation.skipped_bots}次")
+
+
+if __name__ == '__main__':
+    main()